@@ -0,0 +1,61 @@
+"""
+Сравнение скорости записи: построчные хелперы db.py против insert_many_async / update_many_async.
+
+Запуск из корня проекта:
+    python -m benchmarks.db_bulk [количество_строк]
+
+Работает на временной базе, рабочую базу из конфига не трогает.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from modules.utils import db
+
+COLUMNS = ['user_id', 'product_id', 'step', 'paid']
+
+
+async def prepare_table() -> None:
+    if await db.table_exists('purchased'):
+        await db.clear_table('purchased')
+    await db.creator(table='purchased', column_types={'user_id': 'INTEGER', 'product_id': 'INTEGER',
+                                                      'step': 'TEXT', 'paid': 'INTEGER'})
+
+
+async def measure(title: str, rows_count: int, coro) -> None:
+    started = time.perf_counter()
+    await coro
+    elapsed = time.perf_counter() - started
+    print(f"{title:<40} {rows_count:>8} строк  {elapsed:8.3f} c  {rows_count / elapsed:12.0f} строк/с")
+
+
+async def run(rows_count: int) -> None:
+    rows = [(user_id, 1, 'create_link', 0) for user_id in range(rows_count)]
+    updates = [('success_check', 1, user_id, 1) for user_id in range(rows_count)]
+
+    async def insert_per_row():
+        for row in rows:
+            await db.insert_async(COLUMNS, list(row), 'purchased')
+
+    async def update_per_row():
+        for step, paid, user_id, product_id in updates:
+            await db.update_generic_async('purchased', ['step', 'paid'], [step, paid],
+                                          user_id=user_id, product_id=product_id)
+
+    await prepare_table()
+    await measure('insert_async (по одной строке)', rows_count, insert_per_row())
+    await measure('update_generic_async (по одной строке)', rows_count, update_per_row())
+
+    await prepare_table()
+    await measure('insert_many_async', rows_count, db.insert_many_async(COLUMNS, rows, 'purchased'))
+    await measure('update_many_async', rows_count,
+                  db.update_many_async('purchased', ['step', 'paid'], ['user_id', 'product_id'], updates))
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db.DB_NAME = os.path.join(tmp_dir, 'bench.db')
+        asyncio.run(run(count))
@@ -0,0 +1,114 @@
+"""
+Сравнение get_extreme_date_records: прежняя версия (два запроса и список NOT IN)
+против одного запроса с UNION ALL, без индекса и с индексом (user_id, category, date).
+
+Запуск из корня проекта:
+    python -m benchmarks.extreme_dates [количество_строк] [количество_вызовов]
+
+Работает на временной базе, рабочую базу из конфига не трогает.
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import aiosqlite
+
+from modules.utils import db
+from modules.utils.schema import extreme_date_index
+
+TABLE = 'records'
+COLUMNS = ['user_id', 'category', 'date', 'file_link', 'unique_num']
+USERS = 1000
+CATEGORIES = ['video', 'photo', 'audio', 'text']
+
+
+async def legacy_get_extreme_date_records(table, user_id, category, limit=10):
+    """Реализация до перехода на один запрос - для сравнения."""
+    async with aiosqlite.connect(db.DB_NAME) as conn:
+        conn.row_factory = aiosqlite.Row
+        where_clause = "user_id = ? AND category = ? AND file_link IS NOT NULL"
+        values = [user_id, category]
+
+        cur_before = await conn.execute(
+            f"SELECT * FROM {table} WHERE {where_clause} ORDER BY date ASC LIMIT 1", values)
+        before_records = [db.DatabaseRow(dict(r)) for r in await cur_before.fetchall()]
+        await cur_before.close()
+
+        if before_records:
+            before_ids = [record["unique_num"] for record in before_records]
+            query_after = (f"SELECT * FROM {table} WHERE {where_clause} "
+                           f"AND unique_num NOT IN ({', '.join('?' for _ in before_ids)}) "
+                           f"ORDER BY date DESC LIMIT {limit}")
+            after_values = values + before_ids
+        else:
+            query_after = f"SELECT * FROM {table} WHERE {where_clause} ORDER BY date DESC LIMIT {limit}"
+            after_values = values
+        cur_after = await conn.execute(query_after, after_values)
+        after_records = [db.DatabaseRow(dict(r)) for r in await cur_after.fetchall()]
+        await cur_after.close()
+        return before_records, after_records
+
+
+async def fill_table(rows_count: int) -> None:
+    await db.creator(table=TABLE, column_types={'user_id': 'INTEGER', 'category': 'TEXT', 'date': 'TEXT',
+                                                'file_link': 'TEXT', 'unique_num': 'INTEGER'})
+    start = date(2020, 1, 1)
+    rnd = random.Random(1)
+
+    def rows():
+        for num in range(rows_count):
+            yield (rnd.randrange(USERS), rnd.choice(CATEGORIES),
+                   (start + timedelta(days=rnd.randrange(2000))).isoformat(),
+                   None if num % 10 == 0 else f'file_{num}', num)
+
+    await db.insert_many_async(COLUMNS, rows(), TABLE, chunk_size=5000)
+
+
+async def measure(title: str, fn, calls: int) -> None:
+    rnd = random.Random(2)
+    args = [(rnd.randrange(USERS), rnd.choice(CATEGORIES)) for _ in range(calls)]
+    started = time.perf_counter()
+    for user_id, category in args:
+        await fn(TABLE, user_id, category)
+    elapsed = time.perf_counter() - started
+    print(f"{title:<45} {calls:>6} вызовов  {elapsed:8.3f} c  {elapsed / calls * 1000:8.3f} мс/вызов")
+
+
+async def check_parity(calls: int = 50) -> None:
+    rnd = random.Random(3)
+    for _ in range(calls):
+        user_id, category = rnd.randrange(USERS), rnd.choice(CATEGORIES)
+        old = await legacy_get_extreme_date_records(TABLE, user_id, category)
+        new = await db.get_extreme_date_records(TABLE, user_id, category)
+        # Порядок внутри одинаковых дат не определен - сравниваем даты и количество
+        assert [r['date'] for r in old[0]] == [r['date'] for r in new[0]], (user_id, category)
+        assert [r['date'] for r in old[1]] == [r['date'] for r in new[1]], (user_id, category)
+
+
+async def run(rows_count: int, calls: int) -> None:
+    print(f"Заполняем таблицу: {rows_count} строк...")
+    await fill_table(rows_count)
+
+    await measure('прежняя версия, без индекса', legacy_get_extreme_date_records, max(calls // 20, 5))
+    await measure('один запрос, без индекса', db.get_extreme_date_records, max(calls // 20, 5))
+
+    table, columns, unique = extreme_date_index(TABLE)
+    await db.create_index_async(table, columns, unique=unique)
+    await check_parity()
+
+    # Прогрев: первый проход по индексу читает страницы с диска и искажает сравнение
+    await measure('прогрев кэша страниц', db.get_extreme_date_records, calls)
+    await measure('прежняя версия, индекс (user_id, category, date)', legacy_get_extreme_date_records, calls)
+    await measure('один запрос, индекс (user_id, category, date)', db.get_extreme_date_records, calls)
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    calls = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db.DB_NAME = os.path.join(tmp_dir, 'bench.db')
+        asyncio.run(run(count, calls))
@@ -0,0 +1,55 @@
+"""
+Сборка inline-клавиатур: inline_menu против скомпилированного шаблона (compile_keyboard).
+
+Запуск из корня проекта:
+    python -m benchmarks.keyboards [количество_вызовов]
+"""
+import asyncio
+import sys
+import time
+
+from modules.utils.bot_fn import inline_menu, compile_keyboard
+
+TEMPLATE = compile_keyboard(line_1=[("Перейти 🔗", "{url}")], width_1=2,
+                            line_2=[("Проверить оплату ✔", "check_pay:{payment_id}:{product_id}")], width_2=1)
+UNCACHED = compile_keyboard(cache_size=0,
+                            line_1=[("Перейти 🔗", "{url}")], width_1=2,
+                            line_2=[("Проверить оплату ✔", "check_pay:{payment_id}:{product_id}")], width_2=1)
+
+
+def params(i: int, distinct: int):
+    key = i % distinct
+    return f"https://pay.example.com/{key}", f"pay{key}", key % 50
+
+
+async def measure(title: str, calls: int, coro_fn) -> None:
+    started = time.perf_counter()
+    for i in range(calls):
+        await coro_fn(i)
+    elapsed = time.perf_counter() - started
+    print(f"{title:<45} {elapsed / calls * 1e6:8.1f} мкс/вызов")
+
+
+async def run(calls: int) -> None:
+    async def menu(i, distinct=calls):
+        url, payment_id, product_id = params(i, distinct)
+        return await inline_menu(line_1=[("Перейти 🔗", url)], width_1=2,
+                                 line_2=[("Проверить оплату ✔", f'check_pay:{payment_id}:{product_id}')], width_2=1)
+
+    def template(keyboard, distinct):
+        async def render(i):
+            url, payment_id, product_id = params(i, distinct)
+            return keyboard.render(url=url, payment_id=payment_id, product_id=product_id)
+        return render
+
+    # Шаблон должен давать ту же клавиатуру
+    url, payment_id, product_id = params(1, calls)
+    assert await menu(1) == UNCACHED.render(url=url, payment_id=payment_id, product_id=product_id)
+
+    await measure('inline_menu', calls, menu)
+    await measure('шаблон, без кэша', calls, template(UNCACHED, calls))
+    await measure('шаблон, 100 повторяющихся наборов параметров', calls, template(TEMPLATE, 100))
+
+
+if __name__ == '__main__':
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
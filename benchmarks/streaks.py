@@ -0,0 +1,74 @@
+"""
+Серии дней для многих пользователей: get_series в цикле против get_series_batch
+(со списком строк и с массивами из day_arrays, как их дает db.get_day_numbers).
+
+Запуск из корня проекта:
+    python -m benchmarks.streaks [количество_пользователей] [дней_на_пользователя]
+"""
+import asyncio
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+from modules.utils.bot_fn import day_arrays, get_series, get_series_batch
+
+
+def make_dates(users_count: int, days_per_user: int):
+    rnd = random.Random(1)
+    today = date.today()
+    user_ids, dates = [], []
+    for user_id in range(users_count):
+        for _ in range(days_per_user):
+            user_ids.append(user_id)
+            dates.append((today - timedelta(days=rnd.randrange(days_per_user * 2))).isoformat())
+    return user_ids, dates
+
+
+def make_rollup_rows(user_ids, dates):
+    """Строки в формате db.get_day_numbers: (user_id, количество дней, "номера через запятую")."""
+    epoch = date(1970, 1, 1)
+    by_user = {}
+    for user_id, day in zip(user_ids, dates):
+        by_user.setdefault(user_id, set()).add((date.fromisoformat(day) - epoch).days)
+    return [(user_id, len(days), ','.join(map(str, sorted(days)))) for user_id, days in sorted(by_user.items())]
+
+
+async def run(users_count: int, days_per_user: int) -> None:
+    user_ids, dates = make_dates(users_count, days_per_user)
+    print(f"{users_count} пользователей, {len(dates)} дат")
+
+    started = time.perf_counter()
+    batch = await get_series_batch(user_ids, dates)
+    print(f"{'get_series_batch (строки)':<30} {time.perf_counter() - started:8.3f} c")
+
+    rows = make_rollup_rows(user_ids, dates)
+    started = time.perf_counter()
+    user_array, day_array = day_arrays(rows)
+    parsed = time.perf_counter()
+    arrays = await get_series_batch(user_array, day_array, as_arrays=True)
+    finished = time.perf_counter()
+    print(f"{'get_series_batch (массивы)':<30} {finished - started:8.3f} c "
+          f"(day_arrays {parsed - started:.3f} c, серии {finished - parsed:.3f} c)")
+    for user_id, max_len, last_len in zip(arrays.user_ids[:1000].tolist(), arrays.max_streak.tolist(),
+                                          arrays.last_streak.tolist()):
+        assert (max_len, last_len) == (batch[user_id].max_streak, batch[user_id].last_streak), user_id
+
+    # Построчная версия на части пользователей, время пересчитано на всех
+    sample = min(users_count, 2000)
+    by_user = {}
+    for user_id, day in zip(user_ids, dates):
+        if user_id < sample:
+            by_user.setdefault(user_id, []).append(day)
+    started = time.perf_counter()
+    for user_id, user_dates in by_user.items():
+        single = await get_series(user_dates)
+        assert (single.max_streak, single.last_streak) == (batch[user_id].max_streak, batch[user_id].last_streak), user_id
+    elapsed = (time.perf_counter() - started) * users_count / sample
+    print(f"{'get_series в цикле (оценка)':<30} {elapsed:8.3f} c")
+
+
+if __name__ == '__main__':
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    asyncio.run(run(users, days))
@@ -1,33 +1,77 @@
 import asyncio
+import signal
 from modules.bot.bot import bot, dp
-from modules.handlers.start_handler import router as start_router
-from modules.handlers.last_handler import router as last_router
-from modules.handlers.product_sender import router as product_sender
-from modules.utils.db import creator, ensure_database_exists
+from modules.configs import config
+from modules.utils import db
+from modules.utils.db import ensure_database_exists
+from modules.utils.catalog import catalog
+from modules.utils.user_state import user_states
+from modules.utils.bot_settings import bot_settings
+from modules.bot.dispatcher import setup_dispatcher
+from modules.bot.webhook import WebhookServer
+from modules.bot.polling import run_polling
+from modules.bot.scheduler import UpdateScheduler
+from modules.bot.update_tracker import UpdateTracker
+from modules.bot.lifecycle import Lifecycle, emit_shutdown, flush_write_behind
+from modules.utils.schema import TABLES, INDEXES, TRIGGERS, BACKFILLS, DUPLICATE_PRIORITY
 
 async def main():
     
-    await bot.delete_webhook()
+    await create_tables()
+    # Каталог продуктов держим в памяти, админка сбрасывает его через change_counters
+    await catalog.start()
+    # Флаги бана и ролей тоже в памяти - middleware проверяет их без запросов к базе
+    await user_states.start()
+    # Настройки ботов из таблицы bots (своя супергруппа у бота)
+    await bot_settings.start()
     
-    # Регистрируем все роутеры
-    dp.include_router(start_router)
-    dp.include_router(last_router)
-    dp.include_router(product_sender)
-    # Запускаем бота
-    await dp.start_polling(bot)
+    # Последний обработанный update_id хранится в базе: после перезапуска повторы отбрасываются
+    tracker = UpdateTracker(f'last_update_id:{bot.id}')
+    await tracker.load()
+    # Обновления разных чатов обрабатываются параллельно, одного чата (темы) - по порядку
+    scheduler = UpdateScheduler(lambda update: dp.feed_update(bot, update), tracker=tracker,
+                                super_group_ids=bot_settings.super_group_ids(bot.id))
     
+    # Статистика запросов к БД (DB_QUERY_STATS = True в конфиге).
+    # kill -USR1 <pid> выводит ее и очереди обновлений в лог, не останавливая бота
+    if getattr(config, 'DB_QUERY_STATS', False):
+        db.query_stats.enable(slow_ms=getattr(config, 'DB_SLOW_QUERY_MS', 100))
+    if hasattr(signal, 'SIGUSR1'):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, lambda: print_stats(scheduler))
+    
+    # Middleware (бан, антифлуд) и роутеры
+    setup_dispatcher(dp)
+    
+    # Остановка по SIGTERM (pm2 stop/restart) и Ctrl+C: прием прекращается, затем по порядку
+    # дожидаемся обработчиков, вызываем on_shutdown, дописываем отложенные записи и закрываем ресурсы
+    lifecycle = Lifecycle()
+    lifecycle.add_step('обработчики обновлений', scheduler.drain)
+    lifecycle.add_step('on_shutdown', emit_shutdown(dp, bot))
+    lifecycle.add_step('отложенные записи в БД', flush_write_behind)
+    lifecycle.add_step('кэш каталога', lambda remaining: catalog.stop())
+    lifecycle.add_step('кэш пользователей', lambda remaining: user_states.stop())
+    lifecycle.add_step('настройки ботов', lambda remaining: bot_settings.stop())
+    lifecycle.add_step('сессия бота', lambda remaining: bot.session.close())
+    
+    # Запускаем бота: RUN_MODE = 'webhook' в конфиге - прием через вебхук, иначе long polling
+    if getattr(config, 'RUN_MODE', 'polling') == 'webhook':
+        await lifecycle.run(WebhookServer(bot, dp, scheduler).serve())
+    else:
+        await bot.delete_webhook()
+        await lifecycle.run(run_polling(bot, dp, scheduler))
+    
+def print_stats(scheduler):
+    print(f"Очереди обновлений: {scheduler.snapshot()}")
+    print(f"Соединения с Bot API: {bot.session.stats()}")
+    if db.query_stats.enabled:
+        print(db.query_stats.dump())
+
 async def create_tables():
     
     # Сначала проверяем и создаем файл базы данных
     await ensure_database_exists()
-    # Затем создаем таблицы
-    await creator(table='users', column_types={'user_id': 'INTEGER', 'topic_id': 'INTEGER', 'username': 'TEXT',
-                                               'first_name': 'TEXT', 'last_name': 'TEXT', 'source': 'TEXT', 
-                                               'is_admin': 'INTEGER', 'is_moderator': 'INTEGER', 'banned': 'INTEGER',
-                                               'tariff': 'TEXT', 'bot_username': 'TEXT', 'bot_id': 'INTEGER',
-                                               })
-    await creator(table='purchased', column_types={'user_id': 'INTEGER', 'product_id': 'INTEGER', 'step': 'TEXT', 'paid': 'INTEGER'})
+    # Затем приводим таблицы и индексы к схеме (одна транзакция, при неизменной схеме ничего не делает)
+    await db.reconcile_schema(TABLES, INDEXES, TRIGGERS, BACKFILLS, duplicate_priority=DUPLICATE_PRIORITY)
 
 if __name__ == "__main__":
-    asyncio.run(create_tables())
     asyncio.run(main())
\ No newline at end of file
@@ -6,8 +6,10 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.responses import RedirectResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 import uvicorn
+from aiogram.utils.token import TokenValidationError, validate_token
 from modules.utils import db
 from modules.configs.config import tariffs    
+from modules.utils.schema import TABLES, INDEXES, TRIGGERS, BACKFILLS, DUPLICATE_PRIORITY
 
 # Создаем экземпляр FastAPI приложения
 app = FastAPI()
@@ -321,6 +323,7 @@ async def add_bot(
     bot_id: int = Form(...),
     bot_token: str = Form(...),
     bot_username: str = Form(...),
+    super_group_id: str = Form(""),
     auth: bool = Depends(require_auth)
 ):
     """Добавляет нового бота в базу данных"""
@@ -330,9 +333,26 @@ async def add_bot(
         def process_field(value):
             return None if not value or value.strip() == "" else value
         
+        # Неверный токен не дал бы запустить бота (BotPool пропустит его с ошибкой в логе) -
+        # проверяем его так же, как aiogram, до сохранения
+        bot_token = bot_token.strip()
+        try:
+            validate_token(bot_token)
+        except TokenValidationError:
+            return templates.TemplateResponse("add_bot.html", {
+                "request": request,
+                "error": "Неверный токен бота: ожидается формат 123456789:ABC... без пробелов"
+            })
+        if int(bot_token.split(':', 1)[0]) != bot_id:
+            return templates.TemplateResponse("add_bot.html", {
+                "request": request,
+                "error": "ID бота не совпадает с числом в начале токена"
+            })
+        
         await db.insert_async(
-            ["title", "bot_id", "bot_token", "bot_username"], 
-            [process_field(title), bot_id, process_field(bot_token), process_field(bot_username)], 
+            ["title", "bot_id", "bot_token", "bot_username", "super_group_id"], 
+            [process_field(title), bot_id, process_field(bot_token), process_field(bot_username),
+             int(super_group_id) if process_field(super_group_id) else None], 
             table='bots'
         )
         return RedirectResponse(url="/products", status_code=303)
@@ -371,14 +391,16 @@ async def show_users(request: Request, bot_id: str = None, session_id: str = Coo
 async def ban_user(user_id: int, auth: bool = Depends(require_auth)):
     """Блокирует/разблокирует пользователя"""
     try:
-        # Получаем текущее состояние пользователя
-        user = await db.get_one_generic_async("users", user_id=user_id)
-        if not user:
-            return {"error": "Пользователь не найден"}
-        
-        # Переключаем статус бана
-        new_banned_status = 0 if user.get('banned', 0) == 1 else 1
-        await db.update_generic_async("users", ["banned"], [new_banned_status], user_id=user_id)
+        # Чтение и переключение статуса в одной транзакции, чтобы два клика не затерли друг друга
+        async with db.transaction() as tx:
+            # Получаем текущее состояние пользователя
+            user = await tx.get_one_generic_async("users", user_id=user_id)
+            if not user:
+                return {"error": "Пользователь не найден"}
+            
+            # Переключаем статус бана
+            new_banned_status = 0 if user.get('banned', 0) == 1 else 1
+            await tx.update_generic_async("users", ["banned"], [new_banned_status], user_id=user_id)
         
         return RedirectResponse(url="/users", status_code=303)
     except Exception as e:
@@ -393,15 +415,17 @@ async def change_user_role(user_id: int, role: str = Form(...), auth: bool = Dep
         if not user:
             return {"error": "Пользователь не найден"}
         
-        # Сбрасываем все роли
-        await db.update_generic_async("users", ["is_admin", "is_moderator"], [0, 0], user_id=user_id)
-        
-        # Устанавливаем новую роль
-        if role == "admin":
-            await db.update_generic_async("users", ["is_admin"], [1], user_id=user_id)
-        elif role == "moderator":
-            await db.update_generic_async("users", ["is_moderator"], [1], user_id=user_id)
-        # Если role == "user", роли остаются сброшенными
+        # Сброс и установка роли выполняются атомарно в одной транзакции
+        async with db.transaction() as tx:
+            # Сбрасываем все роли
+            await tx.update_generic_async("users", ["is_admin", "is_moderator"], [0, 0], user_id=user_id)
+            
+            # Устанавливаем новую роль
+            if role == "admin":
+                await tx.update_generic_async("users", ["is_admin"], [1], user_id=user_id)
+            elif role == "moderator":
+                await tx.update_generic_async("users", ["is_moderator"], [1], user_id=user_id)
+            # Если role == "user", роли остаются сброшенными
         
         return RedirectResponse(url="/users", status_code=303)
     except Exception as e:
@@ -503,14 +527,8 @@ async def reset_telegram_image_id(product_id: int, auth: bool = Depends(require_
 
 
 async def create_tables():
-    await db.creator(table='products', column_types={'title': 'TEXT', 'description': 'TEXT', 'image': 'TEXT', 'video': 'TEXT', 'is_free': 'INTEGER',
-                                               'price': 'INTEGER', 'discount': 'INTEGER', 'file_type': 'TEXT', 'product_bot': 'TEXT', 'path': 'TEXT', 'link': 'TEXT',
-                                               'telegram_file_id': 'TEXT', 'telegram_video_id': 'TEXT', 'telegram_image_id': 'TEXT', 'unique_product_id': 'TEXT'})
-    await db.creator(table='bots', column_types={'title': 'TEXT', 'bot_id': 'INTEGER', 'bot_token': 'TEXT', 'bot_username': 'TEXT'})
-    await db.creator(table='users', column_types={'user_id': 'INTEGER', 'topic_id': 'INTEGER', 'username': 'TEXT',
-                                               'first_name': 'TEXT', 'last_name': 'TEXT', 'source': 'TEXT', 
-                                               'is_admin': 'INTEGER', 'is_moderator': 'INTEGER', 'banned': 'INTEGER',
-                                               'tariff': 'TEXT', 'bot_username': 'TEXT', 'bot_id': 'INTEGER'})
+    await db.ensure_database_exists()
+    await db.reconcile_schema(TABLES, INDEXES, TRIGGERS, BACKFILLS, duplicate_priority=DUPLICATE_PRIORITY)
 
 if __name__ == "__main__":
     asyncio.run(create_tables())
@@ -1,8 +1,9 @@
 import asyncio
 import logging
-from aiogram import Bot, Dispatcher
+from aiogram import Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from modules.bot.bot import create_bot
 from modules.handlers.start_handler import router as start_router
 from modules.handlers.last_handler import router as last_router
 from modules.utils.db import creator, ensure_database_exists
@@ -23,13 +24,10 @@ class AdvancedMultiBotRunner:
         
     async def create_bot_instance(self, token, bot_id):
         """Создает экземпляр бота с уникальным ID"""
-        bot = Bot(
-            token=token, 
-            default=DefaultBotProperties(
-                parse_mode=getattr(ParseMode, BOT_SETTINGS['parse_mode']),
-                link_preview_is_disabled=BOT_SETTINGS['link_preview_disabled']
-            )
-        )
+        bot = create_bot(token, default=DefaultBotProperties(
+            parse_mode=getattr(ParseMode, BOT_SETTINGS['parse_mode']),
+            link_preview_is_disabled=BOT_SETTINGS['link_preview_disabled']
+        ))
         
         dp = Dispatcher()
         
@@ -8,6 +8,13 @@ BOT_TOKENS = [
     # Добавьте больше токенов по необходимости
 ]
 
+# True - боты берутся из таблицы bots (добавление и удаление в админке без перезапуска),
+# False - из списка BOT_TOKENS выше
+BOTS_FROM_DB = True
+
+# Сколько процессов-воркеров для sharded_multi_bot.py (None - по числу ядер)
+SHARD_WORKERS = None
+
 # Настройки базы данных
 DATABASE_CONFIG = {
     'name': 'pfiles/data.db',
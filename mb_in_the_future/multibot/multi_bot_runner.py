@@ -1,7 +1,8 @@
 import asyncio
-from aiogram import Bot, Dispatcher
+from aiogram import Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from modules.bot.bot import create_bot
 from modules.handlers.start_handler import router as start_router
 from modules.handlers.last_handler import router as last_router
 from modules.utils.db import creator, ensure_database_exists
@@ -17,7 +18,7 @@ class MultiBotRunner:
         
     async def create_bot_and_dispatcher(self, token):
         """Создает бота и диспетчер для одного токена"""
-        bot = Bot(token=token, default=DefaultBotProperties(
+        bot = create_bot(token, default=DefaultBotProperties(
             parse_mode=ParseMode.HTML, 
             link_preview_is_disabled=True
         ))
@@ -0,0 +1,38 @@
+import asyncio
+import os
+import signal
+from modules.bot.lifecycle import Lifecycle, SHUTDOWN_RESERVE, SHUTDOWN_TIMEOUT
+from modules.bot.sharding import ShardSupervisor
+from modules.utils import db
+from modules.utils.db import ensure_database_exists
+from modules.utils.schema import TABLES, INDEXES, TRIGGERS, BACKFILLS, DUPLICATE_PRIORITY
+from bot_config import BOT_TOKENS, BOTS_FROM_DB, SHARD_WORKERS
+
+# Мульти-бот на нескольких процессах: боты раскладываются по воркерам консистентным
+# хешем, у каждого воркера свой event loop. kill -USR1 <pid> печатает сводку по воркерам.
+
+async def main():
+    # Боты из таблицы bots: воркеры сами следят за ней; иначе - фиксированный список
+    tokens = None
+    if not BOTS_FROM_DB:
+        tokens = [token for token in BOT_TOKENS if token and token.strip()]
+        if not tokens:
+            print("❌ Нет валидных токенов для запуска!")
+            return
+    
+    # Схему приводим один раз, до запуска воркеров
+    await ensure_database_exists()
+    await db.reconcile_schema(TABLES, INDEXES, TRIGGERS, BACKFILLS, duplicate_priority=DUPLICATE_PRIORITY)
+    
+    supervisor = ShardSupervisor(tokens, workers=SHARD_WORKERS or os.cpu_count() or 1)
+    asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, lambda: print(supervisor.health()))
+    
+    # Воркер останавливается не дольше SHUTDOWN_TIMEOUT + SHUTDOWN_RESERVE - столько супервизор
+    # и ждет его перед принудительным завершением (все еще меньше kill_timeout pm2)
+    lifecycle = Lifecycle(timeout=SHUTDOWN_TIMEOUT + SHUTDOWN_RESERVE + 1, reserve=0)
+    lifecycle.add_step('воркеры', supervisor.stop)
+    print(f"🚀 Запуск ботов на {len(supervisor.workers)} процессах...")
+    await lifecycle.run(supervisor.run())
+
+if __name__ == "__main__":
+    asyncio.run(main())
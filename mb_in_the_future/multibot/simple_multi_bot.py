@@ -1,7 +1,8 @@
 import asyncio
-from aiogram import Bot, Dispatcher
+from aiogram import Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from modules.bot.bot import create_bot
 from modules.handlers.start_handler import router as start_router
 from modules.handlers.last_handler import router as last_router
 from modules.utils.db import creator, ensure_database_exists
@@ -11,7 +12,7 @@ BOT_TOKENS = ['', '']
 
 async def start_bot(token):
     """Запускает один бот с указанным токеном"""
-    bot = Bot(token=token, default=DefaultBotProperties(
+    bot = create_bot(token, default=DefaultBotProperties(
         parse_mode=ParseMode.HTML, 
         link_preview_is_disabled=True
     ))
@@ -1,7 +1,18 @@
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from modules.bot.session import shared_session
 from modules.configs.config import TOKEN
 
-bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML, link_preview_is_disabled=True))
-dp = Dispatcher()
\ No newline at end of file
+
+def create_bot(token: str, default: DefaultBotProperties = None) -> Bot:
+    """Создает бота на общей сессии процесса (пулы соединений и лимиты - в modules/bot/session.py)."""
+    # Bot проверяет токен: счетчик пользователей сессии увеличиваем только для созданного бота
+    new_bot = Bot(token=token, session=shared_session,
+                  default=default or DefaultBotProperties(parse_mode=ParseMode.HTML, link_preview_is_disabled=True))
+    shared_session.users += 1
+    return new_bot
+
+
+bot = create_bot(TOKEN)
+dp = Dispatcher()
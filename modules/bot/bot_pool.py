@@ -0,0 +1,150 @@
+import asyncio
+from typing import Callable, Dict, Iterable, Optional
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramUnauthorizedError
+from modules.bot.bot import create_bot
+from modules.bot.lifecycle import emit_shutdown
+from modules.bot.polling import run_polling
+from modules.bot.scheduler import UpdateScheduler
+from modules.bot.update_tracker import UpdateTracker
+from modules.configs import config
+from modules.utils import db
+from modules.utils.bot_settings import bot_settings
+from modules.utils.watched_cache import WatchedCache
+
+# Сколько секунд удаленный из таблицы бот дорабатывает уже принятые обновления
+BOT_REMOVE_TIMEOUT = getattr(config, 'BOT_REMOVE_TIMEOUT', 10)
+# Максимальная пауза между попытками polling после ошибки (секунды)
+POLLING_MAX_BACKOFF = getattr(config, 'POLLING_MAX_BACKOFF', 60)
+
+
+def _token_label(token: str) -> str:
+    # В лог - только id бота из токена, не сам токен
+    bot_id = token.split(':', 1)[0]
+    return bot_id if bot_id.isdigit() else '(неверный токен)'
+
+
+class _RunningBot:
+    """Запущенный бот: сам бот, его очереди обновлений и задача polling."""
+
+    def __init__(self, bot: Bot, scheduler: UpdateScheduler, task: asyncio.Task):
+        self.bot = bot
+        self.scheduler = scheduler
+        self.task = task
+
+
+async def _poll_bot(bot: Bot, dp: Dispatcher, scheduler: UpdateScheduler) -> None:
+    # Ошибка одного бота (сеть, неверный токен) не должна останавливать остальных
+    backoff = 1
+    while True:
+        try:
+            await bot.delete_webhook()
+            await run_polling(bot, dp, scheduler)
+        except TelegramUnauthorizedError:
+            print(f"Бот {bot.id}: токен недействителен, бот отключен")
+            return
+        except Exception as e:
+            print(f"Бот {bot.id}: ошибка polling {e}, повтор через {backoff} с")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, POLLING_MAX_BACKOFF)
+
+
+class BotPool(WatchedCache):
+    """
+    Набор ботов из таблицы bots, которые работают в одном процессе на одном Dispatcher.
+
+    Админка добавляет или удаляет бота - триггеры увеличивают счетчик 'bots'
+    (см. schema.TRIGGERS), пул перечитывает таблицу и запускает polling новых ботов
+    и останавливает удаленных. Остальные боты при этом не перезапускаются.
+
+    owns отбирает ботов для этого процесса (например, свой шард в ShardSupervisor).
+    Если передан tokens, пул работает с этим списком вместо таблицы.
+
+    Пример:
+        pool = BotPool(dp)
+        lifecycle.add_step('обработчики обновлений', pool.drain)
+        lifecycle.add_step('on_shutdown', pool.emit_shutdown)
+        lifecycle.add_step('сессии ботов', pool.close)
+        await lifecycle.run(pool.serve())
+    """
+
+    counter_name = 'bots'
+
+    def __init__(self, dp: Dispatcher, owns: Callable[[str], bool] = lambda token: True,
+                 tokens: Optional[Iterable[str]] = None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dp = dp
+        self.owns = owns
+        self.tokens = list(tokens) if tokens is not None else None
+        self.bots: Dict[str, _RunningBot] = {}
+
+    async def _reload(self) -> None:
+        # Настройки новых ботов (супергруппа) должны быть загружены до их запуска
+        await bot_settings.refresh()
+        if self.tokens is not None:
+            tokens = self.tokens
+        else:
+            tokens = [row['bot_token'] for row in await db.get_all_generic_async('bots')]
+        wanted = {token.strip() for token in tokens if token and token.strip() and self.owns(token.strip())}
+
+        for token in set(self.bots) - wanted:
+            await self._remove(token)
+        for token in wanted - set(self.bots):
+            # Ошибка одного бота (неверный токен в таблице) не должна мешать остальным
+            try:
+                await self._add(token)
+            except Exception as e:
+                print(f"Бот {_token_label(token)} не запущен, пропускаем: {type(e).__name__}: {e}")
+
+    async def _add(self, token: str) -> None:
+        bot = create_bot(token)
+        tracker = UpdateTracker(f'last_update_id:{bot.id}')
+        try:
+            await tracker.load()
+        except Exception:
+            await bot.session.close()
+            raise
+        scheduler = UpdateScheduler(lambda update: self.dp.feed_update(bot, update), tracker=tracker,
+                                    super_group_ids=bot_settings.super_group_ids(bot.id))
+        task = asyncio.create_task(_poll_bot(bot, self.dp, scheduler), name=f'polling-{bot.id}')
+        self.bots[token] = _RunningBot(bot, scheduler, task)
+        print(f"Бот {bot.id} запущен")
+
+    async def _remove(self, token: str) -> None:
+        running = self.bots.pop(token)
+        running.task.cancel()
+        await asyncio.gather(running.task, return_exceptions=True)
+        abandoned = await running.scheduler.drain(BOT_REMOVE_TIMEOUT)
+        await running.bot.session.close()
+        print(f"Бот {running.bot.id} остановлен" + (f", брошено обновлений: {abandoned}" if abandoned else ""))
+
+    async def serve(self) -> None:
+        """Запускает ботов и следит за таблицей до отмены; при отмене прекращает polling."""
+        await self.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.stop()
+            tasks = [running.task for running in self.bots.values()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def drain(self, remaining: float) -> int:
+        """Шаг остановки: дожидается обработчиков всех ботов, возвращает число брошенных обновлений."""
+        abandoned = await asyncio.gather(*(running.scheduler.drain(remaining) for running in self.bots.values()))
+        return sum(abandoned)
+
+    async def emit_shutdown(self, remaining: float) -> None:
+        """Шаг остановки: on_shutdown роутеров для всех ботов пула (после drain)."""
+        bots = [running.bot for running in self.bots.values()]
+        await emit_shutdown(self.dp, *bots)(remaining)
+
+    async def close(self, remaining: float) -> None:
+        """Шаг остановки: закрывает сессии ботов (общая сессия закроется с последним)."""
+        for running in self.bots.values():
+            await running.bot.session.close()
+        self.bots = {}
+
+    def snapshot(self) -> Dict[int, Dict[str, int]]:
+        return {running.bot.id: running.scheduler.snapshot() for running in self.bots.values()}
@@ -0,0 +1,63 @@
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from aiogram import BaseMiddleware, Bot
+from aiogram.types import TelegramObject, Update
+from modules.bot.bot import bot as default_bot
+from modules.utils.bot_settings import bot_settings
+
+# Бот и супергруппа обновления, которое сейчас обрабатывается (задает BotContextMiddleware)
+current_bot: ContextVar[Optional[Bot]] = ContextVar('current_bot', default=None)
+current_super_group: ContextVar[Optional[int]] = ContextVar('current_super_group', default=None)
+
+
+def get_bot() -> Bot:
+    """Бот текущего обновления; вне обработки обновления - бот из конфига."""
+    return current_bot.get() or default_bot
+
+
+def super_group_id() -> Optional[int]:
+    """Основная супергруппа поддержки бота текущего обновления."""
+    group_id = current_super_group.get()
+    return group_id if group_id is not None else bot_settings.super_group_id(get_bot().id)
+
+
+def super_group_ids() -> List[int]:
+    """Все супергруппы (шарды) бота текущего обновления, основная - первая."""
+    return bot_settings.super_group_ids(get_bot().id)
+
+
+class _CurrentBot:
+    """
+    Подставляет бота текущего обновления: bot.send_message(...) в общих обработчиках
+    отвечает через того бота, которому пришло обновление, а не через бота из конфига.
+    """
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(get_bot(), name)
+
+
+bot = _CurrentBot()
+
+
+class BotContextMiddleware(BaseMiddleware):
+    """
+    Внешний middleware для dp.update, регистрируется первым: запоминает бота обновления
+    и его супергруппу (bot_settings) на время обработки. Обработчикам основная
+    супергруппа передается в аргументе super_group_id, все шарды - в super_group_ids.
+    """
+
+    async def __call__(self,
+                       handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: Update,
+                       data: Dict[str, Any]) -> Any:
+        bot = data['bot']
+        group_id = bot_settings.super_group_id(bot.id)
+        data['super_group_id'] = group_id
+        data['super_group_ids'] = bot_settings.super_group_ids(bot.id)
+        bot_token = current_bot.set(bot)
+        group_token = current_super_group.set(group_id)
+        try:
+            return await handler(event, data)
+        finally:
+            current_bot.reset(bot_token)
+            current_super_group.reset(group_token)
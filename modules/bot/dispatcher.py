@@ -0,0 +1,26 @@
+from aiogram import Dispatcher
+from modules.bot.context import BotContextMiddleware
+from modules.handlers.start_handler import router as start_router
+from modules.handlers.last_handler import router as last_router
+from modules.handlers.product_sender import router as product_sender
+from modules.middlewares.user_state import UserStateMiddleware
+from modules.middlewares.throttling import ThrottlingMiddleware
+
+
+def setup_dispatcher(dp: Dispatcher) -> Dispatcher:
+    """
+    Подключает middleware и роутеры. Роутер можно включить только в один Dispatcher,
+    поэтому в процессе вызывается один раз (и в main.py, и в воркерах мультибота).
+    """
+    # Бот и супергруппа обновления: обработчики отвечают через бота, которому оно пришло
+    dp.update.outer_middleware(BotContextMiddleware())
+    # Заблокированные пользователи отсекаются до роутеров
+    dp.update.outer_middleware(UserStateMiddleware())
+    # Антифлуд: после проверки ролей, чтобы не ограничивать администраторов и супергруппу
+    dp.update.outer_middleware(ThrottlingMiddleware())
+    
+    # Регистрируем все роутеры
+    dp.include_router(start_router)
+    dp.include_router(last_router)
+    dp.include_router(product_sender)
+    return dp
@@ -0,0 +1,130 @@
+import asyncio
+import signal
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+from aiogram import Bot, Dispatcher
+from modules.configs import config
+from modules.utils import db
+
+# Сколько секунд дается на остановку
+SHUTDOWN_TIMEOUT = getattr(config, 'SHUTDOWN_TIMEOUT', 15)
+# Запас сверх SHUTDOWN_TIMEOUT для шагов после истечения срока (сброс в базу важнее срока).
+# Остановка никогда не длится дольше SHUTDOWN_TIMEOUT + SHUTDOWN_RESERVE - это должно быть
+# меньше kill_timeout в eco.json (20 с), иначе pm2 убьет процесс посреди сброса
+SHUTDOWN_RESERVE = getattr(config, 'SHUTDOWN_RESERVE', 3)
+# Минимальное время на каждый шаг после истечения срока (в пределах запаса)
+MIN_STEP_TIMEOUT = 2
+# На сколько меньше внешнего предела время, которое получает сам шаг: шаг со своим
+# сроком (scheduler.drain) успевает отменить брошенную работу и вернуть ее количество
+STEP_MARGIN = 0.5
+
+
+class Lifecycle:
+    """
+    Корректная остановка бота по SIGTERM / SIGINT (pm2 stop / restart, Ctrl+C).
+
+    run(intake) запускает прием обновлений (polling или вебхук) и ждет сигнала.
+    По сигналу прием останавливается, затем по порядку выполняются шаги остановки,
+    добавленные через add_step(): дождаться обработчиков, вызвать on_shutdown роутеров,
+    сбросить отложенные записи, остановить кэши, закрыть сессию бота. У шагов общий
+    срок SHUTDOWN_TIMEOUT и жесткий предел SHUTDOWN_TIMEOUT + SHUTDOWN_RESERVE: шаги,
+    до которых очередь дошла после предела, пропускаются. После срока шагам всегда
+    остается не меньше MIN_STEP_TIMEOUT (при меньшем запасе срок сдвигается раньше).
+    В конце печатается отчет - что удалось, что брошено.
+
+    Шаг - функция от отведенного ему времени (секунды), которая возвращает число
+    брошенных элементов (или None, если бросать нечего). Внешний предел шага на
+    STEP_MARGIN больше отведенного времени.
+
+    Пример:
+        lifecycle = Lifecycle()
+        lifecycle.add_step('обработчики', scheduler.drain)
+        lifecycle.add_step('on_shutdown', emit_shutdown(dp, bot))
+        lifecycle.add_step('сессия бота', lambda remaining: bot.session.close())
+        await lifecycle.run(run_polling(bot, dp, scheduler))
+    """
+
+    def __init__(self, timeout: float = SHUTDOWN_TIMEOUT, reserve: float = SHUTDOWN_RESERVE):
+        self.timeout = timeout
+        self.reserve = reserve
+        self._steps: List[Tuple[str, Callable[[float], Awaitable[Optional[int]]]]] = []
+        self._stop = asyncio.Event()
+        self.signal_name: Optional[str] = None
+
+    def add_step(self, name: str, step: Callable[[float], Awaitable[Optional[int]]]) -> None:
+        self._steps.append((name, step))
+
+    def stop(self, signal_name: str = 'stop()') -> None:
+        """Запрашивает остановку (вызывается обработчиком сигнала)."""
+        if self.signal_name is None:
+            self.signal_name = signal_name
+        self._stop.set()
+
+    def install_signal_handlers(self) -> None:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.stop, sig.name)
+            except (NotImplementedError, RuntimeError):
+                # Windows: остается стандартный KeyboardInterrupt
+                pass
+
+    async def run(self, intake: Awaitable[Any]) -> None:
+        self.install_signal_handlers()
+        intake_task = asyncio.ensure_future(intake)
+        stop_task = asyncio.create_task(self._stop.wait())
+        try:
+            await asyncio.wait({intake_task, stop_task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stop_task.cancel()
+            # Прекращаем прием: новые обновления больше не поступают в обработку
+            intake_task.cancel()
+            try:
+                await intake_task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                print(f"Прием обновлений завершился с ошибкой: {e}")
+            await self.shutdown()
+
+    async def shutdown(self) -> None:
+        loop = asyncio.get_running_loop()
+        hard_deadline = loop.time() + self.timeout + self.reserve
+        # Шагам после срока (сброс в базу, закрытие сессий) нужно время, даже если запас
+        # меньше MIN_STEP_TIMEOUT: тогда срок наступает раньше, а предел остается прежним
+        deadline = hard_deadline - max(self.reserve, min(MIN_STEP_TIMEOUT, self.timeout))
+        print(f"Остановка бота ({self.signal_name or 'прием обновлений завершился'}), срок {self.timeout} с")
+        report = []
+        for name, step in self._steps:
+            left = hard_deadline - loop.time()
+            if left <= 0:
+                report.append(f"{name}: пропущен, срок остановки вышел")
+                continue
+            remaining = min(max(deadline - loop.time(), MIN_STEP_TIMEOUT), left)
+            budget = remaining - min(STEP_MARGIN, remaining / 2)
+            try:
+                abandoned = await asyncio.wait_for(step(budget), remaining)
+                report.append(f"{name}: брошено {abandoned}" if abandoned else f"{name}: ok")
+            except asyncio.TimeoutError:
+                report.append(f"{name}: не уложились в {remaining:.1f} с")
+            except Exception as e:
+                report.append(f"{name}: ошибка {e}")
+        print("Итоги остановки:\n  " + "\n  ".join(report))
+
+
+async def flush_write_behind(remaining: float) -> int:
+    """Шаг остановки: дописывает отложенные записи. Возвращает число записей, не попавших в базу."""
+    try:
+        await db.write_behind.close()
+    except Exception as e:
+        print(f"Ошибка при сбросе отложенных записей: {e}")
+    return len(db.write_behind)
+
+
+def emit_shutdown(dp: Dispatcher, *bots: Bot) -> Callable[[float], Awaitable[None]]:
+    """
+    Шаг остановки: on_shutdown роутеров. Добавляется после шага, дожидающегося обработчиков,
+    чтобы еще работающие обработчики не застали закрытые ресурсы.
+    """
+    async def step(remaining: float) -> None:
+        await dp.emit_shutdown(bot=bots[0] if bots else None, dispatcher=dp, bots=list(bots), **dp.workflow_data)
+    return step
@@ -0,0 +1,58 @@
+import asyncio
+import time
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramRetryAfter
+from modules.bot.scheduler import UpdateScheduler
+from modules.configs import config
+
+# Сколько секунд Telegram держит запрос getUpdates, если новых обновлений нет
+POLLING_TIMEOUT = getattr(config, 'POLLING_TIMEOUT', 30)
+# Через сколько секунд без обновлений перестать передавать offset. После недели без обновлений
+# Telegram может начать нумерацию с меньшего update_id, и старый offset подтвердил бы новые обновления
+POLLING_OFFSET_IDLE_RESET = getattr(config, 'POLLING_OFFSET_IDLE_RESET', 24 * 3600)
+
+
+async def run_polling(bot: Bot, dp: Dispatcher, scheduler: UpdateScheduler) -> None:
+    """
+    Long polling, который передает обновления в UpdateScheduler вместо dp.start_polling.
+
+    Чтение getUpdates не ждет обработки: обновления раскладываются по очередям чатов
+    и обрабатываются параллельно. Если очереди переполнены (MAX_PENDING_UPDATES),
+    новые обновления не запрашиваются, пока обработка не догонит.
+    Ошибки getUpdates не прерывают прием - повтор с растущей паузой; работает до отмены.
+    Необработанные обновления при выходе дожидается вызывающий (scheduler.drain), он же
+    после этого вызывает on_shutdown (lifecycle.emit_shutdown).
+    """
+    allowed_updates = dp.resolve_used_update_types()
+    await dp.emit_startup(bot=bot, dispatcher=dp, bots=[bot], **dp.workflow_data)
+    print(f"Polling запущен, обрабатываем до {scheduler.concurrency} обновлений одновременно")
+    # Первый запрос без offset: Telegram сам помнит, что подтверждено прошлыми запросами,
+    # а обработанное, но не подтвержденное отсеет UpdateTracker. Сохраненный водяной знак
+    # для offset не годится - после смены нумерации он подтвердил бы все новые обновления
+    offset = None
+    last_update_at = time.monotonic()
+    backoff = 1
+    while True:
+        await scheduler.wait_capacity()
+        if offset is not None and time.monotonic() - last_update_at > POLLING_OFFSET_IDLE_RESET:
+            offset = None
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=POLLING_TIMEOUT,
+                                            allowed_updates=allowed_updates,
+                                            request_timeout=POLLING_TIMEOUT + 10)
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            continue
+        except Exception as e:
+            # Как в dp.start_polling: любая ошибка getUpdates (сеть, 5xx, 409 - бот запущен
+            # где-то еще, 400 и т.п.) не останавливает прием, выход - только по отмене
+            print(f"Ошибка при получении обновлений ({type(e).__name__}): {e}. Повтор через {backoff} с")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+            continue
+        backoff = 1
+        if updates:
+            last_update_at = time.monotonic()
+        for update in updates:
+            scheduler.submit(update)
+            offset = update.update_id + 1
@@ -0,0 +1,163 @@
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Collection, Deque, Dict, Hashable, Optional
+from aiogram.types import Update
+from modules.bot.update_tracker import UpdateTracker
+from modules.configs import config
+
+# Сколько обновлений обрабатывается одновременно (во всех чатах вместе)
+UPDATE_CONCURRENCY = getattr(config, 'UPDATE_CONCURRENCY', getattr(config, 'WEBHOOK_CONCURRENCY', 32))
+# Сколько обновлений может ждать в очередях, прежде чем polling перестанет забирать новые
+MAX_PENDING_UPDATES = getattr(config, 'MAX_PENDING_UPDATES', 1000)
+
+
+def update_key(update: Update, super_group_ids: Collection[int] = ()) -> Hashable:
+    """
+    Ключ очереди обновления: обновления с одним ключом обрабатываются строго по порядку.
+
+    Обычно это чат. В супергруппах поддержки ключом служит тема (у каждого
+    пользователя своя тема), чтобы темы разных пользователей не ждали друг друга.
+    """
+    try:
+        event = update.event
+    except Exception:
+        return ('update', update.update_id)
+
+    message = getattr(event, 'message', None) if not hasattr(event, 'chat') else event
+    chat = getattr(message, 'chat', None) or getattr(event, 'chat', None)
+    if chat is not None:
+        if chat.id in super_group_ids:
+            return (chat.id, getattr(message, 'message_thread_id', None))
+        return (chat.id, None)
+
+    user = getattr(event, 'from_user', None)
+    if user is not None:
+        return (user.id, None)
+    return ('update', update.update_id)
+
+
+class UpdateScheduler:
+    """
+    Параллельная обработка обновлений с сохранением порядка внутри чата.
+
+    У каждого ключа (update_key: чат или тема супергруппы) своя очередь и не больше
+    одного обработчика за раз, разные чаты обрабатываются параллельно, а общее число
+    одновременно выполняющихся обработчиков ограничено concurrency.
+
+    С tracker (UpdateTracker) повторно доставленные обновления отбрасываются при приеме.
+
+    Пример:
+        scheduler = UpdateScheduler(lambda update: dp.feed_update(bot, update))
+        scheduler.submit(update)
+        print(scheduler.snapshot())
+    """
+
+    def __init__(self, process: Callable[[Update], Awaitable[Any]], concurrency: int = UPDATE_CONCURRENCY,
+                 super_group_ids: Collection[int] = (getattr(config, 'SUPER_GROUP_ID', None),),
+                 tracker: Optional[UpdateTracker] = None):
+        self.process = process
+        self.tracker = tracker
+        self.concurrency = concurrency
+        self.super_group_ids = frozenset(super_group_ids)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._queues: Dict[Hashable, Deque[Update]] = {}
+        self._workers: Dict[Hashable, asyncio.Task] = {}
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._below_limit = asyncio.Event()
+        self._below_limit.set()
+        self.pending = 0
+        self.in_progress = 0
+        self.processed = 0
+        self.failed = 0
+        self.peak_pending = 0
+        self.peak_depth = 0
+
+    def submit(self, update: Update) -> None:
+        # Повторно доставленное обновление (уже обработано до перезапуска или только что принято)
+        if self.tracker is not None and not self.tracker.received(update.update_id):
+            return
+        key = update_key(update, self.super_group_ids)
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+        queue.append(update)
+        self.pending += 1
+        self.peak_pending = max(self.peak_pending, self.pending)
+        self.peak_depth = max(self.peak_depth, len(queue))
+        self._idle.clear()
+        if self.pending >= MAX_PENDING_UPDATES:
+            self._below_limit.clear()
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._work(key, queue))
+
+    async def _work(self, key: Hashable, queue: Deque[Update]) -> None:
+        try:
+            while queue:
+                update = queue[0]
+                async with self._semaphore:
+                    self.in_progress += 1
+                    try:
+                        await self.process(update)
+                        self.processed += 1
+                    except Exception as e:
+                        self.failed += 1
+                        print(f"Ошибка при обработке обновления {update.update_id}: {e}")
+                    finally:
+                        self.in_progress -= 1
+                if self.tracker is not None:
+                    await self.tracker.done(update.update_id)
+                queue.popleft()
+                self.pending -= 1
+                if self.pending < MAX_PENDING_UPDATES:
+                    self._below_limit.set()
+        finally:
+            del self._workers[key]
+            # При отмене в очереди могли остаться обновления - drain() возвращает их число
+            if not queue:
+                del self._queues[key]
+            if not self._workers:
+                self._idle.set()
+
+    async def wait_capacity(self) -> None:
+        """Ждет, пока в очередях станет меньше MAX_PENDING_UPDATES обновлений."""
+        await self._below_limit.wait()
+
+    async def drain(self, timeout: Optional[float] = None) -> int:
+        """
+        Ждет обработки всех принятых обновлений. По истечении timeout отменяет
+        оставшиеся и возвращает число необработанных обновлений.
+
+        Если отменяют само ожидание (внешний срок остановки), обработчики тоже
+        отменяются, чтобы не работать параллельно со следующими шагами остановки.
+        """
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return 0
+        except asyncio.TimeoutError:
+            return await self._abandon()
+        except asyncio.CancelledError:
+            abandoned = await self._abandon()
+            print(f"Ожидание обработчиков прервано, брошено обновлений: {abandoned}")
+            raise
+
+    async def _abandon(self) -> int:
+        abandoned = self.pending
+        for task in list(self._workers.values()):
+            task.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        return abandoned
+
+    def snapshot(self) -> Dict[str, int]:
+        """Метрики очередей: сколько ждет, выполняется, в скольких чатах, самая длинная очередь."""
+        return {
+            'pending': self.pending,
+            'in_progress': self.in_progress,
+            'active_chats': len(self._workers),
+            'max_depth': max((len(queue) for queue in self._queues.values()), default=0),
+            'peak_pending': self.peak_pending,
+            'peak_depth': self.peak_depth,
+            'processed': self.processed,
+            'failed': self.failed,
+            'duplicates': self.tracker.duplicates if self.tracker is not None else 0,
+        }
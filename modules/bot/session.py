@@ -0,0 +1,155 @@
+import asyncio
+import time
+from typing import Any, Dict, Optional
+from aiohttp import ClientError, ClientSession, ClientTimeout
+from aiohttp.hdrs import USER_AGENT
+from aiohttp.http import SERVER_SOFTWARE
+from aiogram import Bot, __version__ as aiogram_version
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramNetworkError
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from modules.configs import config
+
+# Соединений к Bot API для обычных запросов (сообщения, ответы на кнопки, getUpdates)
+HTTP_LIMIT = getattr(config, 'HTTP_LIMIT', 100)
+# Отдельный пул для загрузки файлов: большие отправки не занимают соединения мелких
+HTTP_UPLOAD_LIMIT = getattr(config, 'HTTP_UPLOAD_LIMIT', 8)
+# Сколько секунд держать простаивающее соединение открытым (keep-alive)
+HTTP_KEEPALIVE = getattr(config, 'HTTP_KEEPALIVE', 60)
+# Сколько секунд кэшировать DNS api.telegram.org
+HTTP_DNS_TTL = getattr(config, 'HTTP_DNS_TTL', 300)
+# Таймауты в секундах: установка соединения, обычный запрос, загрузка файла
+HTTP_CONNECT_TIMEOUT = getattr(config, 'HTTP_CONNECT_TIMEOUT', 10)
+HTTP_TIMEOUT = getattr(config, 'HTTP_TIMEOUT', 30)
+HTTP_UPLOAD_TIMEOUT = getattr(config, 'HTTP_UPLOAD_TIMEOUT', 300)
+
+
+class _Pool:
+    """Один пул соединений (ClientSession со своим коннектором) и его счетчики."""
+
+    def __init__(self, limit: int, timeout: float):
+        self.limit = limit
+        self.timeout = timeout
+        self.session: Optional[ClientSession] = None
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_time = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        connector = self.session.connector if self.session is not None and not self.session.closed else None
+        return {
+            'limit': self.limit,
+            'requests': self.requests,
+            'in_flight': self.in_flight,
+            'peak_in_flight': self.peak_in_flight,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'avg_ms': round(self.total_time / self.requests * 1000, 1) if self.requests else 0,
+            # Открытые соединения: занятые запросами и простаивающие в keep-alive
+            'acquired': len(getattr(connector, '_acquired', ())),
+            'idle': sum(len(conns) for conns in getattr(connector, '_conns', {}).values()),
+        }
+
+
+class PooledSession(AiohttpSession):
+    """
+    Сессия Bot API с двумя пулами соединений: для обычных запросов и для загрузки файлов.
+
+    Запрос с файлом (multipart: send_photo / send_video / send_document с FSInputFile)
+    идет в пул 'upload' со своим лимитом соединений и длинным таймаутом, остальные -
+    в пул 'api'. Так десяток больших видео не заставляет ждать ответы на кнопки.
+
+    Одна сессия разделяется всеми ботами процесса (create_bot): соединения к
+    api.telegram.org переиспользуются, а настоящие пулы закрываются при закрытии
+    последнего бота.
+
+    Пример:
+        bot = create_bot(token)
+        print(bot.session.stats())
+    """
+
+    def __init__(self, limit: int = HTTP_LIMIT, upload_limit: int = HTTP_UPLOAD_LIMIT,
+                 keepalive: float = HTTP_KEEPALIVE, dns_ttl: int = HTTP_DNS_TTL,
+                 connect_timeout: float = HTTP_CONNECT_TIMEOUT, timeout: float = HTTP_TIMEOUT,
+                 upload_timeout: float = HTTP_UPLOAD_TIMEOUT, **kwargs: Any):
+        super().__init__(limit=limit, timeout=timeout, **kwargs)
+        self.keepalive = keepalive
+        self.dns_ttl = dns_ttl
+        self.connect_timeout = connect_timeout
+        self.pools = {'api': _Pool(limit, timeout), 'upload': _Pool(upload_limit, upload_timeout)}
+        self.users = 0
+
+    async def _pool_session(self, pool: _Pool) -> ClientSession:
+        if self._should_reset_connector:
+            await self._close_pools()
+            self._should_reset_connector = False
+
+        if pool.session is None or pool.session.closed:
+            # Все запросы идут на один хост, поэтому limit_per_host совпадает с limit
+            connector_init = {**self._connector_init, 'limit': pool.limit, 'limit_per_host': pool.limit,
+                              'keepalive_timeout': self.keepalive, 'ttl_dns_cache': self.dns_ttl}
+            pool.session = ClientSession(connector=self._connector_type(**connector_init),
+                                         headers={USER_AGENT: f"{SERVER_SOFTWARE} aiogram/{aiogram_version}"})
+        return pool.session
+
+    async def create_session(self) -> ClientSession:
+        # Используется aiogram для скачивания файлов (stream_content) - это пул загрузок
+        return await self._pool_session(self.pools['upload'])
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[TelegramType],
+                           timeout: Optional[int] = None) -> TelegramType:
+        url = self.api.api_url(token=bot.token, method=method.__api_method__)
+        form = self.build_form_data(bot=bot, method=method)
+        pool = self.pools['upload' if form.is_multipart else 'api']
+        session = await self._pool_session(pool)
+        # Явный timeout (getUpdates передает свой) важнее таймаута пула
+        client_timeout = ClientTimeout(total=pool.timeout if timeout is None else timeout,
+                                       sock_connect=self.connect_timeout)
+
+        pool.requests += 1
+        pool.in_flight += 1
+        pool.peak_in_flight = max(pool.peak_in_flight, pool.in_flight)
+        started = time.monotonic()
+        try:
+            async with session.post(url, data=form, timeout=client_timeout) as resp:
+                raw_result = await resp.text()
+        except asyncio.TimeoutError as e:
+            pool.timeouts += 1
+            raise TelegramNetworkError(method=method, message="Request timeout error") from e
+        except ClientError as e:
+            pool.errors += 1
+            raise TelegramNetworkError(method=method, message=f"{type(e).__name__}: {e}") from e
+        finally:
+            pool.in_flight -= 1
+            pool.total_time += time.monotonic() - started
+
+        response = self.check_response(bot=bot, method=method, status_code=resp.status, content=raw_result)
+        return response.result
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Счетчики пулов: запросы, ошибки, таймауты, среднее время, открытые соединения."""
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+    async def _close_pools(self) -> None:
+        closed = False
+        for pool in self.pools.values():
+            if pool.session is not None and not pool.session.closed:
+                await pool.session.close()
+                closed = True
+        if closed:
+            # Даем SSL-соединениям закрыться (как в AiohttpSession.close)
+            await asyncio.sleep(0.25)
+
+    async def close(self) -> None:
+        """Закрывает пулы, когда закрыт последний бот, использующий сессию."""
+        self.users = max(self.users - 1, 0)
+        if self.users == 0:
+            await self._close_pools()
+
+
+# Общая сессия всех ботов процесса
+shared_session = PooledSession()
@@ -0,0 +1,260 @@
+import asyncio
+import bisect
+import hashlib
+import multiprocessing
+import os
+import queue
+import time
+from typing import Any, Dict, Hashable, Iterable, List, Optional
+from modules.bot.session import shared_session
+from modules.configs import config
+
+# Сколько процессов-воркеров запускает супервизор (по умолчанию - по числу ядер)
+SHARD_WORKERS = getattr(config, 'SHARD_WORKERS', os.cpu_count() or 1)
+# Как часто воркер отправляет супервизору отчет о здоровье (секунды)
+SHARD_HEALTH_INTERVAL = getattr(config, 'SHARD_HEALTH_INTERVAL', 5)
+# Пауза перед перезапуском упавшего воркера растет от 1 до SHARD_MAX_BACKOFF секунд;
+# если воркер проработал дольше SHARD_MAX_BACKOFF, она снова начинается с 1
+SHARD_MAX_BACKOFF = getattr(config, 'SHARD_MAX_BACKOFF', 60)
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+
+def token_bot_id(token: str) -> str:
+    """id бота - часть токена до двоеточия (не секрет, в отличие от остального токена)."""
+    return token.split(':', 1)[0]
+
+
+class HashRing:
+    """
+    Консистентное хеширование: ключ (id бота) всегда попадает на один и тот же узел,
+    а при изменении числа узлов переезжает только ~1/N ключей.
+
+    Пример:
+        ring = HashRing(range(4))
+        worker = ring.node('123456789')
+    """
+
+    def __init__(self, nodes: Iterable[Hashable], replicas: int = 100):
+        self._ring = sorted((_hash(f'{node}:{i}'), node) for node in nodes for i in range(replicas))
+        self._hashes = [point for point, _ in self._ring]
+
+    def node(self, key: Any) -> Hashable:
+        index = bisect.bisect(self._hashes, _hash(str(key))) % len(self._ring)
+        return self._ring[index][1]
+
+
+class _Worker:
+    """Состояние одного воркера в супервизоре."""
+
+    def __init__(self, index: int, tokens: List[str]):
+        self.index = index
+        self.tokens = tokens
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.started_at = 0.0
+        self.next_start = 0.0
+        self.failures = 0
+        self.restarts = 0
+        self.report: Dict[str, Any] = {}
+        self.reported_at = 0.0
+
+
+class ShardSupervisor:
+    """
+    Раскладывает ботов по процессам-воркерам и следит за ними.
+
+    Бот попадает на воркер по консистентному хешу своего id, поэтому после перезапуска
+    (и при небольшом изменении числа воркеров) он остается на своем воркере. Каждый
+    воркер - отдельный процесс со своим event loop, поэтому медленные обработчики
+    одного бота не задерживают ботов на других воркерах.
+
+    Упавший воркер перезапускается с растущей паузой. Воркеры присылают отчеты
+    (очереди обновлений каждого бота, пулы соединений) через multiprocessing.Queue,
+    health() собирает их в одну сводку.
+
+    Без списка токенов каждый воркер сам читает таблицу bots (BotPool) и берет своих
+    ботов по тому же хешу: добавленный в админке бот запускается без перезапуска воркеров.
+
+    Пример:
+        supervisor = ShardSupervisor(workers=4)
+        lifecycle.add_step('воркеры', supervisor.stop)
+        await lifecycle.run(supervisor.run())
+    """
+
+    def __init__(self, tokens: Optional[Iterable[str]] = None, workers: int = SHARD_WORKERS):
+        self.ring = HashRing(range(workers))
+        # Без списка токенов воркеры берут ботов из таблицы bots и следят за ее изменениями
+        self.static = tokens is not None
+        self.workers = {index: _Worker(index, []) for index in range(workers)}
+        for token in tokens or ():
+            self.workers[self.ring.node(token_bot_id(token))].tokens.append(token)
+        # spawn: воркер начинает с чистого процесса, без унаследованного event loop и соединений
+        self._context = multiprocessing.get_context('spawn')
+        self.reports = self._context.Queue()
+
+    def _start(self, worker: _Worker) -> None:
+        # daemon: воркеры завершаются вместе с супервизором; если его убили (SIGKILL), воркер
+        # сам замечает смену родителя (_watch_parent) - иначе перезапущенный супервизор
+        # запустил бы второй набор воркеров на тех же ботах (409 и двойная обработка)
+        worker.process = self._context.Process(target=run_worker, name=f'bot-worker-{worker.index}', daemon=True,
+                                               args=(worker.index, len(self.workers),
+                                                     worker.tokens if self.static else None, self.reports,
+                                                     os.getpid()))
+        worker.process.start()
+        worker.started_at = time.monotonic()
+
+    def _collect_reports(self) -> None:
+        while True:
+            try:
+                report = self.reports.get_nowait()
+            except queue.Empty:
+                return
+            worker = self.workers.get(report.get('worker'))
+            if worker is not None:
+                worker.report = report
+                worker.reported_at = time.monotonic()
+
+    def _check(self, worker: _Worker) -> None:
+        now = time.monotonic()
+        process = worker.process
+        if process is not None and process.is_alive():
+            return
+        if process is not None:
+            # Воркер упал: следующий запуск через паузу, которая растет, пока он падает часто
+            worker.failures = 1 if now - worker.started_at > SHARD_MAX_BACKOFF else worker.failures + 1
+            backoff = min(2 ** (worker.failures - 1), SHARD_MAX_BACKOFF)
+            worker.next_start = now + backoff
+            worker.process = None
+            worker.report = {}
+            print(f"Воркер #{worker.index} завершился с кодом {process.exitcode}, перезапуск через {backoff} с")
+        elif now >= worker.next_start:
+            if worker.started_at:
+                worker.restarts += 1
+            self._start(worker)
+
+    async def run(self) -> None:
+        """Запускает воркеры и перезапускает упавшие; работает до отмены."""
+        while True:
+            self._collect_reports()
+            for worker in self.workers.values():
+                if worker.tokens or not self.static:
+                    self._check(worker)
+            await asyncio.sleep(1)
+
+    async def stop(self, timeout: float = 10) -> int:
+        """
+        Останавливает воркеры по SIGTERM (каждый корректно завершает свои обработчики).
+        Кто не уложился в timeout, завершается принудительно; возвращает их число.
+        """
+        running = [worker.process for worker in self.workers.values()
+                   if worker.process is not None and worker.process.is_alive()]
+        for process in running:
+            process.terminate()
+        deadline = time.monotonic() + max(timeout - 1, 0)
+        while any(process.is_alive() for process in running) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        killed = 0
+        for process in running:
+            if process.is_alive():
+                process.kill()
+                killed += 1
+            # join блокирует - выполняем его в потоке, чтобы не останавливать event loop
+            await asyncio.to_thread(process.join, 1)
+        self._collect_reports()
+        return killed
+
+    def health(self) -> Dict[str, Any]:
+        """Сводка по воркерам: жив ли, перезапуски, давность отчета, очереди ботов."""
+        self._collect_reports()
+        now = time.monotonic()
+        workers = {}
+        totals = {'bots': 0, 'pending': 0, 'processed': 0, 'failed': 0}
+        for index, worker in self.workers.items():
+            if self.static and not worker.tokens:
+                continue
+            bots = worker.report.get('bots', {})
+            alive = worker.process is not None and worker.process.is_alive()
+            age = round(now - worker.reported_at, 1) if worker.reported_at else None
+            workers[index] = {
+                'pid': worker.process.pid if alive else None,
+                'alive': alive,
+                # Жив, но давно не присылал отчет - скорее всего, завис event loop
+                'stale': alive and now - max(worker.reported_at, worker.started_at) > SHARD_HEALTH_INTERVAL * 3,
+                'restarts': worker.restarts,
+                'report_age': age,
+                'bots': bots,
+                'session': worker.report.get('session', {}),
+            }
+            totals['bots'] += len(bots)
+            for snapshot in bots.values():
+                for key in ('pending', 'processed', 'failed'):
+                    totals[key] += snapshot.get(key, 0)
+        return {'workers': workers, 'totals': totals}
+
+
+def run_worker(index: int, workers: int, tokens: Optional[List[str]], reports: Any,
+               parent_pid: Optional[int] = None) -> None:
+    """Точка входа процесса-воркера."""
+    asyncio.run(_worker(index, workers, tokens, reports, parent_pid))
+
+
+async def _watch_parent(parent_pid: int, lifecycle: Any) -> None:
+    # Супервизор завершился, не остановив воркер (например, kill -9): родителем становится
+    # другой процесс. Воркер корректно останавливается сам
+    while os.getppid() == parent_pid:
+        await asyncio.sleep(1)
+    lifecycle.stop('супервизор завершился')
+
+
+async def _report_health(index: int, pool: Any, reports: Any) -> None:
+    while True:
+        reports.put({
+            'worker': index,
+            'pid': os.getpid(),
+            'bots': pool.snapshot(),
+            'session': shared_session.stats(),
+        })
+        await asyncio.sleep(SHARD_HEALTH_INTERVAL)
+
+
+async def _worker(index: int, workers: int, tokens: Optional[List[str]], reports: Any,
+                  parent_pid: Optional[int] = None) -> None:
+    # Импорт здесь: супервизору роутеры и кэши не нужны, их загружает только воркер
+    from modules.bot.bot import bot as default_bot, dp
+    from modules.bot.bot_pool import BotPool
+    from modules.bot.dispatcher import setup_dispatcher
+    from modules.bot.lifecycle import Lifecycle, flush_write_behind
+    from modules.utils.catalog import catalog
+    from modules.utils.bot_settings import bot_settings
+    from modules.utils.user_state import user_states
+
+    await catalog.start()
+    await user_states.start()
+    await bot_settings.start()
+    setup_dispatcher(dp)
+
+    # Воркер берет только своих ботов: тот же хеш, что и у супервизора
+    ring = HashRing(range(workers))
+    pool = BotPool(dp, owns=lambda token: ring.node(token_bot_id(token)) == index, tokens=tokens)
+
+    async def close_sessions(remaining: float) -> None:
+        # Сессия общая: пулы закрываются вместе с последним ботом (в том числе ботом из конфига)
+        await pool.close(remaining)
+        await default_bot.session.close()
+
+    lifecycle = Lifecycle()
+    lifecycle.add_step('обработчики обновлений', pool.drain)
+    lifecycle.add_step('on_shutdown', pool.emit_shutdown)
+    lifecycle.add_step('отложенные записи в БД', flush_write_behind)
+    lifecycle.add_step('кэш каталога', lambda remaining: catalog.stop())
+    lifecycle.add_step('кэш пользователей', lambda remaining: user_states.stop())
+    lifecycle.add_step('настройки ботов', lambda remaining: bot_settings.stop())
+    lifecycle.add_step('сессии ботов', close_sessions)
+
+    print(f"Воркер #{index} запущен (pid {os.getpid()})")
+    intake = [pool.serve(), _report_health(index, pool, reports)]
+    if parent_pid is not None:
+        intake.append(_watch_parent(parent_pid, lifecycle))
+    await lifecycle.run(asyncio.gather(*intake))
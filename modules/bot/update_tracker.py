@@ -0,0 +1,90 @@
+from collections import deque
+from typing import Deque, Set
+from modules.configs import config
+from modules.utils import db
+
+# Сколько последних update_id помнить для отсева повторов
+RECENT_UPDATES = 1000
+# Насколько update_id может быть ниже водяного знака, чтобы считаться повтором. Повторы после
+# перезапуска - это обновления, которые были в обработке (не больше MAX_PENDING_UPDATES) или в
+# последней пачке getUpdates (100). id, который ниже знака сильнее, - новая нумерация: после недели
+# без обновлений Telegram выбирает следующий update_id случайно, в том числе меньше прежних
+UPDATE_ID_RESET_GAP = getattr(config, 'UPDATE_ID_RESET_GAP', 2000)
+
+
+class UpdateTracker:
+    """
+    Отсев повторно доставленных обновлений (после перезапуска бота или повтора вебхука).
+
+    Хранит в bot_state "водяной знак" - update_id, до которого включительно все
+    обновления обработаны: минимальный из еще обрабатываемых минус 1, а если таких
+    нет - максимальный обработанный. Знак пишется через db.write_behind, то есть
+    пачкой раз в полсекунды, а не на каждое обновление. Обновления не новее знака
+    (но не дальше reset_gap от него) и недавно принятые (множество последних
+    RECENT_UPDATES id) отбрасываются. update_id намного ниже знака означает, что
+    Telegram начал нумерацию заново: знак опускается, обновление обрабатывается.
+
+    Используется UpdateScheduler: received() при приеме, done() после обработки.
+    """
+
+    def __init__(self, name: str, reset_gap: int = UPDATE_ID_RESET_GAP):
+        self.name = name
+        self.reset_gap = reset_gap
+        self.persisted = 0
+        self.max_done = 0
+        self._in_flight: Set[int] = set()
+        self._recent: Set[int] = set()
+        self._recent_order: Deque[int] = deque()
+        self.duplicates = 0
+        self.resets = 0
+        # Знак опущен после сброса нумерации и еще не записан в базу
+        self._lowered = False
+
+    async def load(self) -> int:
+        """Читает сохраненный водяной знак. Возвращает его (0, если бот запускается впервые)."""
+        row = await db.get_one_generic_async('bot_state', name=self.name)
+        self.persisted = self.max_done = row['value'] if row and row['value'] else 0
+        return self.persisted
+
+    @property
+    def watermark(self) -> int:
+        if self._in_flight:
+            return min(self._in_flight) - 1
+        return self.max_done
+
+    def received(self, update_id: int) -> bool:
+        """Отмечает обновление принятым. False - это повтор, обрабатывать не нужно."""
+        if update_id < self.watermark - self.reset_gap:
+            print(f"update_id {update_id} намного ниже обработанного {self.watermark}: "
+                  f"Telegram начал нумерацию заново")
+            self._reset(update_id)
+        if update_id <= self.persisted or update_id in self._recent:
+            self.duplicates += 1
+            return False
+        self._recent.add(update_id)
+        self._recent_order.append(update_id)
+        if len(self._recent_order) > RECENT_UPDATES:
+            self._recent.discard(self._recent_order.popleft())
+        self._in_flight.add(update_id)
+        return True
+
+    def _reset(self, update_id: int) -> None:
+        # Обновления старой нумерации, которые еще обрабатываются, на знак больше не влияют (см. done)
+        self.resets += 1
+        self.persisted = self.max_done = update_id - 1
+        self._in_flight.clear()
+        self._recent.clear()
+        self._recent_order.clear()
+        self._lowered = True
+
+    async def done(self, update_id: int) -> None:
+        if update_id not in self._in_flight:
+            # Принято до сброса нумерации
+            return
+        self._in_flight.discard(update_id)
+        self.max_done = max(self.max_done, update_id)
+        watermark = self.watermark
+        if watermark > self.persisted or self._lowered:
+            self.persisted = watermark
+            self._lowered = False
+            await db.write_behind.upsert('bot_state', ['name'], ['name', 'value'], [self.name, watermark])
@@ -0,0 +1,103 @@
+import asyncio
+import hmac
+import secrets
+from typing import Optional
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from modules.bot.scheduler import MAX_PENDING_UPDATES, UpdateScheduler
+from modules.configs import config
+
+# Публичный адрес вебхука (https://example.com/webhook). Пустой - set_webhook не вызывается,
+# сервер просто принимает POST-запросы (удобно для локальной проверки записанными обновлениями)
+WEBHOOK_URL = getattr(config, 'WEBHOOK_URL', '')
+WEBHOOK_PATH = getattr(config, 'WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = getattr(config, 'WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = getattr(config, 'WEBHOOK_PORT', 8080)
+# Секрет, который Telegram присылает в заголовке X-Telegram-Bot-Api-Secret-Token.
+# Пустой при заданном WEBHOOK_URL - при запуске генерируется случайный; без проверки
+# секрета сервер работает только локально (WEBHOOK_URL пустой)
+WEBHOOK_SECRET = getattr(config, 'WEBHOOK_SECRET', '')
+# Сколько одновременных соединений Telegram может открыть к вебхуку (1-100)
+WEBHOOK_MAX_CONNECTIONS = getattr(config, 'WEBHOOK_MAX_CONNECTIONS', 40)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """
+    Прием обновлений через вебхук вместо long polling.
+
+    На каждый POST сразу отвечает 200 (Telegram не ждет обработки и не повторяет
+    доставку), а обновление передается в UpdateScheduler - как и при polling:
+    те же роутеры и middleware, параллельно по чатам, по порядку внутри чата.
+    Если в очередях уже MAX_PENDING_UPDATES обновлений, отвечает 503, и Telegram
+    доставит обновление повторно.
+
+    Локальная проверка (WEBHOOK_URL пустой):
+        curl -X POST localhost:8080/webhook -H 'X-Telegram-Bot-Api-Secret-Token: <секрет>' -d @update.json
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, scheduler: UpdateScheduler, secret: str = WEBHOOK_SECRET,
+                 path: str = WEBHOOK_PATH):
+        self.bot = bot
+        self.dp = dp
+        self.scheduler = scheduler
+        self.secret = secret
+        self.path = path
+        self._runner: Optional[web.AppRunner] = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        # compare_digest - чтобы время сравнения не выдавало совпавшую часть секрета.
+        # Сравниваются байты: строки с не-ASCII символами compare_digest не принимает
+        # (aiohttp декодирует заголовки с surrogateescape, поэтому кодируем так же)
+        received = request.headers.get(SECRET_HEADER, '').encode('utf-8', 'surrogateescape')
+        if self.secret and not hmac.compare_digest(received, self.secret.encode('utf-8')):
+            return web.Response(status=401)
+        # Очереди переполнены: не принимаем обновление, Telegram повторит доставку позже
+        # (как polling, который при переполнении перестает забирать новые обновления)
+        if self.scheduler.pending >= MAX_PENDING_UPDATES:
+            return web.Response(status=503, headers={'Retry-After': '1'})
+        try:
+            update = Update.model_validate(await request.json(), context={'bot': self.bot})
+        except Exception as e:
+            print(f"Некорректное обновление в вебхуке: {e}")
+            return web.Response(status=400)
+
+        self.scheduler.submit(update)
+        return web.Response(status=200)
+
+    async def start(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT, url: str = WEBHOOK_URL) -> None:
+        if url and not self.secret:
+            # Публичный вебхук без секрета принял бы поддельные обновления от кого угодно.
+            # Секрет задается до открытия порта, чтобы ни один запрос не прошел без проверки
+            self.secret = secrets.token_urlsafe(32)
+            print("WEBHOOK_SECRET не задан - для вебхука сгенерирован случайный секрет")
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        await self.dp.emit_startup(bot=self.bot, dispatcher=self.dp, bots=[self.bot], **self.dp.workflow_data)
+        if url:
+            await self.bot.set_webhook(url=url, secret_token=self.secret,
+                                       allowed_updates=self.dp.resolve_used_update_types(),
+                                       max_connections=WEBHOOK_MAX_CONNECTIONS)
+        print(f"Вебхук слушает {host}:{port}{self.path}" + (f", адрес для Telegram: {url}" if url else ""))
+
+    async def stop(self) -> None:
+        """
+        Перестает принимать запросы. Уже принятые обновления дожидается вызывающий (scheduler.drain),
+        он же после этого вызывает on_shutdown (lifecycle.emit_shutdown).
+        """
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def serve(self) -> None:
+        """Запускает сервер и работает до отмены (Ctrl+C), затем корректно останавливается."""
+        await self.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.stop()
@@ -1,14 +1,23 @@
 from aiogram import Router
-from aiogram import F
 from aiogram.types import Message, FSInputFile
 import os
-from modules.utils.bot_fn import inline_menu, tg_hyperlink
+from modules.utils.bot_fn import compile_keyboard, tg_hyperlink
 from modules.utils.messages_provider import send
-from modules.bot.bot import bot
+from modules.bot.context import bot
 from modules.utils import db
+from modules.utils.catalog import catalog
+from modules.utils.callback_codec import CallbackFilter, PAY, DOWNLOAD, CHECK_PAY
+from modules.utils.locks import purchase_locks, CallbackDedupMiddleware
 from modules.utils.payment import yoomoney_pay, yoomoney_pay_check
 
 router = Router()
+# Двойное нажатие "Оплатить" / "Проверить оплату" не должно создавать второй платеж или второй раз слать файл
+router.callback_query.middleware(CallbackDedupMiddleware())
+
+# Ссылка на оплату у каждого платежа своя - кэш готовых клавиатур не нужен
+PAYMENT_KEYBOARD = compile_keyboard(cache_size=0,
+                                    line_1=[("Перейти 🔗", "{url}")], width_1=2,
+                                    line_2=[("Проверить оплату ✔", "{check_data}")], width_2=1)
 
 async def send_media_file(user_id, file_path, file_type, caption=None):
     """
@@ -42,7 +51,7 @@ async def send_media_file(user_id, file_path, file_type, caption=None):
         return False
 
 async def send_product(user_id, product_id, caption=None):
-    product_data = await db.get_one_generic_async(table='products', id=product_id)
+    product_data = await catalog.get(product_id)
     unique_product_id = product_data['unique_product_id']
     file_type = product_data['file_type']
     product_title = product_data['title']
@@ -63,74 +72,72 @@ async def send_product(user_id, product_id, caption=None):
         message_to_user = await bot.send_message(chat_id=user_id, text=f"Файл не найден. Мы уже работаем над этим")
         await send(user_id, message=message_to_user)
 
-@router.callback_query(F.data.startswith(("pay:", "download:")))
-async def handle_pay(message: Message):
+@router.callback_query(CallbackFilter(PAY, DOWNLOAD))
+async def handle_pay(message: Message, callback_data):
     
     user_id = message.from_user.id
+    product_id = callback_data.product_id
     
-    action = message.data.split(":")[0]
-    product_id = message.data.split(":")[1]
-    
-    product_data = await db.get_one_generic_async(table='products', id=product_id)
+    card = await catalog.card(product_id)
     
-    if not product_data:
+    if not card:
         await message.answer("Продукт не найден")
         return
     
-    markup = None
-    
-    product_price = product_data['price']
-    product_discount = product_data['discount']
-    product_title = product_data['title']
-    product_is_free = product_data['is_free']
-    
-    end_price = int(product_price-(product_price/100*product_discount))
-    product_is_free = product_is_free if product_is_free or end_price<=0 else False
-    
-    if action == "pay" and not product_is_free:
-        
-        payment_data = yoomoney_pay(end_price, product_title)
-        confirmation_url = payment_data['confirmation_url']
-        hyperlink = await tg_hyperlink(confirmation_url, str(confirmation_url)[8:])
-        payment_id = payment_data['payment_id']
+    # Пока идет оплата или выдача этого продукта пользователю, следующее нажатие ждет
+    async with purchase_locks(user_id, product_id):
         
-        markup = await inline_menu(line_1=[(f"Перейти 🔗", confirmation_url)], width_1=2,
-                                   line_2=[(f"Проверить оплату ✔", f'check_pay:{payment_id}:{product_id}')], width_2=1)
-        text = f"⬇️ <b>Перейдите по ссылке для покупки</b> ⬇️\n\n<i>{hyperlink}</i>"
-        
-        message_to_user = await bot.send_message(chat_id=user_id, text=text, reply_markup=markup)
-        await send(user_id, message=message_to_user)
+        markup = None
         
-        purchased_data = await db.get_one_generic_async(table='purchased', user_id=user_id, product_id=product_id)
-        if not purchased_data:
-            await db.insert_async(['product_id', 'user_id', 'step', 'paid'], [product_id, user_id, 'create_link', 0], table='purchased')
-        
-    else:
-        await send_product(user_id=user_id, product_id=product_id)
+        if callback_data.schema is PAY and not card.is_free:
+            
+            payment_data = yoomoney_pay(card.end_price, card.title)
+            confirmation_url = payment_data['confirmation_url']
+            hyperlink = await tg_hyperlink(confirmation_url, str(confirmation_url)[8:])
+            payment_id = payment_data['payment_id']
+            
+            markup = PAYMENT_KEYBOARD.render(url=confirmation_url,
+                                             check_data=CHECK_PAY.pack(payment_id=payment_id, product_id=product_id))
+            text = f"⬇️ <b>Перейдите по ссылке для покупки</b> ⬇️\n\n<i>{hyperlink}</i>"
+            
+            message_to_user = await bot.send_message(chat_id=user_id, text=text, reply_markup=markup)
+            await send(user_id, message=message_to_user)
+            
+            await db.insert_ignore_async(['product_id', 'user_id', 'step', 'paid'], [product_id, user_id, 'create_link', 0], table='purchased')
+            
+        else:
+            await send_product(user_id=user_id, product_id=product_id)
         
         
-@router.callback_query(F.data.startswith(("check_pay:")))
-async def handle_pay(message: Message):
+@router.callback_query(CHECK_PAY.filter())
+async def handle_pay(message: Message, callback_data):
      
     user_id = message.from_user.id
-    _, payment_id, product_id = message.data.split(':')
-    
-    check_result = yoomoney_pay_check(payment_id=payment_id)
+    payment_id, product_id = callback_data.payment_id, callback_data.product_id
     
-    purchased_data = await db.get_one_generic_async(table='purchased', user_id=user_id, product_id=product_id)
-    if not purchased_data:
-            await db.insert_async(['product_id', 'user_id', 'step', 'paid'], [product_id, user_id, 'check', 0], table='purchased')
-    
-    if check_result:
-        await send_product(user_id=user_id, product_id=product_id)
+    async with purchase_locks(user_id, product_id):
         
-        await db.update_generic_async(table='purchased', columns=['step', 'paid'],
-                                      values=['success_check', 1], user_id=user_id, product_id=product_id)
+        # Оплату уже подтвердила предыдущая проверка - файл отправлен, второй раз не шлем
+        purchased_data = await db.get_one_generic_async('purchased', user_id=user_id, product_id=product_id)
+        if purchased_data and purchased_data['paid']:
+            await message.answer("Оплата уже подтверждена, файл отправлен")
+            return
         
-    else:
-        text = "<b>Проверка не пройдена</b>\n\n<i>Обычно оплата проходит в течении 5-30 секунд\nПодождите и попробуйте проверить еще</i>\n\nЕсли вы оплатили, но проверка всё еще не проходит, напишите об этом\n\n<b>Поддержка ответит в ближайшее время</b>"
-        message_to_user = await bot.send_message(chat_id=user_id, text=text)
-        await send(user_id, message=message_to_user)
+        check_result = yoomoney_pay_check(payment_id=payment_id)
         
-        await db.update_generic_async(table='purchased', columns=['step', 'paid'],
-                                      values=['unsuccess_check', 0], user_id=user_id, product_id=product_id)
\ No newline at end of file
+        if check_result:
+            await send_product(user_id=user_id, product_id=product_id)
+            
+            # Отложенный статус неудачной проверки не должен перезаписать успешную оплату
+            await db.write_behind.discard('purchased', user_id=user_id, product_id=product_id)
+            await db.upsert_async('purchased', ['user_id', 'product_id'], ['product_id', 'user_id', 'step', 'paid'],
+                                  [product_id, user_id, 'success_check', 1])
+            
+        else:
+            text = "<b>Проверка не пройдена</b>\n\n<i>Обычно оплата проходит в течении 5-30 секунд\nПодождите и попробуйте проверить еще</i>\n\nЕсли вы оплатили, но проверка всё еще не проходит, напишите об этом\n\n<b>Поддержка ответит в ближайшее время</b>"
+            message_to_user = await bot.send_message(chat_id=user_id, text=text)
+            await send(user_id, message=message_to_user)
+            
+            # Неудачные проверки частые и некритичные - пишем их через буфер отложенной записи
+            await db.write_behind.upsert('purchased', ['user_id', 'product_id'], ['product_id', 'user_id', 'step', 'paid'],
+                                         [product_id, user_id, 'unsuccess_check', 0])
\ No newline at end of file
@@ -0,0 +1,99 @@
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Tuple
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from modules.configs import config
+
+# {тип обновления: (сколько обновлений, за сколько секунд)}. Типы, которых здесь нет, не ограничиваются
+THROTTLE_LIMITS = getattr(config, 'THROTTLE_LIMITS', {
+    'message': (20, 10),
+    'callback_query': (10, 5),
+})
+THROTTLE_TEXT = getattr(config, 'THROTTLE_TEXT',
+                        "Слишком много сообщений подряд. Подождите несколько секунд, лишние сообщения не будут доставлены")
+# Как часто удалять окна пользователей, которые давно ничего не присылали
+SWEEP_INTERVAL = 60
+
+
+class _Window:
+    __slots__ = ('times', 'notified')
+
+    def __init__(self, limit: int):
+        # Время последних limit обновлений: самое старое выпадает само
+        self.times = deque(maxlen=limit)
+        self.notified = False
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware для dp.update: скользящее окно на пользователя и тип обновления.
+
+    Обновления сверх лимита отбрасываются, пользователь один раз получает
+    предупреждение (повторно - только после того, как окно освободится).
+    Администраторы, модераторы и сообщения из супергруппы не ограничиваются,
+    поэтому регистрировать его нужно после UserStateMiddleware.
+
+    Память - по одному окну на активного пользователя: окна, которые не
+    использовались дольше своего периода, удаляются раз в SWEEP_INTERVAL секунд.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[int, float]] = None, exempt_chat_ids=()):
+        self.limits = limits if limits is not None else THROTTLE_LIMITS
+        for event_type, (count, period) in self.limits.items():
+            # Окно на 0 обновлений не может быть заполнено; чтобы не ограничивать тип - уберите его из лимитов
+            if count < 1 or period <= 0:
+                raise ValueError(f"THROTTLE_LIMITS['{event_type}']: нужно не меньше 1 обновления "
+                                 f"за положительное число секунд, указано ({count}, {period})")
+        self.exempt_chat_ids = set(exempt_chat_ids)
+        self.windows: Dict[Tuple[int, str], _Window] = {}
+        self.dropped = 0
+        self._last_sweep = time.monotonic()
+
+    async def __call__(self,
+                       handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: Update,
+                       data: Dict[str, Any]) -> Any:
+        limit = self.limits.get(event.event_type)
+        user = data.get('event_from_user')
+        if limit is None or user is None:
+            return await handler(event, data)
+
+        chat = data.get('event_chat')
+        state = data.get('user_state')
+        # Супергруппы бота (super_group_ids задает BotContextMiddleware) тоже не ограничиваются
+        if chat and (chat.id in self.exempt_chat_ids or chat.id in data.get('super_group_ids', ())):
+            return await handler(event, data)
+        if state and (state.is_admin or state.is_moderator):
+            return await handler(event, data)
+
+        now = time.monotonic()
+        if now - self._last_sweep > SWEEP_INTERVAL:
+            self._sweep(now)
+
+        count, period = limit
+        key = (user.id, event.event_type)
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows[key] = _Window(count)
+
+        if len(window.times) == count and now - window.times[0] < period:
+            self.dropped += 1
+            if not window.notified:
+                window.notified = True
+                try:
+                    await data['bot'].send_message(chat_id=user.id, text=THROTTLE_TEXT)
+                except Exception as e:
+                    print(f"Ошибка при отправке предупреждения о флуде пользователю {user.id}: {e}")
+            return None
+
+        window.times.append(now)
+        window.notified = False
+        return await handler(event, data)
+
+    def _sweep(self, now: float) -> None:
+        self._last_sweep = now
+        idle = [key for key, window in self.windows.items()
+                if now - window.times[-1] > self.limits[key[1]][1]]
+        for key in idle:
+            del self.windows[key]
@@ -0,0 +1,36 @@
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from modules.utils.user_state import user_states, DEFAULT_STATE
+
+
+class UserStateMiddleware(BaseMiddleware):
+    """
+    Внешний middleware для dp.update: не пропускает к обработчикам заблокированных
+    пользователей и передает обработчикам флаги пользователя в аргументе user_state.
+
+    Флаги берутся из кэша user_states, поэтому проверка не обращается к базе.
+
+    Пример обработчика:
+        @router.message(Command("stats"))
+        async def stats(message: Message, user_state: UserState):
+            if not user_state.is_admin:
+                return
+    """
+
+    async def __call__(self,
+                       handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: Update,
+                       data: Dict[str, Any]) -> Any:
+        user = data.get('event_from_user')
+        state = await user_states.get(user.id) if user else DEFAULT_STATE
+        if state.banned:
+            # Убираем "часики" на кнопке, иначе пользователь видит зависшее нажатие
+            if event.callback_query:
+                try:
+                    await event.callback_query.answer("Доступ ограничен")
+                except Exception as e:
+                    print(f"Ошибка при ответе заблокированному пользователю {user.id}: {e}")
+            return None
+        data['user_state'] = state
+        return await handler(event, data)
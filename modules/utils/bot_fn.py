@@ -9,6 +9,8 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 import secrets
 import string
+import numpy as np
+from functools import lru_cache
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 
 async def inline_menu(**kwargs) -> InlineKeyboardMarkup:
@@ -177,6 +179,95 @@ async def inline_menu(**kwargs) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=combined_keyboard)
 
 
+def _compile_string(value: str):
+    """
+    Строка с {полями} превращается в format_map, статическая - в готовую строку.
+    Полем считается только {имя} (идентификатор): {}, {0} и одиночные скобки в
+    статической строке остаются как есть, {{ }} в обоих случаях дают одиночные скобки.
+    """
+    try:
+        fields = {name for _, name, _, _ in string.Formatter().parse(value) if name}
+    except ValueError:
+        fields = set()
+    if any(name.isidentifier() for name in fields):
+        return value.format_map, fields
+    return value.replace('{{', '{').replace('}}', '}'), set()
+
+
+class KeyboardTemplate:
+    """
+    Заранее разобранная inline-клавиатура с подстановками {поле} в тексте и данных кнопок.
+
+    Создается через compile_keyboard() один раз (обычно на уровне модуля), а render()
+    собирает InlineKeyboardMarkup за один проход без InlineKeyboardBuilder.
+    Готовые клавиатуры кэшируются по набору параметров (LRU), клавиатура без полей
+    собирается один раз при компиляции.
+
+    Возвращаемая клавиатура общая для всех вызовов с теми же параметрами - не изменяйте ее
+    на месте (inline_menu(message_markup=...) создает новые кнопки и безопасен).
+    """
+
+    def __init__(self, rows: List[List[Tuple[str, str]]], cache_size: int = 256):
+        self.fields = set()
+        self._rows = []
+        for row in rows:
+            compiled_row = []
+            for text, data in row:
+                text, text_fields = _compile_string(text)
+                data, data_fields = _compile_string(data)
+                self.fields |= text_fields | data_fields
+                compiled_row.append((text, data))
+            self._rows.append(compiled_row)
+        self._render_cached = lru_cache(maxsize=cache_size)(self._render)
+        self._static = None if self.fields else self._render(())
+
+    def render(self, **params) -> InlineKeyboardMarkup:
+        """Клавиатура с подставленными параметрами (значения должны быть хэшируемыми: str, int)."""
+        if self._static is not None:
+            return self._static
+        return self._render_cached(tuple(sorted(params.items())))
+
+    def _render(self, items: Tuple[Tuple[str, object], ...]) -> InlineKeyboardMarkup:
+        params = dict(items)
+        keyboard = []
+        for row in self._rows:
+            buttons = []
+            for text, data in row:
+                if not isinstance(text, str):
+                    text = text(params)
+                if not isinstance(data, str):
+                    data = data(params)
+                # Как и в inline_menu: ссылка - url-кнопка, остальное - callback_data
+                if data.startswith(('http://', 'https://')):
+                    buttons.append(InlineKeyboardButton(text=text, url=data))
+                else:
+                    buttons.append(InlineKeyboardButton(text=text, callback_data=data))
+            keyboard.append(buttons)
+        return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+def compile_keyboard(cache_size: int = 256, **kwargs) -> KeyboardTemplate:
+    """
+    Компилирует шаблон клавиатуры с теми же line_{N} / width_{N}, что и в inline_menu.
+    В тексте и данных кнопок можно использовать поля {name}, литеральные скобки - {{ }}.
+
+    Пример:
+        PAY_KEYBOARD = compile_keyboard(
+            line_1=[("Оплатить", "pay:{product_id}"), ("Сайт", "{site_url}")], width_1=2,
+        )
+        markup = PAY_KEYBOARD.render(product_id=5, site_url="https://example.com")
+    """
+    rows = []
+    i = 1
+    while isinstance(kwargs.get(f'line_{i}'), list):
+        buttons = kwargs[f'line_{i}']
+        width = kwargs.get(f'width_{i}', 1)
+        # Разбиваем кнопки строки по ширине, как builder.adjust(width)
+        rows.extend(buttons[j:j + width] for j in range(0, len(buttons), width))
+        i += 1
+    return KeyboardTemplate(rows, cache_size=cache_size)
+
+
 def generate_secure_uuid(length=12):
     characters = string.ascii_letters + string.digits
     return ''.join(secrets.choice(characters) for _ in range(length))
@@ -235,6 +326,108 @@ async def get_series(dates):
         last_streak = 0
     return SimpleNamespace(max_streak=max_streak, last_streak=last_streak)
 
+def day_arrays(rows):
+    """
+    Строки db.get_day_numbers -> (user_ids, days): два массива NumPy, по элементу на день.
+    Номера дней всех пользователей разбираются одним вызовом, без цикла по датам.
+    """
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    users = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    counts = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+    # Разбор текста целиком в C - без промежуточного списка строк
+    days = np.fromstring(','.join(row[2] for row in rows), dtype=np.int64, sep=',')
+    return np.repeat(users, counts), days
+
+async def get_series_batch(user_ids, dates, today=None, as_arrays=False):
+    """
+    То же, что get_series, но сразу для многих пользователей (для рейтингов).
+
+    Параметры:
+    --------------------------------
+    - user_ids: последовательность id пользователей, по одному на каждую дату
+    - dates: дни - строки "YYYY-MM-DD" / даты (повторы допускаются) или массив NumPy
+      с номерами дней от 1970-01-01 (целые или datetime64[D])
+    - today: дата отсчета текущей серии (по умолчанию сегодня)
+    - as_arrays: вернуть массивы вместо словаря
+
+    Быстрее всего - массивы из day_arrays(await db.get_day_numbers(table)): они
+    используются как есть. Списки строк и дат сначала переводятся в массивы, и это
+    самая долгая часть.
+
+    Возвращает:
+    --------------------------------
+    {user_id: SimpleNamespace(max_streak, last_streak)} для каждого пользователя из user_ids,
+    а с as_arrays - SimpleNamespace(user_ids, max_streak, last_streak) из массивов одной длины.
+
+    Даты переводятся в номера дней (datetime64), пары (пользователь, день) сводятся
+    к одному числу и сортируются, после чего серии - это участки, где день больше
+    предыдущего ровно на 1.
+    Все шаги выполняются над массивами NumPy, без цикла по датам.
+
+    Пример:
+        user_ids, days = day_arrays(await db.get_day_numbers('records'))
+        series = await get_series_batch(user_ids, days, as_arrays=True)
+    """
+    if len(dates) == 0:
+        if as_arrays:
+            empty = np.empty(0, dtype=np.int64)
+            return SimpleNamespace(user_ids=empty, max_streak=empty, last_streak=empty)
+        return {}
+
+    days = np.asarray(dates)
+    if days.dtype.kind not in 'iu':
+        days = days.astype('datetime64[D]')
+    days = days.astype(np.int64)
+    user_ids = np.asarray(user_ids)
+    if user_ids.dtype.kind not in 'iu':
+        # Нечисловые id заменяем номерами
+        user_index, user_ids = np.unique(user_ids, return_inverse=True)
+    else:
+        user_index = None
+
+    # Один ключ (пользователь, день) вместо сортировки по двум колонкам
+    first_day = days.min()
+    span = int(days.max() - first_day) + 2
+    keys = user_ids.astype(np.int64) * span + (days - first_day)
+    # Данные из get_daily_counts уже отсортированы и без повторов - тогда сортировка не нужна
+    if not np.all(keys[1:] > keys[:-1]):
+        keys = np.sort(keys)
+        keys = keys[np.r_[True, keys[1:] != keys[:-1]]]
+    user_codes, days = np.divmod(keys, span)
+    days += first_day
+
+    # Новая серия начинается со сменой пользователя или при пропуске дня
+    run_start = np.ones(len(days), dtype=bool)
+    run_start[1:] = (user_codes[1:] != user_codes[:-1]) | (days[1:] - days[:-1] != 1)
+    starts = np.flatnonzero(run_start)
+    lengths = np.diff(np.append(starts, len(days)))
+    run_users = user_codes[starts]
+    run_first_day = days[starts]
+    run_last_day = run_first_day + lengths - 1
+
+    # Самая длинная серия: максимум по сериям каждого пользователя (серии идут подряд по пользователям)
+    user_changed = np.r_[True, run_users[1:] != run_users[:-1]]
+    user_first_run = np.flatnonzero(user_changed)
+    max_streak = np.maximum.reduceat(lengths, user_first_run)
+
+    # Текущая серия: та, что содержит сегодня, а если такой нет - вчера (как в get_series)
+    today = np.datetime64(today or datetime.today().date(), 'D').astype(np.int64)
+    # Номер пользователя для каждой серии - позиция в max_streak
+    run_user_pos = np.cumsum(user_changed) - 1
+    last_streak = np.zeros(len(user_first_run), dtype=np.int64)
+    for day in (today - 1, today):
+        contains = (run_first_day <= day) & (run_last_day >= day)
+        last_streak[run_user_pos[contains]] = day - run_first_day[contains] + 1
+
+    users = run_users[user_first_run]
+    if user_index is not None:
+        users = user_index[users]
+    if as_arrays:
+        return SimpleNamespace(user_ids=users, max_streak=max_streak, last_streak=last_streak)
+    return {user: SimpleNamespace(max_streak=max_len, last_streak=last_len)
+            for user, max_len, last_len in zip(users.tolist(), max_streak.tolist(), last_streak.tolist())}
+
 async def keyboard_menu(**kwargs):
 
 	#Пример
@@ -0,0 +1,58 @@
+from typing import Dict, List, Optional
+from modules.configs import config
+from modules.utils import db
+from modules.utils.watched_cache import WatchedCache
+
+
+class BotSettingsCache(WatchedCache):
+    """
+    Строки таблицы bots в памяти: настройки каждого бота мультибота (супергруппа и т.п.).
+
+    Ключ - id бота из токена (часть до двоеточия), а если токена нет - столбец bot_id.
+    Перечитывается по счетчику 'bots', как и BotPool. Для бота без строки в таблице
+    (бот из конфига) действуют значения из конфига.
+
+    Пример:
+        group_id = bot_settings.super_group_id(bot.id)
+        shards = bot_settings.super_group_ids(bot.id)
+    """
+
+    counter_name = 'bots'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rows: Dict[int, db.DatabaseRow] = {}
+
+    async def _reload(self) -> None:
+        rows = {}
+        for row in await db.get_all_generic_async('bots'):
+            token = row.get('bot_token') or ''
+            key = token.split(':', 1)[0] if ':' in token else row.get('bot_id')
+            try:
+                rows[int(key)] = row
+            except (TypeError, ValueError):
+                continue
+        self.rows = rows
+
+    def get(self, bot_id: int) -> Optional[db.DatabaseRow]:
+        return self.rows.get(bot_id)
+
+    def super_group_id(self, bot_id: int) -> Optional[int]:
+        """Основная супергруппа поддержки бота: из bots.super_group_id, иначе SUPER_GROUP_ID из конфига."""
+        row = self.rows.get(bot_id)
+        return (row and row.get('super_group_id')) or getattr(config, 'SUPER_GROUP_ID', None)
+
+    def super_group_ids(self, bot_id: int) -> List[int]:
+        """
+        Все супергруппы (шарды) бота: основная и SUPER_GROUP_IDS из конфига.
+        У бота со своей супергруппой в таблице bots шард один - эта супергруппа.
+        """
+        primary = self.super_group_id(bot_id)
+        row = self.rows.get(bot_id)
+        if row and row.get('super_group_id'):
+            return [primary]
+        extra = [group_id for group_id in getattr(config, 'SUPER_GROUP_IDS', ()) if group_id != primary]
+        return [primary, *extra] if primary is not None else extra
+
+
+bot_settings = BotSettingsCache()
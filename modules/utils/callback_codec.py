@@ -0,0 +1,152 @@
+import base64
+import uuid
+from collections import namedtuple
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+from aiogram.filters import Filter
+from aiogram.types import CallbackQuery
+
+# Версия формата: первый символ кода схемы. Смена формата - новая версия, старые кнопки
+# в уже отправленных сообщениях разбираются по старым правилам или как legacy.
+VERSION = '1'
+SEPARATOR = ':'
+# Ограничение Telegram на callback_data
+MAX_LENGTH = 64
+
+_BASE36 = '0123456789abcdefghijklmnopqrstuvwxyz'
+# Метка строки, которая не является UUID и хранится в поле 'uuid' как есть
+_RAW_MARK = '~'
+
+# {префикс: (схема, legacy)} - по первой части callback_data схема находится одним поиском в словаре
+_registry: Dict[str, Tuple['CallbackSchema', bool]] = {}
+
+
+def _int_to_base36(value: int) -> str:
+    if value < 0:
+        return '-' + _int_to_base36(-value)
+    digits = []
+    while True:
+        value, rest = divmod(value, 36)
+        digits.append(_BASE36[rest])
+        if not value:
+            return ''.join(reversed(digits))
+
+
+def _uuid_to_short(value) -> str:
+    try:
+        raw = uuid.UUID(str(value)).bytes
+    except ValueError:
+        return _RAW_MARK + str(value)
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _short_to_uuid(value: str) -> str:
+    if value.startswith(_RAW_MARK):
+        return value[1:]
+    return str(uuid.UUID(bytes=base64.urlsafe_b64decode(value + '==')))
+
+
+# Тип поля: (кодирование, декодирование, декодирование legacy-формата)
+FIELD_TYPES = {
+    'int': (_int_to_base36, lambda value: int(value, 36), int),
+    'str': (str, str, str),
+    # UUID (например, id платежа ЮKassa): 36 символов -> 22
+    'uuid': (_uuid_to_short, _short_to_uuid, str),
+}
+
+
+class CallbackSchema:
+    """
+    Описание callback_data кнопки: короткий код и типизированные поля.
+
+    Формат: <версия><код>:<поле>:<поле>..., числа в base36, UUID в 22 символах base64.
+    Например, CHECK_PAY.pack(payment_id='2419a771-000f-5000-9000-1edaf29243f2', product_id=15)
+    дает '1c:JBmncQAPUACQAB7a8pJD8g:f' (27 байт вместо 49 у 'check_pay:<uuid>:15').
+
+    legacy - прежний текстовый префикс ('pay'), чтобы кнопки в уже отправленных
+    сообщениях ('pay:15') продолжали работать.
+    """
+
+    def __init__(self, name: str, code: str, legacy: Optional[str] = None, **fields: str):
+        self.name = name
+        self.prefix = VERSION + code
+        self.fields = fields
+        for prefix, is_legacy in ((self.prefix, False), (legacy, True)):
+            if prefix is None:
+                continue
+            if prefix in _registry:
+                raise ValueError(f"Префикс callback_data '{prefix}' уже занят схемой {_registry[prefix][0].name}")
+            _registry[prefix] = (self, is_legacy)
+        self._encoders = [FIELD_TYPES[field_type][0] for field_type in fields.values()]
+        self._decoders = [FIELD_TYPES[field_type][1] for field_type in fields.values()]
+        self._legacy_decoders = [FIELD_TYPES[field_type][2] for field_type in fields.values()]
+        base = namedtuple(f'{name.title().replace("_", "")}Data', list(fields))
+        # Значение знает свою схему: callback_data.schema is PAY
+        self.value_type = type(base.__name__, (base,), {'__slots__': (), 'schema': self})
+
+    def pack(self, **values) -> str:
+        """Собирает callback_data. Ошибка, если не хватает полей или строка длиннее 64 байт."""
+        parts = [self.prefix]
+        for (field, _), encode in zip(self.fields.items(), self._encoders):
+            part = encode(values[field])
+            if SEPARATOR in part:
+                raise ValueError(f"Поле {field} схемы {self.name} не может содержать '{SEPARATOR}'")
+            parts.append(part)
+        data = SEPARATOR.join(parts)
+        if len(data.encode('utf-8')) > MAX_LENGTH:
+            raise ValueError(f"callback_data длиннее {MAX_LENGTH} байт: {data}")
+        return data
+
+    def filter(self) -> 'CallbackFilter':
+        return CallbackFilter(self)
+
+
+@lru_cache(maxsize=4096)
+def decode(data: str):
+    """
+    Разбирает callback_data в значение схемы (namedtuple с атрибутом schema).
+    Неизвестная или испорченная строка - None. Результат кэшируется: повторные
+    нажатия той же кнопки и проверки нескольких фильтров не разбирают строку заново.
+    """
+    prefix, _, rest = data.partition(SEPARATOR)
+    entry = _registry.get(prefix)
+    if entry is None:
+        return None
+    schema, is_legacy = entry
+    parts = rest.split(SEPARATOR) if rest else []
+    if len(parts) != len(schema.fields):
+        return None
+    decoders = schema._legacy_decoders if is_legacy else schema._decoders
+    try:
+        return schema.value_type(*(decoder(part) for decoder, part in zip(decoders, parts)))
+    except ValueError:
+        return None
+
+
+class CallbackFilter(Filter):
+    """
+    Фильтр aiogram: пропускает callback одной из схем и передает в обработчик
+    разобранное значение как аргумент callback_data.
+
+    Пример:
+        @router.callback_query(CallbackFilter(PAY, DOWNLOAD))
+        async def handle_pay(message: CallbackQuery, callback_data):
+            if callback_data.schema is PAY: ...
+    """
+
+    def __init__(self, *schemas: CallbackSchema):
+        self.schemas = frozenset(schemas)
+
+    async def __call__(self, query: CallbackQuery):
+        if not query.data:
+            return False
+        value = decode(query.data)
+        if value is None or value.schema not in self.schemas:
+            return False
+        return {'callback_data': value}
+
+
+# Схемы кнопок бота. Коды должны быть уникальны - повтор вызывает ошибку при импорте.
+PAY = CallbackSchema('pay', 'p', legacy='pay', product_id='int')
+DOWNLOAD = CallbackSchema('download', 'd', legacy='download', product_id='int')
+CHECK_PAY = CallbackSchema('check_pay', 'c', legacy='check_pay', payment_id='uuid', product_id='int')
@@ -0,0 +1,95 @@
+from typing import Dict, Optional, Tuple
+from modules.bot.context import current_bot
+from modules.utils import db
+from modules.utils.watched_cache import WatchedCache
+from modules.utils.product_card import ProductCard, render_card
+
+
+class ProductCatalog(WatchedCache):
+    """
+    Кэш таблицы products в памяти бота: поиск по id и по link без запросов к базе.
+
+    Перезагружается целиком, когда админка меняет products (счетчик 'products'
+    увеличивается триггерами из schema.TRIGGERS). Вместе с данными пересобираются
+    готовые карточки продуктов (product_card.ProductCard).
+
+    В мультиботе у каждого бота своя витрина: при обработке обновления видны продукты
+    этого бота (products.product_bot = id бота) и общие (product_bot пустой), а ссылка
+    сначала ищется среди продуктов бота. Вне обработки обновления видны все продукты.
+
+    Пример:
+        product_data = await catalog.get(product_id)
+        product_data = await catalog.get_by_link('main')
+        card = await catalog.card(product_id)
+    """
+
+    counter_name = 'products'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.by_id: Dict[int, db.DatabaseRow] = {}
+        self.by_link: Dict[str, db.DatabaseRow] = {}
+        # {(product_bot или '', link): продукт}
+        self.bot_links: Dict[Tuple[str, str], db.DatabaseRow] = {}
+        self.cards: Dict[int, ProductCard] = {}
+
+    async def _reload(self) -> None:
+        products = await db.get_all_generic_async('products')
+        by_id = {}
+        by_link = {}
+        bot_links = {}
+        cards = {}
+        for product in products:
+            if product.get('price') is None:
+                # Без цены продукт нельзя ни продать, ни показать - в витрину не попадает
+                print(f"Продукт {product['id']} пропущен: не задана цена")
+                continue
+            by_id[product['id']] = product
+            try:
+                cards[product['id']] = render_card(product)
+            except Exception as e:
+                print(f"Ошибка при сборке карточки продукта {product['id']}: {e}")
+            if product.get('link'):
+                # При совпадении ссылок побеждает продукт с меньшим id, как и в прежнем запросе к базе
+                by_link.setdefault(product['link'], product)
+                bot_links.setdefault((str(product.get('product_bot') or ''), product['link']), product)
+        # Подменяем словари целиком, чтобы читатели не видели наполовину загруженный каталог
+        self.by_id, self.by_link, self.bot_links, self.cards = by_id, by_link, bot_links, cards
+        print(f"Каталог продуктов загружен: {len(by_id)} шт.")
+
+    @staticmethod
+    def _scope() -> Optional[str]:
+        # id бота, чье обновление обрабатывается (None - вне обработки обновления)
+        bot = current_bot.get()
+        return str(bot.id) if bot is not None else None
+
+    @staticmethod
+    def _visible(product: Optional[db.DatabaseRow], scope: Optional[str]) -> bool:
+        if product is None:
+            return False
+        owner = product.get('product_bot')
+        return scope is None or not owner or str(owner) == scope
+
+    async def get(self, product_id) -> Optional[db.DatabaseRow]:
+        """Продукт по id (id из callback_data приходит строкой)."""
+        await self.ensure_loaded()
+        try:
+            product = self.by_id.get(int(product_id))
+        except (TypeError, ValueError):
+            return None
+        return product if self._visible(product, self._scope()) else None
+
+    async def get_by_link(self, link: str) -> Optional[db.DatabaseRow]:
+        """Продукт по ссылке из deep link (/start p-<link>): сначала продукт бота, затем общий."""
+        await self.ensure_loaded()
+        scope = self._scope()
+        if scope is None:
+            return self.by_link.get(link)
+        return self.bot_links.get((scope, link)) or self.bot_links.get(('', link))
+
+    async def card(self, product_id) -> Optional[ProductCard]:
+        """Готовая карточка продукта (текст, цена, клавиатуры) по id."""
+        product = await self.get(product_id)
+        return self.cards.get(product['id']) if product is not None else None
+
+catalog = ProductCatalog()
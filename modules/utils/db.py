@@ -1,6 +1,17 @@
+import asyncio
 import aiosqlite
+import json
 import os
-from typing import List, Optional, Dict, Any, Tuple
+import re
+import time
+import zlib
+from bisect import bisect_left
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from itertools import count, islice
+from typing import List, Optional, Dict, Any, Tuple, Set, Iterable, Iterator, Sequence, AsyncIterator, Awaitable, Callable
 from modules.configs.config import DB_NAME
 
 
@@ -27,6 +38,294 @@ class DatabaseRow(dict):
     def __repr__(self):
         return f"{self.__class__.__name__}({super().__repr__()})"
 
+
+_SQL_WHITESPACE = re.compile(r'\s+')
+_SQL_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_SQL_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SQL_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(query: str) -> str:
+    """
+    Приводит запрос к "форме": литералы заменяются на ?, списки (?, ?, ?) сворачиваются в (?+).
+    Запросы, отличающиеся только значениями и длиной IN-списков, попадают в одну форму.
+    """
+    shape = _SQL_STRING_LITERAL.sub('?', query)
+    shape = _SQL_NUMBER_LITERAL.sub('?', shape)
+    shape = _SQL_PLACEHOLDER_LIST.sub('(?+)', shape)
+    return _SQL_WHITESPACE.sub(' ', shape).strip()
+
+
+class QueryStats:
+    """
+    Статистика запросов хелперов db.py: количество, суммарное время и гистограмма
+    задержек по каждой форме запроса (см. normalize_sql), плюс журнал медленных запросов.
+
+    По умолчанию выключена: пока enabled=False, обертка запроса делает одну проверку флага.
+
+    Для медленных запросов (дольше slow_ms) в журнал пишутся форма, время, типы параметров
+    (сами значения не сохраняются) и план EXPLAIN QUERY PLAN, который снимается один раз на форму.
+
+    Пример:
+        db.query_stats.enable(slow_ms=50)
+        ...
+        print(db.query_stats.dump())
+    """
+
+    # Верхние границы корзин гистограммы в миллисекундах
+    BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, float('inf'))
+
+    def __init__(self, slow_ms: float = 100, slow_log_size: int = 200):
+        self.enabled = False
+        self.slow_ms = slow_ms
+        self._shapes: Dict[str, Dict[str, Any]] = {}
+        self._plans: Dict[str, Optional[List[str]]] = {}
+        self.slow_log: deque = deque(maxlen=slow_log_size)
+        # Задачи снятия планов: ссылки держим, пока задача не завершится, иначе ее может собрать GC
+        self._plan_tasks: Set[asyncio.Task] = set()
+
+    def enable(self, slow_ms: Optional[float] = None) -> None:
+        if slow_ms is not None:
+            self.slow_ms = slow_ms
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def reset(self) -> None:
+        self._shapes.clear()
+        self._plans.clear()
+        self.slow_log.clear()
+
+    def record(self, query: str, values: Sequence[Any], elapsed: float, rows: int = 1) -> None:
+        """Учитывает выполненный запрос (elapsed в секундах, rows - сколько строк в executemany)."""
+        shape = normalize_sql(query)
+        elapsed_ms = elapsed * 1000
+        stats = self._shapes.get(shape)
+        if stats is None:
+            stats = self._shapes[shape] = {'count': 0, 'rows': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                                           'histogram': [0] * len(self.BUCKETS_MS)}
+        stats['count'] += 1
+        stats['rows'] += rows
+        stats['total_ms'] += elapsed_ms
+        stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+        stats['histogram'][bisect_left(self.BUCKETS_MS, elapsed_ms)] += 1
+
+        if elapsed_ms >= self.slow_ms:
+            self.slow_log.append({
+                'time': time.time(),
+                'shape': shape,
+                'elapsed_ms': round(elapsed_ms, 3),
+                'params': [type(value).__name__ for value in values] if values else [],
+                'plan': self._plans.get(shape),
+            })
+            if shape not in self._plans:
+                self._plans[shape] = None
+                task = asyncio.create_task(self._capture_plan(shape, query, values))
+                self._plan_tasks.add(task)
+                task.add_done_callback(self._plan_done)
+
+    def _plan_done(self, task: asyncio.Task) -> None:
+        self._plan_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Ошибка при снятии плана запроса: {task.exception()}")
+
+    async def _capture_plan(self, shape: str, query: str, values: Sequence[Any]) -> None:
+        # Отдельное соединение: план не должен мешать текущей транзакции и не попадает в статистику
+        try:
+            async with aiosqlite.connect(DB_NAME, isolation_level=None) as connection:
+                cursor = await connection.execute(f"EXPLAIN QUERY PLAN {query}", values or ())
+                plan = [row[-1] for row in await cursor.fetchall()]
+                await cursor.close()
+        except Exception as e:
+            plan = [f"Не удалось получить план: {e}"]
+        self._plans[shape] = plan
+        for entry in self.slow_log:
+            if entry['shape'] == shape and entry['plan'] is None:
+                entry['plan'] = plan
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Текущая статистика: формы запросов по убыванию суммарного времени и журнал медленных запросов."""
+        shapes = []
+        for shape, stats in sorted(self._shapes.items(), key=lambda item: item[1]['total_ms'], reverse=True):
+            shapes.append({
+                'shape': shape,
+                'count': stats['count'],
+                'rows': stats['rows'],
+                'total_ms': round(stats['total_ms'], 3),
+                'avg_ms': round(stats['total_ms'] / stats['count'], 3),
+                'max_ms': round(stats['max_ms'], 3),
+                'histogram': {('inf' if bound == float('inf') else f'<={bound}ms'): hits
+                              for bound, hits in zip(self.BUCKETS_MS, stats['histogram'])},
+                'plan': self._plans.get(shape),
+            })
+        return {'enabled': self.enabled, 'slow_ms': self.slow_ms, 'shapes': shapes, 'slow_log': list(self.slow_log)}
+
+    def dump(self, path: Optional[str] = None) -> str:
+        """Возвращает статистику в JSON и, если передан path, записывает ее в файл."""
+        report = json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(report)
+        return report
+
+
+query_stats = QueryStats()
+
+
+async def _execute(cursor: aiosqlite.Cursor, query: str, values: Sequence[Any] = ()) -> None:
+    """Выполняет запрос на курсоре, учитывая его в query_stats, если статистика включена."""
+    if not query_stats.enabled:
+        await cursor.execute(query, values)
+        return
+    started = time.perf_counter()
+    try:
+        await cursor.execute(query, values)
+    finally:
+        query_stats.record(query, values, time.perf_counter() - started)
+
+
+async def _executemany(cursor: aiosqlite.Cursor, query: str, rows: List[Sequence[Any]]) -> None:
+    """executemany с учетом в query_stats (параметры журнала берутся по первой строке)."""
+    if not query_stats.enabled:
+        await cursor.executemany(query, rows)
+        return
+    started = time.perf_counter()
+    try:
+        await cursor.executemany(query, rows)
+    finally:
+        query_stats.record(query, rows[0] if rows else (), time.perf_counter() - started, rows=len(rows))
+
+
+# Соединение открытой транзакции. Пока оно установлено, все хелперы модуля
+# выполняют запросы на нем и не делают автокоммит.
+_transaction_connection: ContextVar[Optional[aiosqlite.Connection]] = ContextVar('_transaction_connection', default=None)
+_savepoint_counter = count(1)
+
+# Сколько раз повторять BEGIN IMMEDIATE / COMMIT при SQLITE_BUSY и базовая пауза между попытками
+BUSY_RETRIES = 5
+BUSY_RETRY_DELAY = 0.05
+
+
+@asynccontextmanager
+async def _connect() -> AsyncIterator[aiosqlite.Connection]:
+    """Возвращает соединение текущей транзакции или открывает новое в режиме автокоммита."""
+    connection = _transaction_connection.get()
+    if connection is not None:
+        yield connection
+        return
+    async with aiosqlite.connect(DB_NAME, isolation_level=None) as connection:
+        yield connection
+
+
+async def _commit(connection: aiosqlite.Connection) -> None:
+    """Коммитит изменения, если запрос выполняется вне транзакции."""
+    if _transaction_connection.get() is None:
+        await connection.commit()
+
+
+def _is_busy_error(error: Exception) -> bool:
+    message = str(error).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+
+async def _retry_on_busy(operation: Callable[[], Awaitable[Any]], retries: int, delay: float) -> None:
+    """Выполняет operation, повторяя ее с нарастающей паузой, пока база занята (SQLITE_BUSY)."""
+    for attempt in range(retries + 1):
+        try:
+            await operation()
+            return
+        except aiosqlite.OperationalError as e:
+            if not _is_busy_error(e) or attempt == retries:
+                raise
+            await asyncio.sleep(delay * (2 ** attempt))
+
+
+class Transaction:
+    """
+    Открытая транзакция. Предоставляет те же хелперы, что и модуль db,
+    но все они выполняются на одном соединении внутри транзакции:
+
+        async with db.transaction() as tx:
+            await tx.update_generic_async('users', ['is_admin', 'is_moderator'], [0, 0], user_id=user_id)
+            await tx.update_generic_async('users', ['is_admin'], [1], user_id=user_id)
+    """
+
+    _API = (
+        'insert_async', 'insert_ignore_async', 'upsert_async', 'insert_many_async', 'update_many_async',
+        'upsert_many_async',
+        'update_generic_async', 'get_one_generic_async', 'get_all_generic_async', 'get_records_from_to_date',
+        'get_daily_counts', 'get_user_days', 'get_day_numbers', 'count_async', 'count_by_async',
+        'delete_generic_async', 'clear_table', 'update_clear', 'get_extreme_date_records',
+    )
+
+    def __init__(self, connection: aiosqlite.Connection, savepoint: Optional[str] = None):
+        self.connection = connection
+        self.savepoint = savepoint
+
+    def __getattr__(self, name):
+        if name in self._API:
+            return globals()[name]
+        raise AttributeError(f"'{self.__class__.__name__}' object has no attribute '{name}'")
+
+    async def execute(self, query: str, values: Sequence[Any] = ()) -> int:
+        """Выполняет произвольный запрос внутри транзакции и возвращает rowcount."""
+        cursor = await self.connection.cursor()
+        try:
+            await _execute(cursor, query, values)
+            return cursor.rowcount
+        finally:
+            await cursor.close()
+
+
+@asynccontextmanager
+async def transaction(retries: int = BUSY_RETRIES, retry_delay: float = BUSY_RETRY_DELAY) -> AsyncIterator[Transaction]:
+    """
+    Явная транзакция для многошаговых операций: BEGIN IMMEDIATE ... COMMIT на одном соединении.
+
+    - Все хелперы модуля, вызванные внутри блока (в том числе напрямую db.insert_async и т.п.),
+      выполняются на соединении транзакции.
+    - Вложенный transaction() превращается в SAVEPOINT: ошибка внутри откатывает только его.
+    - BEGIN IMMEDIATE и COMMIT повторяются при SQLITE_BUSY (retries раз, пауза удваивается).
+    - Любое исключение внутри блока откатывает транзакцию и пробрасывается дальше.
+
+    Дочерние задачи (asyncio.create_task), созданные внутри блока, тоже видят транзакцию,
+    поэтому не стоит запускать из нее фоновые задачи, работающие с базой.
+
+    Пример:
+        async with db.transaction() as tx:
+            await tx.update_generic_async('users', ['is_admin', 'is_moderator'], [0, 0], user_id=user_id)
+            await tx.update_generic_async('users', ['is_admin'], [1], user_id=user_id)
+    """
+    connection = _transaction_connection.get()
+
+    if connection is not None:
+        savepoint = f"sp_{next(_savepoint_counter)}"
+        await connection.execute(f"SAVEPOINT {savepoint}")
+        try:
+            yield Transaction(connection, savepoint)
+        except BaseException:
+            await connection.execute(f"ROLLBACK TO {savepoint}")
+            await connection.execute(f"RELEASE {savepoint}")
+            raise
+        await connection.execute(f"RELEASE {savepoint}")
+        return
+
+    async with aiosqlite.connect(DB_NAME, isolation_level=None) as connection:
+        await _retry_on_busy(lambda: connection.execute('BEGIN IMMEDIATE'), retries, retry_delay)
+        token = _transaction_connection.set(connection)
+        try:
+            yield Transaction(connection)
+            await _retry_on_busy(connection.commit, retries, retry_delay)
+        except BaseException:
+            if connection.in_transaction:
+                await connection.rollback()
+            raise
+        finally:
+            _transaction_connection.reset(token)
+
+
 async def ensure_database_exists() -> None:
     """
     Проверяет существование файла базы данных и создает его, если необходимо.
@@ -76,12 +375,40 @@ async def insert_async(columns: List[str], values: List[Any], table: str) -> Non
         values: Список значений для вставки.
         table: Имя таблицы.
     """
-    async with aiosqlite.connect(DB_NAME, isolation_level=None) as connection:
+    async with _connect() as connection:
         cursor = await connection.cursor()
         query = f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join(["?" for _ in columns])})'
         try:
-            await cursor.execute(query, values)
-            await connection.commit()
+            await _execute(cursor, query, values)
+            await _commit(connection)
+        except aiosqlite.Error as e:
+            print(f"Ошибка при вставке в таблицу {table}: {e}")
+            raise
+        finally:
+            await cursor.close()
+
+
+async def insert_ignore_async(columns: List[str], values: List[Any], table: str) -> bool:
+    """
+    Вставляет запись, если она не нарушает уникальный индекс (INSERT ... ON CONFLICT DO NOTHING).
+    Заменяет связку "get_one + insert если нет" одним атомарным запросом.
+
+    Args:
+        columns: Список имен столбцов.
+        values: Список значений для вставки.
+        table: Имя таблицы.
+
+    Returns:
+        True если запись вставлена, False если такая запись уже существовала.
+    """
+    async with _connect() as connection:
+        cursor = await connection.cursor()
+        query = (f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join(["?" for _ in columns])}) '
+                 f'ON CONFLICT DO NOTHING')
+        try:
+            await _execute(cursor, query, values)
+            await _commit(connection)
+            return cursor.rowcount > 0
         except aiosqlite.Error as e:
             print(f"Ошибка при вставке в таблицу {table}: {e}")
             raise
@@ -89,6 +416,51 @@ async def insert_async(columns: List[str], values: List[Any], table: str) -> Non
             await cursor.close()
 
 
+def _upsert_query(table: str, key_columns: List[str], columns: List[str],
+                  update_columns: Optional[List[str]] = None) -> str:
+    if update_columns is None:
+        update_columns = [col for col in columns if col not in key_columns]
+
+    conflict_clause = f'ON CONFLICT({", ".join(key_columns)}) '
+    if update_columns:
+        conflict_clause += 'DO UPDATE SET ' + ', '.join([f'{col}=excluded.{col}' for col in update_columns])
+    else:
+        conflict_clause += 'DO NOTHING'
+
+    return (f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join(["?" for _ in columns])}) '
+            f'{conflict_clause}')
+
+
+async def upsert_async(table: str, key_columns: List[str], columns: List[str], values: List[Any],
+                       update_columns: Optional[List[str]] = None) -> None:
+    """
+    Вставляет запись или обновляет существующую (INSERT ... ON CONFLICT(...) DO UPDATE).
+    Для key_columns в таблице должен существовать уникальный индекс (см. create_index_async).
+
+    Args:
+        table: Имя таблицы.
+        key_columns: Столбцы уникального ключа, по которым определяется конфликт.
+        columns: Список имен столбцов (должен включать key_columns).
+        values: Список значений для вставки.
+        update_columns: Столбцы, обновляемые при конфликте (по умолчанию все, кроме key_columns).
+
+    Пример:
+        await upsert_async('purchased', ['user_id', 'product_id'],
+                           ['user_id', 'product_id', 'step', 'paid'], [user_id, product_id, 'check', 0])
+    """
+    async with _connect() as connection:
+        cursor = await connection.cursor()
+        query = _upsert_query(table, key_columns, columns, update_columns)
+        try:
+            await _execute(cursor, query, values)
+            await _commit(connection)
+        except aiosqlite.Error as e:
+            print(f"Ошибка при upsert в таблицу {table}: {e}")
+            raise
+        finally:
+            await cursor.close()
+
+
 async def update_generic_async(table: str, columns: List[str], values: List[Any], **where_conditions: Any) -> None:
     """
     Обновляет записи в таблице по заданным условиям.
@@ -99,15 +471,15 @@ async def update_generic_async(table: str, columns: List[str], values: List[Any]
         values: Список значений для обновления.
         where_conditions: Условия для фильтрации записей.
     """
-    async with aiosqlite.connect(DB_NAME, isolation_level=None) as connection:
+    async with _connect() as connection:
         cursor = await connection.cursor()
         set_clause = ', '.join([f'{col}=?' for col in columns])
         where_clause = ' AND '.join([f'{key}=?' for key in where_conditions.keys()])
         query = f"UPDATE {table} SET {set_clause} WHERE {where_clause}"
         values = tuple(values + list(where_conditions.values()))
         try:
-            await cursor.execute(query, values)
-            await connection.commit()
+            await _execute(cursor, query, values)
+            await _commit(connection)
         except aiosqlite.Error as e:
             print(f"Ошибка при обновлении таблицы {table}: {e}")
             raise
@@ -115,6 +487,311 @@ async def update_generic_async(table: str, columns: List[str], values: List[Any]
             await cursor.close()
 
 
+def _chunked(rows: Iterable[Sequence[Any]], chunk_size: int) -> Iterator[List[Sequence[Any]]]:
+    """Разбивает поток строк на списки по chunk_size элементов."""
+    # Проверка сразу при вызове, а не на первой итерации: с chunk_size < 1 не было бы ни одной
+    # пачки, и insert_many_async / update_many_async молча ничего не записали бы
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size должен быть не меньше 1, указано {chunk_size}")
+    return _iter_chunks(iter(rows), chunk_size)
+
+
+def _iter_chunks(iterator: Iterator[Sequence[Any]], chunk_size: int) -> Iterator[List[Sequence[Any]]]:
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+async def insert_many_async(columns: List[str], rows: Iterable[Sequence[Any]], table: str,
+                            chunk_size: int = 500) -> int:
+    """
+    Массово вставляет записи через executemany в одной транзакции (один fsync на всю пачку).
+
+    Args:
+        columns: Список имен столбцов.
+        rows: Последовательность (или генератор) строк значений в порядке columns.
+        table: Имя таблицы.
+        chunk_size: Сколько строк передавать в один вызов executemany.
+
+    Returns:
+        Количество вставленных записей.
+    """
+    query = f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join(["?" for _ in columns])})'
+    inserted = 0
+    try:
+        async with transaction() as tx:
+            cursor = await tx.connection.cursor()
+            try:
+                for chunk in _chunked(rows, chunk_size):
+                    await _executemany(cursor, query, chunk)
+                    inserted += len(chunk)
+            finally:
+                await cursor.close()
+        return inserted
+    except aiosqlite.Error as e:
+        print(f"Ошибка при массовой вставке в таблицу {table}: {e}")
+        raise
+
+
+async def update_many_async(table: str, columns: List[str], where_columns: List[str],
+                            rows: Iterable[Sequence[Any]], chunk_size: int = 500) -> int:
+    """
+    Массово обновляет записи через executemany в одной транзакции.
+
+    Args:
+        table: Имя таблицы.
+        columns: Список столбцов для обновления.
+        where_columns: Столбцы условий (объединяются через AND).
+        rows: Строки значений: сначала значения для columns, затем для where_columns.
+        chunk_size: Сколько строк передавать в один вызов executemany.
+
+    Returns:
+        Количество обновленных записей.
+
+    Пример:
+        await update_many_async('purchased', ['step'], ['user_id', 'product_id'],
+                                [('success_check', 1, 5), ('success_check', 2, 5)])
+    """
+    set_clause = ', '.join([f'{col}=?' for col in columns])
+    where_clause = ' AND '.join([f'{col}=?' for col in where_columns])
+    query = f"UPDATE {table} SET {set_clause} WHERE {where_clause}"
+    updated = 0
+    try:
+        async with transaction() as tx:
+            cursor = await tx.connection.cursor()
+            try:
+                for chunk in _chunked(rows, chunk_size):
+                    await _executemany(cursor, query, chunk)
+                    updated += cursor.rowcount
+            finally:
+                await cursor.close()
+        return updated
+    except aiosqlite.Error as e:
+        print(f"Ошибка при массовом обновлении таблицы {table}: {e}")
+        raise
+
+
+async def upsert_many_async(table: str, key_columns: List[str], columns: List[str],
+                            rows: Iterable[Sequence[Any]], update_columns: Optional[List[str]] = None,
+                            chunk_size: int = 500) -> None:
+    """
+    Массовый upsert_async через executemany в одной транзакции.
+
+    Args:
+        table: Имя таблицы.
+        key_columns: Столбцы уникального ключа, по которым определяется конфликт.
+        columns: Список имен столбцов (должен включать key_columns).
+        rows: Строки значений в порядке columns.
+        update_columns: Столбцы, обновляемые при конфликте (по умолчанию все, кроме key_columns).
+        chunk_size: Сколько строк передавать в один вызов executemany.
+    """
+    query = _upsert_query(table, key_columns, columns, update_columns)
+    try:
+        async with transaction() as tx:
+            cursor = await tx.connection.cursor()
+            try:
+                for chunk in _chunked(rows, chunk_size):
+                    await _executemany(cursor, query, chunk)
+            finally:
+                await cursor.close()
+    except aiosqlite.Error as e:
+        print(f"Ошибка при массовом upsert в таблицу {table}: {e}")
+        raise
+
+
+class WriteBehindBuffer:
+    """
+    Отложенная запись для частых некритичных обновлений (шаги воронки, отметки активности и т.п.).
+
+    Обновления одной и той же строки склеиваются в памяти (побеждает последнее значение
+    каждого столбца) и сбрасываются в базу одной транзакцией раз в flush_interval_ms
+    или как только накопится max_batch строк. Если в очереди max_pending строк,
+    новая запись ждет сброса, так что память ограничена.
+
+    Записи, которые еще не сброшены, теряются при падении процесса, поэтому
+    буфер подходит только для данных, которые не жалко потерять. Если сброс пачки
+    не удался, строки пишутся по одной: ошибочная строка не задерживает остальные,
+    а после max_retries неудачных сбросов отбрасывается с сообщением в лог. Перед синхронной
+    записью в ту же строку нужно вызвать discard(), иначе отложенное значение
+    может перезаписать ее при следующем сбросе. При остановке бота нужно вызвать close().
+    Внутри transaction() буфер не ждет сброса (ограничение max_pending там не действует).
+
+    Пример:
+        await db.write_behind.update('purchased', ['step'], ['unsuccess_check'],
+                                     user_id=user_id, product_id=product_id)
+    """
+
+    def __init__(self, flush_interval_ms: int = 500, max_batch: int = 200, max_pending: int = 10000,
+                 max_retries: int = 5):
+        self.flush_interval_ms = flush_interval_ms
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        # (режим, таблица, ключ строки) -> {столбец: значение}
+        self._pending: Dict[Tuple[str, str, Tuple[Tuple[str, Any], ...]], Dict[str, Any]] = {}
+        # Сколько сбросов подряд не удалось для строки
+        self._failures: Dict[Tuple[str, str, Tuple[Tuple[str, Any], ...]], int] = {}
+        # Строки, отброшенные discard() во время текущего сброса: при неудаче их старые значения
+        # не возвращаются в очередь (discard внутри transaction() не ждет блокировку)
+        self._discarded: Set[Tuple[str, str, Tuple[Tuple[str, Any], ...]]] = set()
+        self.dropped = 0
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def update(self, table: str, columns: List[str], values: List[Any], **where_conditions: Any) -> None:
+        """Откладывает UPDATE table SET columns WHERE where_conditions."""
+        await self._put(('update', table, tuple(sorted(where_conditions.items()))), columns, values)
+
+    async def upsert(self, table: str, key_columns: List[str], columns: List[str], values: List[Any]) -> None:
+        """Откладывает upsert_async (для key_columns нужен уникальный индекс)."""
+        row = dict(zip(columns, values))
+        key = tuple(sorted((col, row.pop(col)) for col in key_columns))
+        await self._put(('upsert', table, key), list(row.keys()), list(row.values()))
+
+    async def discard(self, table: str, **where_conditions: Any) -> None:
+        """
+        Отбрасывает отложенные записи строки. Дожидается текущего сброса,
+        поэтому синхронная запись после discard() гарантированно будет последней.
+        """
+        key = tuple(sorted(where_conditions.items()))
+        if _transaction_connection.get() is not None:
+            # Внутри транзакции нельзя ждать фоновый сброс: он сам ждет блокировку этой транзакции
+            self._discard(table, key)
+            return
+        async with self._lock:
+            self._discard(table, key)
+
+    async def flush(self) -> int:
+        """
+        Сбрасывает все отложенные записи одной транзакцией. Возвращает количество записанных строк.
+        Если транзакция не удалась, строки пишутся по одной; неудачные возвращаются в очередь.
+        """
+        async with self._lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            self._discarded = set()
+
+            try:
+                await self._write(pending)
+            except asyncio.CancelledError:
+                self._requeue(pending)
+                raise
+            except Exception as e:
+                print(f"Ошибка при сбросе отложенных записей ({len(pending)} строк), пишем по одной: {e}")
+            else:
+                for key in pending:
+                    self._failures.pop(key, None)
+                return len(pending)
+
+            # Пачка не записалась: ищем строки с ошибкой, остальные записываем
+            written = 0
+            failed = {}
+            for key, row in pending.items():
+                try:
+                    await self._write({key: row})
+                except asyncio.CancelledError:
+                    self._requeue({key: row, **failed})
+                    raise
+                except Exception as e:
+                    attempts = self._failures.get(key, 0) + 1
+                    if attempts >= self.max_retries:
+                        mode, table, where = key
+                        self._failures.pop(key, None)
+                        self.dropped += 1
+                        print(f"Отложенная запись {mode} в {table} {dict(where)} {row} отброшена "
+                              f"после {attempts} неудачных попыток: {e}")
+                    else:
+                        self._failures[key] = attempts
+                        failed[key] = row
+                else:
+                    self._failures.pop(key, None)
+                    written += 1
+            self._requeue(failed)
+            return written
+
+    async def _write(self, pending: Dict[Tuple[str, str, Tuple[Tuple[str, Any], ...]], Dict[str, Any]]) -> None:
+        # Группируем строки с одинаковым набором столбцов, чтобы писать их через executemany
+        groups: Dict[Tuple[str, str, Tuple[str, ...], Tuple[str, ...]], List[List[Any]]] = {}
+        for (mode, table, key), row in pending.items():
+            key_columns = tuple(col for col, _ in key)
+            columns = tuple(row.keys())
+            groups.setdefault((mode, table, key_columns, columns), []).append(
+                [value for _, value in key] + list(row.values()) if mode == 'upsert'
+                else list(row.values()) + [value for _, value in key]
+            )
+
+        async with transaction():
+            for (mode, table, key_columns, columns), rows in groups.items():
+                if mode == 'upsert':
+                    await upsert_many_async(table, list(key_columns), list(key_columns + columns), rows)
+                else:
+                    await update_many_async(table, list(columns), list(key_columns), rows)
+
+    def _requeue(self, rows: Dict[Tuple[str, str, Tuple[Tuple[str, Any], ...]], Dict[str, Any]]) -> None:
+        # Значения, пришедшие во время сброса, новее; строки, отброшенные discard(), не возвращаем
+        for key, row in rows.items():
+            if key in self._discarded:
+                self._failures.pop(key, None)
+                continue
+            self._pending[key] = {**row, **self._pending.get(key, {})}
+
+    async def close(self) -> None:
+        """Останавливает фоновый сброс и записывает все, что осталось в очереди."""
+        if self._task is not None:
+            # Не отменяем задачу посреди сброса, а просим ее завершиться после текущего цикла
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._closing = False
+        await self.flush()
+
+    def _discard(self, table: str, key: Tuple[Tuple[str, Any], ...]) -> None:
+        for mode in ('update', 'upsert'):
+            self._pending.pop((mode, table, key), None)
+            self._discarded.add((mode, table, key))
+
+    async def _put(self, key: Tuple[str, str, Tuple[Tuple[str, Any], ...]], columns: List[str], values: List[Any]) -> None:
+        # Внутри transaction() ограничение мягкое: ожидание сброса там привело бы к взаимной блокировке
+        while (len(self._pending) >= self.max_pending and key not in self._pending
+               and _transaction_connection.get() is None):
+            await self.flush()
+        self._pending.setdefault(key, {}).update(zip(columns, values))
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        # Задача могла быть создана внутри transaction(): сбрасываем унаследованное соединение
+        _transaction_connection.set(None)
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval_ms / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Ошибка при отложенной записи в базу данных: {e}")
+            if self._closing:
+                return
+
+
+# Общий буфер отложенной записи (используется только там, где его вызывают явно)
+write_behind = WriteBehindBuffer()
+
+
 async def get_one_generic_async(table: str, get_random: bool = False, **kwargs: Any) -> Optional[DatabaseRow]:
     """
     Получает одну запись из таблицы по заданным условиям.
@@ -130,7 +807,7 @@ async def get_one_generic_async(table: str, get_random: bool = False, **kwargs:
         И как к атрибутам: row.key
     """
     get_random_clause = 'ORDER BY RANDOM() LIMIT 1' if get_random else ''
-    async with aiosqlite.connect(DB_NAME, isolation_level=None) as connection:
+    async with _connect() as connection:
         connection.row_factory = aiosqlite.Row
         cursor = await connection.cursor()
         conditions = " AND ".join([f"{key} = ?" for key in kwargs.keys()])
@@ -138,7 +815,7 @@ async def get_one_generic_async(table: str, get_random: bool = False, **kwargs:
         where_clause = f"WHERE {conditions}" if conditions else ""
         query = f"SELECT * FROM {table} {where_clause} {get_random_clause}"
         try:
-            await cursor.execute(query, values)
+            await _execute(cursor, query, values)
             result = await cursor.fetchone()
             if result:
                 # Преобразуем aiosqlite.Row в DatabaseRow для поддержки .get() и атрибутов
@@ -160,13 +837,16 @@ async def get_all_generic_async(table: str, limit: Optional[int] = None, **kwarg
         limit: Максимальное количество возвращаемых записей (опционально).
         **kwargs: Условия фильтрации (ключ=значение).
 
+    Для больших таблиц объявите индекс schema.date_index(table, [колонки фильтров]),
+    а для подсчетов по дням используйте get_daily_counts.
+
     Returns:
         Список DatabaseRow с данными записей.
         Каждый элемент поддерживает обращение как к словарю: row['key'], row.get('key')
         И как к атрибутам: row.key
     """
     limit_clause = f' LIMIT {limit}' if limit else ''
-    async with aiosqlite.connect(DB_NAME, isolation_level=None) as connection:
+    async with _connect() as connection:
         connection.row_factory = aiosqlite.Row
         cursor = await connection.cursor()
         conditions = " AND ".join([f"{key} = ?" for key in kwargs.keys()])
@@ -174,7 +854,7 @@ async def get_all_generic_async(table: str, limit: Optional[int] = None, **kwarg
         where_clause = f"WHERE {conditions}" if conditions else ""
         query = f"SELECT * FROM {table} {where_clause}{limit_clause}"
         try:
-            await cursor.execute(query, values)
+            await _execute(cursor, query, values)
             results = await cursor.fetchall()
             # Преобразуем каждую строку в DatabaseRow
             return [DatabaseRow(dict(row)) for row in results]
@@ -185,6 +865,31 @@ async def get_all_generic_async(table: str, limit: Optional[int] = None, **kwarg
             await cursor.close()
             
             
+def _date_condition(column: str, date_val: Any, conditions: List[str], values: List[Any]) -> None:
+    """Добавляет условие по дате в формате аргумента date из get_records_from_to_date."""
+    if isinstance(date_val, (list, tuple)):
+        # список дат (IN)
+        if len(date_val) > 0 and all(isinstance(x, str) for x in date_val):
+            placeholders = ",".join(["?"] * len(date_val))
+            conditions.append(f"{column} IN ({placeholders})")
+            values.extend(date_val)
+        else:
+            # диапазон
+            start, end = (tuple(date_val) + (None, None))[:2]
+            if start and end:
+                conditions.append(f"{column} BETWEEN ? AND ?")
+                values.extend([start, end])
+            elif start:
+                conditions.append(f"{column} >= ?")
+                values.append(start)
+            elif end:
+                conditions.append(f"{column} <= ?")
+                values.append(end)
+    elif date_val:
+        conditions.append(f"{column} = ?")
+        values.append(date_val)
+
+
 async def get_records_from_to_date(table, limit=None, **kwargs) -> List[DatabaseRow]:
     
     """
@@ -197,6 +902,9 @@ async def get_records_from_to_date(table, limit=None, **kwargs) -> List[Database
       - date=(None, "2025-07-25")          -> date <= ...
       - date=["2025-05-13","2025-05-25"]   -> IN (...)
     
+    Для больших таблиц объявите индекс schema.date_index(table, [колонки фильтров]),
+    а для подсчетов по дням используйте get_daily_counts.
+
     Returns:
         Список DatabaseRow с данными записей.
         Каждый элемент поддерживает обращение как к словарю: row['key'], row.get('key')
@@ -215,42 +923,147 @@ async def get_records_from_to_date(table, limit=None, **kwargs) -> List[Database
         values.append(value)
 
     # обработка date
-    if isinstance(date_val, (list, tuple)):
-        # список дат (IN)
-        if len(date_val) > 0 and all(isinstance(x, str) for x in date_val):
-            placeholders = ",".join(["?"] * len(date_val))
-            conditions.append(f"date IN ({placeholders})")
-            values.extend(date_val)
-        else:
-            # диапазон
-            start, end = (date_val + (None, None))[:2]
-            if start and end:
-                conditions.append("date BETWEEN ? AND ?")
-                values.extend([start, end])
-            elif start:
-                conditions.append("date >= ?")
-                values.append(start)
-            elif end:
-                conditions.append("date <= ?")
-                values.append(end)
-    elif date_val:
-        conditions.append("date = ?")
-        values.append(date_val)
+    _date_condition('date', date_val, conditions, values)
 
     where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
     query = f"SELECT * FROM {table} {where_clause} ORDER BY date ASC{limit_clause}"
 
-    async with aiosqlite.connect(DB_NAME, isolation_level=None) as connection:
+    async with _connect() as connection:
         connection.row_factory = aiosqlite.Row
         cursor = await connection.cursor()
         try:
-            await cursor.execute(query, tuple(values))
+            await _execute(cursor, query, tuple(values))
             rows = await cursor.fetchall()
             return [DatabaseRow(dict(r)) for r in rows]
         finally:
             await cursor.close()
 
 
+async def get_daily_counts(table: str, user_id: Optional[int] = None, date: Any = None,
+                           user_column: str = 'user_id') -> List[DatabaseRow]:
+    """
+    Количество событий по дням из таблицы {table}_daily (см. schema.daily_rollup).
+
+    Args:
+        table: Исходная таблица событий (не сама _daily).
+        user_id: Пользователь; None - все пользователи.
+        date: Фильтр по дню в том же формате, что и в get_records_from_to_date.
+
+    Returns:
+        Список DatabaseRow (user_id, day, events), отсортированный по пользователю и дню.
+    """
+    conditions = []
+    values = []
+    if user_id is not None:
+        conditions.append(f"{user_column} = ?")
+        values.append(user_id)
+    _date_condition('day', date, conditions, values)
+
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f"SELECT {user_column}, day, events FROM {table}_daily {where_clause} ORDER BY {user_column}, day"
+
+    async with _connect() as connection:
+        connection.row_factory = aiosqlite.Row
+        cursor = await connection.cursor()
+        try:
+            await _execute(cursor, query, tuple(values))
+            return [DatabaseRow(dict(r)) for r in await cursor.fetchall()]
+        except aiosqlite.Error as e:
+            print(f"Ошибка при получении дневной статистики {table}: {e}")
+            raise
+        finally:
+            await cursor.close()
+
+
+async def get_user_days(table: str, user_id: int, date: Any = None, user_column: str = 'user_id') -> List[str]:
+    """
+    Дни ("YYYY-MM-DD"), в которые у пользователя были события, по возрастанию.
+    Готовый вход для bot_fn.get_series.
+    """
+    return [row['day'] for row in await get_daily_counts(table, user_id, date, user_column)]
+
+
+async def get_day_numbers(table: str, date: Any = None, user_column: str = 'user_id') -> List[Tuple[int, int, str]]:
+    """
+    Дни с событиями всех пользователей из {table}_daily одной строкой на пользователя:
+    (user_id, количество дней, "номера дней через запятую"). Номер дня - число дней
+    с 1970-01-01 (как у datetime64[D]), дни идут по возрастанию.
+
+    Строк столько, сколько пользователей, а не дней, и строку с номерами NumPy разбирает
+    целиком (bot_fn.day_arrays) - готовый вход для bot_fn.get_series_batch.
+    """
+    conditions = []
+    values = []
+    _date_condition('day', date, conditions, values)
+
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    # julianday('1970-01-01') = 2440587.5
+    query = (f"SELECT {user_column}, COUNT(*), group_concat(day_number) FROM "
+             f"(SELECT {user_column}, CAST(julianday(day) - 2440587.5 AS INTEGER) AS day_number "
+             f"FROM {table}_daily {where_clause} ORDER BY {user_column}, day) "
+             f"GROUP BY {user_column} ORDER BY {user_column}")
+
+    async with _connect() as connection:
+        cursor = await connection.cursor()
+        try:
+            await _execute(cursor, query, tuple(values))
+            return await cursor.fetchall()
+        except aiosqlite.Error as e:
+            print(f"Ошибка при получении дней {table}: {e}")
+            raise
+        finally:
+            await cursor.close()
+
+
+async def count_async(table: str, where: Optional[str] = None, **kwargs: Any) -> int:
+    """
+    Количество записей с условиями фильтрации (ключ=значение) и дополнительным условием where -
+    готовым SQL из кода (не из пользовательского ввода), например 'topic_id IS NULL'.
+
+    Пример:
+        await count_async('users', where='topic_id IS NULL')
+    """
+    conditions = [f"{key} = ?" for key in kwargs.keys()]
+    if where:
+        conditions.append(f"({where})")
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f"SELECT COUNT(*) FROM {table} {where_clause}"
+
+    async with _connect() as connection:
+        cursor = await connection.cursor()
+        try:
+            await _execute(cursor, query, tuple(kwargs.values()))
+            return (await cursor.fetchone())[0]
+        except aiosqlite.Error as e:
+            print(f"Ошибка при подсчете записей в таблице {table}: {e}")
+            raise
+        finally:
+            await cursor.close()
+
+
+async def count_by_async(table: str, column: str, **kwargs: Any) -> Dict[Any, int]:
+    """
+    Количество записей для каждого значения column (GROUP BY) с условиями фильтрации.
+
+    Пример:
+        await count_by_async('users', 'super_group_id')  # {-100123: 5120, -100456: 4980, None: 12}
+    """
+    conditions = " AND ".join([f"{key} = ?" for key in kwargs.keys()])
+    where_clause = f"WHERE {conditions}" if conditions else ""
+    query = f"SELECT {column}, COUNT(*) FROM {table} {where_clause} GROUP BY {column}"
+
+    async with _connect() as connection:
+        cursor = await connection.cursor()
+        try:
+            await _execute(cursor, query, tuple(kwargs.values()))
+            return {value: count for value, count in await cursor.fetchall()}
+        except aiosqlite.Error as e:
+            print(f"Ошибка при подсчете записей в таблице {table}: {e}")
+            raise
+        finally:
+            await cursor.close()
+
+
 async def delete_generic_async(table: str, **kwargs: Any) -> None:
     """
     Удаляет записи из таблицы по заданным условиям.
@@ -259,15 +1072,15 @@ async def delete_generic_async(table: str, **kwargs: Any) -> None:
         table: Имя таблицы.
         **kwargs: Условия фильтрации (ключ=значение).
     """
-    async with aiosqlite.connect(DB_NAME, isolation_level=None) as connection:
+    async with _connect() as connection:
         cursor = await connection.cursor()
         conditions = " AND ".join([f"{key} = ?" for key in kwargs.keys()])
         values = tuple(kwargs.values())
         where_clause = f"WHERE {conditions}" if conditions else ""
         query = f"DELETE FROM {table} {where_clause}"
         try:
-            await cursor.execute(query, values)
-            await connection.commit()
+            await _execute(cursor, query, values)
+            await _commit(connection)
         except aiosqlite.Error as e:
             print(f"Ошибка при удалении из таблицы {table}: {e}")
             raise
@@ -282,12 +1095,12 @@ async def clear_table(table: str) -> None:
     Args:
         table: Имя таблицы.
     """
-    async with aiosqlite.connect(DB_NAME, isolation_level=None) as connection:
+    async with _connect() as connection:
         cursor = await connection.cursor()
         query = f"DELETE FROM {table}"
         try:
-            await cursor.execute(query)
-            await connection.commit()
+            await _execute(cursor, query)
+            await _commit(connection)
         except aiosqlite.Error as e:
             print(f"Ошибка при очистке таблицы {table}: {e}")
             raise
@@ -304,13 +1117,13 @@ async def update_clear(table: str, columns: List[str], values: List[Any]) -> Non
         columns: Список столбцов для обновления.
         values: Список значений для обновления.
     """
-    async with aiosqlite.connect(DB_NAME, isolation_level=None) as connection:
+    async with _connect() as connection:
         cursor = await connection.cursor()
         set_clause = ', '.join([f'{col}=?' for col in columns])
         query = f"UPDATE {table} SET {set_clause}"
         try:
-            await cursor.execute(query, values)
-            await connection.commit()
+            await _execute(cursor, query, values)
+            await _commit(connection)
         except aiosqlite.Error as e:
             print(f"Ошибка при обновлении таблицы {table}: {e}")
             raise
@@ -318,6 +1131,11 @@ async def update_clear(table: str, columns: List[str], values: List[Any]) -> Non
             await cursor.close()
 
 
+# Служебная колонка, по которой get_extreme_date_records делит результат на две части
+_EXTREME_PART = '_extreme_part'
+_EXTREME_ROWID = '_extreme_rowid'
+
+
 async def get_extreme_date_records(
     table: str,
     user_id: int,
@@ -325,56 +1143,57 @@ async def get_extreme_date_records(
     limit: Optional[int] = 10,  # Ограничиваем до 10 записей по умолчанию
     **extra_filters: Any,
 ) -> Tuple[List[DatabaseRow], List[DatabaseRow]]:
-    async with aiosqlite.connect(DB_NAME, isolation_level=None) as conn:
-        conn.row_factory = aiosqlite.Row
+    """
+    Самая старая запись и до limit самых новых (без нее) одним запросом.
 
-        # Формируем WHERE
-        base_conditions = ["user_id = ?", "category = ?", "file_link IS NOT NULL"]
-        values = [user_id, category]
-        for k, v in extra_filters.items():
-            base_conditions.append(f"{k} = ?")
-            values.append(v)
-        where_clause = " AND ".join(base_conditions)
-
-        # 1) Выбираем одну самую старую запись
-        cur_before = await conn.cursor()
-        query_before = (
-            f"SELECT * FROM {table} "
-            f"WHERE {where_clause} "
-            f"ORDER BY date ASC "
-            f"LIMIT 1"
-        )
-        await cur_before.execute(query_before, tuple(values))
-        before_records = [DatabaseRow(dict(r)) for r in await cur_before.fetchall()]
-        await cur_before.close()
-
-        # 2) Выбираем до limit самых новых записей, исключая unique_num из before_records
-        cur_after = await conn.cursor()
-        limit_clause = f" LIMIT {limit}" if limit is not None else " LIMIT 10"
-        if before_records:
-            before_ids = [record["unique_num"] for record in before_records]
-            query_after = (
-                f"SELECT * FROM {table} "
-                f"WHERE {where_clause} "
-                f"AND unique_num NOT IN ({', '.join('?' for _ in before_ids)}) "
-                f"ORDER BY date DESC "
-                f"{limit_clause}"
-            )
-            after_values = values + before_ids
-        else:
-            query_after = (
-                f"SELECT * FROM {table} "
-                f"WHERE {where_clause} "
-                f"ORDER BY date DESC "
-                f"{limit_clause}"
-            )
-            after_values = values
+    Обе части - подзапросы с ORDER BY date и LIMIT, объединенные через UNION ALL.
+    С индексом (user_id, category, date) (см. schema.extreme_date_index) каждая
+    часть читает из индекса только нужные строки, без сортировки всей выборки.
+
+    Возвращает:
+        (before_records, after_records) - как и раньше, два списка DatabaseRow.
+    """
+    # Формируем WHERE
+    base_conditions = ["user_id = ?", "category = ?", "file_link IS NOT NULL"]
+    values = [user_id, category]
+    for k, v in extra_filters.items():
+        base_conditions.append(f"{k} = ?")
+        values.append(v)
+    where_clause = " AND ".join(base_conditions)
 
-        await cur_after.execute(query_after, tuple(after_values))
-        after_records = [DatabaseRow(dict(r)) for r in await cur_after.fetchall()]
-        await cur_after.close()
+    # 0 - одна самая старая запись, 1 - самые новые, кроме нее. Порядок UNION ALL без
+    # внешнего ORDER BY не гарантирован, поэтому сортируем явно: по части, затем по дате
+    # (новые первыми, как раньше) и по rowid, чтобы одинаковые даты шли в стабильном порядке
+    query = (
+        f"WITH oldest AS (SELECT rowid AS {_EXTREME_ROWID}, * FROM {table} WHERE {where_clause} "
+        f"ORDER BY date ASC, rowid ASC LIMIT 1) "
+        f"SELECT 0 AS {_EXTREME_PART}, * FROM oldest "
+        f"UNION ALL "
+        f"SELECT 1 AS {_EXTREME_PART}, * FROM ("
+        f"SELECT rowid AS {_EXTREME_ROWID}, * FROM {table} WHERE {where_clause} "
+        f"AND unique_num NOT IN (SELECT unique_num FROM oldest) "
+        f"ORDER BY date DESC, rowid DESC LIMIT ?) "
+        f"ORDER BY {_EXTREME_PART} ASC, date DESC, {_EXTREME_ROWID} DESC"
+    )
+    query_values = tuple(values) + tuple(values) + (limit if limit is not None else 10,)
 
-        return before_records, after_records
+    async with _connect() as conn:
+        conn.row_factory = aiosqlite.Row
+        cursor = await conn.cursor()
+        try:
+            await _execute(cursor, query, query_values)
+            rows = await cursor.fetchall()
+        finally:
+            await cursor.close()
+
+    before_records = []
+    after_records = []
+    for row in rows:
+        record = DatabaseRow(dict(row))
+        part = record.pop(_EXTREME_PART)
+        record.pop(_EXTREME_ROWID)
+        (after_records if part else before_records).append(record)
+    return before_records, after_records
 
 
 async def table_exists(table_name: str) -> bool:
@@ -387,11 +1206,11 @@ async def table_exists(table_name: str) -> bool:
     Returns:
         True если таблица существует, False в противном случае.
     """
-    async with aiosqlite.connect(DB_NAME, isolation_level=None) as connection:
+    async with _connect() as connection:
         cursor = await connection.cursor()
         query = "SELECT name FROM sqlite_master WHERE type='table' AND name=?"
         try:
-            await cursor.execute(query, (table_name,))
+            await _execute(cursor, query, (table_name,))
             result = await cursor.fetchone()
             return result is not None
         except aiosqlite.Error as e:
@@ -411,11 +1230,11 @@ async def get_table_columns(table_name: str) -> List[str]:
     Returns:
         Список имен колонок.
     """
-    async with aiosqlite.connect(DB_NAME, isolation_level=None) as connection:
+    async with _connect() as connection:
         cursor = await connection.cursor()
         query = f"PRAGMA table_info({table_name})"
         try:
-            await cursor.execute(query)
+            await _execute(cursor, query)
             columns_info = await cursor.fetchall()
             return [column[1] for column in columns_info]  # column[1] - это имя колонки
         except aiosqlite.Error as e:
@@ -434,12 +1253,12 @@ async def add_column_to_table(table_name: str, column_name: str, column_type: st
         column_name: Имя новой колонки.
         column_type: Тип данных колонки (по умолчанию TEXT).
     """
-    async with aiosqlite.connect(DB_NAME, isolation_level=None) as connection:
+    async with _connect() as connection:
         cursor = await connection.cursor()
         query = f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}"
         try:
-            await cursor.execute(query)
-            await connection.commit()
+            await _execute(cursor, query)
+            await _commit(connection)
         except aiosqlite.Error as e:
             print(f"Ошибка при добавлении колонки {column_name} в таблицу {table_name}: {e}")
             raise
@@ -468,12 +1287,12 @@ async def create_table_with_columns(table_name: str, columns: List[str],
     
     columns_sql = ", ".join(column_definitions)
     
-    async with aiosqlite.connect(DB_NAME, isolation_level=None) as connection:
+    async with _connect() as connection:
         cursor = await connection.cursor()
         query = f"CREATE TABLE {table_name} ({columns_sql})"
         try:
-            await cursor.execute(query)
-            await connection.commit()
+            await _execute(cursor, query)
+            await _commit(connection)
         except aiosqlite.Error as e:
             print(f"Ошибка при создании таблицы {table_name}: {e}")
             raise
@@ -481,6 +1300,73 @@ async def create_table_with_columns(table_name: str, columns: List[str],
             await cursor.close()
 
 
+def _duplicates_query(table: str, key_columns: List[str], keep_order: str = 'id DESC') -> str:
+    # Первая запись группы в порядке keep_order остается, остальные - дубликаты.
+    # Строки с NULL в ключе не дубликаты: уникальный индекс SQLite допускает несколько NULL
+    not_null = ' AND '.join(f"{column} IS NOT NULL" for column in key_columns)
+    return (f"SELECT id FROM (SELECT id, ROW_NUMBER() OVER "
+            f"(PARTITION BY {', '.join(key_columns)} ORDER BY {keep_order}) AS position "
+            f"FROM {table} WHERE {not_null}) "
+            f"WHERE position > 1")
+
+
+async def remove_duplicates_async(table: str, key_columns: List[str], keep_order: str = 'id DESC') -> int:
+    """
+    Удаляет дубликаты по набору столбцов, оставляя одну запись из каждой группы.
+    Нужно перед созданием уникального индекса на таблице, где дубликаты уже успели появиться.
+
+    Args:
+        table: Имя таблицы.
+        key_columns: Столбцы, по которым определяются дубликаты.
+        keep_order: ORDER BY внутри группы - остается первая запись
+            (по умолчанию самая поздняя, см. schema.DUPLICATE_PRIORITY).
+
+    Returns:
+        Количество удаленных записей.
+    """
+    async with _connect() as connection:
+        cursor = await connection.cursor()
+        query = f"DELETE FROM {table} WHERE id IN ({_duplicates_query(table, key_columns, keep_order)})"
+        try:
+            await _execute(cursor, query)
+            await _commit(connection)
+            return cursor.rowcount
+        except aiosqlite.Error as e:
+            print(f"Ошибка при удалении дубликатов из таблицы {table}: {e}")
+            raise
+        finally:
+            await cursor.close()
+
+
+async def create_index_async(table: str, columns: List[str], unique: bool = False,
+                             index_name: Optional[str] = None) -> None:
+    """
+    Создает индекс на таблице, если его еще нет.
+
+    Args:
+        table: Имя таблицы.
+        columns: Список столбцов индекса (порядок важен).
+        unique: Создать уникальный индекс (нужен для upsert_async / insert_ignore_async).
+        index_name: Имя индекса (по умолчанию формируется из имени таблицы и столбцов).
+    """
+    if index_name is None:
+        prefix = 'ux' if unique else 'ix'
+        index_name = f"{prefix}_{table}_{'_'.join(columns)}"
+
+    async with _connect() as connection:
+        cursor = await connection.cursor()
+        unique_clause = 'UNIQUE ' if unique else ''
+        query = f"CREATE {unique_clause}INDEX IF NOT EXISTS {index_name} ON {table} ({', '.join(columns)})"
+        try:
+            await _execute(cursor, query)
+            await _commit(connection)
+        except aiosqlite.Error as e:
+            print(f"Ошибка при создании индекса {index_name} на таблице {table}: {e}")
+            raise
+        finally:
+            await cursor.close()
+
+
 async def creator(table: str, column_types: Dict[str, str]) -> None:
     """
     Гибкая функция для создания таблиц и колонок с предварительной проверкой существования.
@@ -555,3 +1441,156 @@ async def creator(table: str, column_types: Dict[str, str]) -> None:
         raise
 
 
+
+
+def schema_version(tables: Dict[str, Dict[str, str]], indexes: Iterable[Tuple[str, List[str], bool]] = (),
+                   triggers: Optional[Dict[str, str]] = None) -> int:
+    """
+    Вычисляет версию схемы (положительное 31-битное число) по ее описанию.
+    Любое изменение таблиц, колонок, типов, индексов или триггеров дает новую версию.
+    """
+    description = repr((sorted((table, sorted(columns.items())) for table, columns in tables.items()),
+                        sorted((table, list(columns), bool(unique)) for table, columns, unique in indexes),
+                        sorted((triggers or {}).items())))
+    return zlib.crc32(description.encode('utf-8')) & 0x7FFFFFFF or 1
+
+
+async def reconcile_schema(tables: Dict[str, Dict[str, str]],
+                           indexes: Iterable[Tuple[str, List[str], bool]] = (),
+                           triggers: Optional[Dict[str, str]] = None,
+                           backfills: Optional[Dict[str, str]] = None,
+                           duplicate_priority: Optional[Dict[str, str]] = None) -> bool:
+    """
+    Приводит базу к описанной схеме за одно соединение и одну транзакцию.
+
+    Работает как creator() для всех таблиц сразу (создает таблицы, добавляет недостающие
+    колонки, колонку id добавляет автоматически) и дополнительно создает индексы и триггеры.
+    Триггер с изменившимся текстом пересоздается. Таблицы, созданные при этом запуске,
+    заполняются запросами из backfills (после создания триггеров, в той же транзакции).
+    Перед созданием уникального индекса из таблицы удаляются дубликаты: из каждой группы остается
+    первая запись в порядке duplicate_priority[table] (по умолчанию самая поздняя), id удаленных
+    записей печатаются.
+    Версия схемы хранится в PRAGMA user_version: если она совпадает с описанием,
+    функция ничего не делает, кроме одного чтения pragma.
+
+    Args:
+        tables: {имя таблицы: {колонка: тип}} - как column_types в creator().
+        indexes: Список (таблица, [колонки], уникальный).
+        triggers: {имя триггера: тело CREATE TRIGGER после имени}, см. schema.TRIGGERS.
+        backfills: {таблица: INSERT ... SELECT для ее начального заполнения}, см. schema.daily_rollup.
+        duplicate_priority: {таблица: ORDER BY для выбора оставляемого дубликата}, см. schema.DUPLICATE_PRIORITY.
+
+    Returns:
+        True если схема была изменена, False если она уже актуальна.
+    """
+    indexes = list(indexes)
+    triggers = triggers or {}
+    backfills = backfills or {}
+    duplicate_priority = duplicate_priority or {}
+    version = schema_version(tables, indexes, triggers)
+
+    async with aiosqlite.connect(DB_NAME, isolation_level=None) as connection:
+        cursor = await connection.execute("PRAGMA user_version")
+        current_version = (await cursor.fetchone())[0]
+        await cursor.close()
+        if current_version == version:
+            print(f"Схема базы данных актуальна (версия {version})")
+            return False
+
+        print(f"Обновляем схему базы данных: версия {current_version} -> {version}")
+        await _retry_on_busy(lambda: connection.execute('BEGIN IMMEDIATE'), BUSY_RETRIES, BUSY_RETRY_DELAY)
+        try:
+            # Один снимок sqlite_master вместо отдельного запроса на каждую таблицу
+            cursor = await connection.execute("SELECT type, name, sql FROM sqlite_master "
+                                              "WHERE type IN ('table', 'index', 'trigger')")
+            master_rows = await cursor.fetchall()
+            await cursor.close()
+            snapshot = {(row_type, name) for row_type, name, _ in master_rows}
+            trigger_sql = {name: sql for row_type, name, sql in master_rows if row_type == 'trigger'}
+            created_tables = []
+
+            for table, column_types in tables.items():
+                if "id" not in column_types:
+                    column_types = {"id": "INTEGER PRIMARY KEY", **column_types}
+
+                if ('table', table) not in snapshot:
+                    columns_sql = ", ".join(f"{column} {column_type}" for column, column_type in column_types.items())
+                    await connection.execute(f"CREATE TABLE {table} ({columns_sql})")
+                    print(f"Таблица {table} создана с колонками: {', '.join(column_types)}")
+                    created_tables.append(table)
+                    continue
+
+                cursor = await connection.execute(f"PRAGMA table_info({table})")
+                existing_columns = {column[1] for column in await cursor.fetchall()}
+                await cursor.close()
+
+                for column, column_type in column_types.items():
+                    if column in existing_columns:
+                        continue
+                    if "PRIMARY KEY" in column_type.upper():
+                        print(f"Предупреждение: Нельзя добавить PRIMARY KEY колонку '{column}' к существующей таблице {table}")
+                        continue
+                    await connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+                    print(f"Колонка {column} добавлена в таблицу {table}")
+
+            for table, columns, unique in indexes:
+                index_name = f"{'ux' if unique else 'ix'}_{table}_{'_'.join(columns)}"
+                if ('index', index_name) in snapshot:
+                    continue
+                if unique and ('table', table) in snapshot:
+                    duplicates = _duplicates_query(table, columns, duplicate_priority.get(table, 'id DESC'))
+                    cursor = await connection.execute(duplicates)
+                    duplicate_ids = [row[0] for row in await cursor.fetchall()]
+                    await cursor.close()
+                    if duplicate_ids:
+                        await connection.execute(f"DELETE FROM {table} WHERE id IN ({duplicates})")
+                        print(f"Удалено дубликатов в таблице {table} по ({', '.join(columns)}): "
+                              f"{len(duplicate_ids)}, id: {duplicate_ids}")
+                unique_clause = 'UNIQUE ' if unique else ''
+                await connection.execute(
+                    f"CREATE {unique_clause}INDEX IF NOT EXISTS {index_name} ON {table} ({', '.join(columns)})"
+                )
+                print(f"Индекс {index_name} создан")
+
+            for trigger_name, trigger_body in triggers.items():
+                create_sql = f"CREATE TRIGGER {trigger_name} {trigger_body}"
+                if trigger_sql.get(trigger_name) == create_sql:
+                    continue
+                if trigger_name in trigger_sql:
+                    await connection.execute(f"DROP TRIGGER {trigger_name}")
+                await connection.execute(create_sql)
+                print(f"Триггер {trigger_name} создан")
+
+            for table in created_tables:
+                if table in backfills:
+                    cursor = await connection.execute(backfills[table])
+                    print(f"Таблица {table} заполнена: {cursor.rowcount} строк")
+                    await cursor.close()
+
+            await connection.execute(f"PRAGMA user_version = {version}")
+            await _retry_on_busy(connection.commit, BUSY_RETRIES, BUSY_RETRY_DELAY)
+        except BaseException as e:
+            await connection.rollback()
+            print(f"Ошибка при обновлении схемы базы данных: {e}")
+            raise
+
+    return True
+
+
+async def get_change_counter(name: str) -> int:
+    """
+    Возвращает счетчик изменений из таблицы change_counters (0, если изменений еще не было).
+    Счетчики увеличиваются триггерами (см. schema.change_counter_triggers) при любой записи
+    в отслеживаемую таблицу из любого процесса, поэтому кэши сверяются с ним вместо перечитывания таблиц.
+    """
+    async with _connect() as connection:
+        cursor = await connection.cursor()
+        try:
+            await _execute(cursor, "SELECT counter FROM change_counters WHERE name = ?", (name,))
+            row = await cursor.fetchone()
+            return row[0] if row else 0
+        except aiosqlite.Error as e:
+            print(f"Ошибка при получении счетчика изменений {name}: {e}")
+            raise
+        finally:
+            await cursor.close()
@@ -0,0 +1,75 @@
+import asyncio
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery
+
+
+class KeyedLocks:
+    """
+    asyncio.Lock на каждый ключ (например, пользователь + продукт) без общего замка.
+
+    Замки хранятся по слабым ссылкам: пока замок кто-то держит или ждет, он живет,
+    а когда ссылок не осталось - сам исчезает из реестра. Поэтому память зависит
+    только от числа одновременно выполняемых операций.
+
+    Пример:
+        async with purchase_locks(user_id, product_id):
+            ...
+    """
+
+    def __init__(self):
+        self._locks: 'weakref.WeakValueDictionary[Hashable, asyncio.Lock]' = weakref.WeakValueDictionary()
+
+    def __call__(self, *key: Hashable) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+# Покупка и выдача продукта: одна операция на пару (пользователь, продукт) за раз
+purchase_locks = KeyedLocks()
+
+
+class CallbackDedupMiddleware(BaseMiddleware):
+    """
+    Отбрасывает повторное нажатие той же кнопки тем же пользователем в течение window секунд
+    (двойной тап). На повтор отвечает пустым answer(), чтобы кнопка не "зависала".
+
+    Подключается к роутеру: router.callback_query.middleware(CallbackDedupMiddleware()).
+    Записи старше window удаляются при очередной проверке, не чаще раза в window секунд.
+    """
+
+    def __init__(self, window: float = 2.0):
+        self.window = window
+        self._seen: Dict[Tuple[int, str], float] = {}
+        self._last_sweep = time.monotonic()
+        self.dropped = 0
+
+    async def __call__(self,
+                       handler: Callable[[CallbackQuery, Dict[str, Any]], Awaitable[Any]],
+                       event: CallbackQuery,
+                       data: Dict[str, Any]) -> Any:
+        now = time.monotonic()
+        if now - self._last_sweep > self.window:
+            self._last_sweep = now
+            self._seen = {key: seen_at for key, seen_at in self._seen.items() if now - seen_at < self.window}
+
+        key = (event.from_user.id, event.data)
+        seen_at = self._seen.get(key)
+        if seen_at is not None and now - seen_at < self.window:
+            self.dropped += 1
+            try:
+                await event.answer()
+            except Exception as e:
+                print(f"Ошибка при ответе на повторное нажатие {event.data}: {e}")
+            return None
+
+        self._seen[key] = now
+        return await handler(event, data)
@@ -1,9 +1,21 @@
 import asyncio
 from aiogram import types
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
-from modules.bot.bot import bot
+from modules.bot.context import bot, super_group_id, super_group_ids
 from modules.utils import db
-from modules.configs.config import SUPER_GROUP_ID, USE_SUPER_GROUP, bot_id
+from modules.configs import config
+from modules.configs.config import USE_SUPER_GROUP
+
+# Супергруппа тем, заведенных до шардов (user_topics.super_group_id пустой) - основная
+# супергруппа из конфига, у всех ботов одна (см. supergroups.SupergroupShards)
+LEGACY_SUPER_GROUP_ID = getattr(config, 'SUPER_GROUP_ID', None)
+
+
+def _topic_of_bot(user_topic_info, bot_id, group_ids):
+    """Тема принадлежит боту: создана им или заведена до user_topics в его супергруппе."""
+    if user_topic_info['bot_id'] is not None:
+        return user_topic_info['bot_id'] == bot_id
+    return (user_topic_info['super_group_id'] or LEGACY_SUPER_GROUP_ID) in group_ids
 
 
 async def safe_send_to_topic(bot, group_id, topic_id, text, user_id=None, fallback_to_user=True):
@@ -49,42 +61,81 @@ async def safe_send_to_topic(bot, group_id, topic_id, text, user_id=None, fallba
         return False
 
 
-async def get_user_topic_id(user_id):
+async def find_user_topic(user_id):
     """
-    Получает ID темы пользователя в супергруппе
+    Супергруппа и тема пользователя у бота текущего обновления, без обработки ошибок базы
+    (topic_creator не должен создавать вторую тему, если база недоступна)
     
     Args:
         user_id: ID пользователя
     
     Returns:
-        int: ID темы или None если тема не найдена
+        tuple: (ID супергруппы, ID темы); (None, None) если у бота темы пользователя нет
+    """
+    bot_id = bot.id
+    group_ids = super_group_ids()
+    user_topics = await db.get_all_generic_async(table='user_topics', user_id=user_id)
+    # Своя тема бота важнее темы, заведенной до user_topics
+    for user_topic_info in sorted(user_topics, key=lambda row: row['bot_id'] is None):
+        if user_topic_info['topic_id'] and _topic_of_bot(user_topic_info, bot_id, group_ids):
+            # Темы, заведенные до шардов супергрупп, живут в основной супергруппе
+            return user_topic_info['super_group_id'] or LEGACY_SUPER_GROUP_ID, user_topic_info['topic_id']
+    return None, None
+
+
+async def get_user_topic(user_id):
+    """
+    Получает супергруппу и тему пользователя у бота текущего обновления
+    
+    Args:
+        user_id: ID пользователя
+    
+    Returns:
+        tuple: (ID супергруппы, ID темы); (None, None) если тема не найдена
     """
     if not USE_SUPER_GROUP:
-        return None
+        return None, None
         
     try:
-        user_topic_info = await db.get_one_generic_async(table='users', user_id=user_id)
-        return user_topic_info['topic_id'] if user_topic_info else None
+        return await find_user_topic(user_id)
     except Exception as e:
         print(f"Ошибка получения темы пользователя {user_id}: {e}")
-        return None
+        return None, None
 
 
-async def check_supergroup_access():
+async def get_user_topic_id(user_id):
+    """
+    Получает ID темы пользователя в супергруппе
+    
+    Args:
+        user_id: ID пользователя
+    
+    Returns:
+        int: ID темы или None если тема не найдена
+    """
+    _, topic_id = await get_user_topic(user_id)
+    return topic_id
+
+
+async def check_supergroup_access(group_id=None):
     """
     Проверяет доступность супергруппы
     
+    Args:
+        group_id: ID супергруппы (по умолчанию - основная супергруппа бота)
+    
     Returns:
         bool: True если супергруппа доступна, False иначе
     """
     if not USE_SUPER_GROUP:
         return False
-        
+    
+    group_id = group_id or super_group_id()
     try:
-        chat_info = await bot.get_chat(SUPER_GROUP_ID)
+        chat_info = await bot.get_chat(group_id)
         return chat_info is not None
     except Exception as e:
-        print(f"Супергруппа {SUPER_GROUP_ID} недоступна: {e}")
+        print(f"Супергруппа {group_id} недоступна: {e}")
         return False
 
 
@@ -117,20 +168,20 @@ async def send_message_to_user_topic(user_id, text, parse_mode=None, reply_marku
             print(f"Ошибка отправки сообщения пользователю {user_id}: {e}")
             return False
     
-    # Проверяем доступность супергруппы
-    if not await check_supergroup_access():
-        print(f"Супергруппа недоступна, пропускаем отправку в супергруппу для пользователя {user_id}")
-        return False
-    
-    topic_id = await get_user_topic_id(user_id)
+    group_id, topic_id = await get_user_topic(user_id)
     
     if not topic_id:
         print(f"Тема для пользователя {user_id} не найдена")
         return False
     
+    # Проверяем доступность супергруппы пользователя
+    if not await check_supergroup_access(group_id):
+        print(f"Супергруппа недоступна, пропускаем отправку в супергруппу для пользователя {user_id}")
+        return False
+    
     try:
         await bot.send_message(
-            chat_id=SUPER_GROUP_ID,
+            chat_id=group_id,
             message_thread_id=topic_id,
             text=text,
             parse_mode=parse_mode,
@@ -180,32 +231,32 @@ async def send_media_to_user_topic(user_id, media_type, file_id, caption=None, r
             print(f"Ошибка отправки медиа пользователю {user_id}: {e}")
             return False
     
-    # Проверяем доступность супергруппы
-    if not await check_supergroup_access():
-        print(f"Супергруппа недоступна, пропускаем отправку медиа в супергруппу для пользователя {user_id}")
-        return False
-    
-    topic_id = await get_user_topic_id(user_id)
+    group_id, topic_id = await get_user_topic(user_id)
     
     if not topic_id:
         print(f"Тема для пользователя {user_id} не найдена")
         return False
     
+    # Проверяем доступность супергруппы пользователя
+    if not await check_supergroup_access(group_id):
+        print(f"Супергруппа недоступна, пропускаем отправку медиа в супергруппу для пользователя {user_id}")
+        return False
+    
     try:
         if media_type == 'photo':
-            await bot.send_photo(chat_id=SUPER_GROUP_ID, message_thread_id=topic_id, photo=file_id, caption=caption, reply_markup=reply_markup, caption_entities=entities, parse_mode=None)
+            await bot.send_photo(chat_id=group_id, message_thread_id=topic_id, photo=file_id, caption=caption, reply_markup=reply_markup, caption_entities=entities, parse_mode=None)
         elif media_type == 'video':
-            await bot.send_video(chat_id=SUPER_GROUP_ID, message_thread_id=topic_id, video=file_id, caption=caption, reply_markup=reply_markup, caption_entities=entities, parse_mode=None)
+            await bot.send_video(chat_id=group_id, message_thread_id=topic_id, video=file_id, caption=caption, reply_markup=reply_markup, caption_entities=entities, parse_mode=None)
         elif media_type == 'document':
-            await bot.send_document(chat_id=SUPER_GROUP_ID, message_thread_id=topic_id, document=file_id, caption=caption, reply_markup=reply_markup, caption_entities=entities, parse_mode=None)
+            await bot.send_document(chat_id=group_id, message_thread_id=topic_id, document=file_id, caption=caption, reply_markup=reply_markup, caption_entities=entities, parse_mode=None)
         elif media_type == 'audio':
-            await bot.send_audio(chat_id=SUPER_GROUP_ID, message_thread_id=topic_id, audio=file_id, caption=caption, reply_markup=reply_markup, caption_entities=entities, parse_mode=None)
+            await bot.send_audio(chat_id=group_id, message_thread_id=topic_id, audio=file_id, caption=caption, reply_markup=reply_markup, caption_entities=entities, parse_mode=None)
         elif media_type == 'voice':
-            await bot.send_voice(chat_id=SUPER_GROUP_ID, message_thread_id=topic_id, voice=file_id, caption=caption, reply_markup=reply_markup, caption_entities=entities, parse_mode=None)
+            await bot.send_voice(chat_id=group_id, message_thread_id=topic_id, voice=file_id, caption=caption, reply_markup=reply_markup, caption_entities=entities, parse_mode=None)
         elif media_type == 'video_note':
-            await bot.send_video_note(chat_id=SUPER_GROUP_ID, message_thread_id=topic_id, video_note=file_id, reply_markup=reply_markup, caption_entities=entities, parse_mode=None)
+            await bot.send_video_note(chat_id=group_id, message_thread_id=topic_id, video_note=file_id, reply_markup=reply_markup, caption_entities=entities, parse_mode=None)
         elif media_type == 'sticker':
-            await bot.send_sticker(chat_id=SUPER_GROUP_ID, message_thread_id=topic_id, sticker=file_id, reply_markup=reply_markup, caption_entities=entities, parse_mode=None)
+            await bot.send_sticker(chat_id=group_id, message_thread_id=topic_id, sticker=file_id, reply_markup=reply_markup, caption_entities=entities, parse_mode=None)
         return True
     except Exception as e:
         print(f"Ошибка отправки медиа в тему {topic_id}: {e}")
@@ -233,20 +284,20 @@ async def send_media_group_to_user_topic(user_id, media_list, reply_markup=None)
             print(f"Ошибка отправки медиагруппы пользователю {user_id}: {e}")
             return False
     
-    # Проверяем доступность супергруппы
-    if not await check_supergroup_access():
-        print(f"Супергруппа недоступна, пропускаем отправку медиагруппы в супергруппу для пользователя {user_id}")
-        return False
-    
-    topic_id = await get_user_topic_id(user_id)
+    group_id, topic_id = await get_user_topic(user_id)
     
     if not topic_id:
         print(f"Тема для пользователя {user_id} не найдена")
         return False
     
+    # Проверяем доступность супергруппы пользователя
+    if not await check_supergroup_access(group_id):
+        print(f"Супергруппа недоступна, пропускаем отправку медиагруппы в супергруппу для пользователя {user_id}")
+        return False
+    
     try:
         await bot.send_media_group(
-            chat_id=SUPER_GROUP_ID,
+            chat_id=group_id,
             message_thread_id=topic_id,
             media=media_list,
             reply_markup=reply_markup
@@ -283,20 +334,20 @@ async def forward_message_to_user_topic(user_id, from_chat_id, message_id, reply
             print(f"Ошибка пересылки сообщения пользователю {user_id}: {e}")
             return False
     
-    # Проверяем доступность супергруппы
-    if not await check_supergroup_access():
-        print(f"Супергруппа недоступна, пропускаем пересылку в супергруппу для пользователя {user_id}")
-        return False
-    
-    topic_id = await get_user_topic_id(user_id)
+    group_id, topic_id = await get_user_topic(user_id)
     
     if not topic_id:
         print(f"Тема для пользователя {user_id} не найдена")
         return False
     
+    # Проверяем доступность супергруппы пользователя
+    if not await check_supergroup_access(group_id):
+        print(f"Супергруппа недоступна, пропускаем пересылку в супергруппу для пользователя {user_id}")
+        return False
+    
     try:
         await bot.forward_message(
-            chat_id=SUPER_GROUP_ID,
+            chat_id=group_id,
             from_chat_id=from_chat_id,
             message_id=message_id,
             message_thread_id=topic_id
@@ -307,29 +358,34 @@ async def forward_message_to_user_topic(user_id, from_chat_id, message_id, reply
         return False
 
 
-async def get_user_from_topic_id(topic_id):
+async def get_user_from_topic_id(topic_id, group_id=None):
     """
     Получает ID пользователя по ID темы
     
     Args:
         topic_id: ID темы
+        group_id: ID супергруппы темы (номера тем в разных супергруппах совпадают)
     
     Returns:
         int: ID пользователя или None если пользователь не найден
     """
     try:
-        user_topic_info = await db.get_one_generic_async(table='users', topic_id=topic_id)
-        if user_topic_info:
-            return user_topic_info['user_id']
-        else:
-            print(f"Пользователь для темы {topic_id} не найден в базе данных")
-            return None
+        bot_id = bot.id
+        group_ids = super_group_ids()
+        for user_topic_info in await db.get_all_generic_async(table='user_topics', topic_id=topic_id):
+            # Пустая супергруппа у темы - основная из конфига (заведена до шардов)
+            user_group_id = user_topic_info['super_group_id'] or LEGACY_SUPER_GROUP_ID
+            # Тему другого бота в общей супергруппе обслуживает тот бот, а не этот
+            if (group_id is None or user_group_id == group_id) and _topic_of_bot(user_topic_info, bot_id, group_ids):
+                return user_topic_info['user_id']
+        print(f"Пользователь для темы {topic_id} супергруппы {group_id} не найден в базе данных")
+        return None
     except Exception as e:
         print(f"Ошибка получения пользователя по теме {topic_id}: {e}")
         return None
 
 
-async def send_message_from_topic_to_user(topic_id, text, parse_mode="HTML", reply_markup=None, entities=None):
+async def send_message_from_topic_to_user(topic_id, text, parse_mode="HTML", reply_markup=None, entities=None, group_id=None):
     """
     Отправляет сообщение из темы пользователю (для обработки сообщений от админов в теме)
     
@@ -338,11 +394,12 @@ async def send_message_from_topic_to_user(topic_id, text, parse_mode="HTML", rep
         text: Текст сообщения
         parse_mode: Режим парсинга (HTML, Markdown)
         reply_markup: Клавиатура для сообщения
+        group_id: ID супергруппы темы
     
     Returns:
         bool: True если сообщение отправлено успешно, False иначе
     """
-    user_id = await get_user_from_topic_id(topic_id)
+    user_id = await get_user_from_topic_id(topic_id, group_id)
     
     if not user_id:
         print(f"Пользователь для темы {topic_id} не найден")
@@ -363,7 +420,7 @@ async def send_message_from_topic_to_user(topic_id, text, parse_mode="HTML", rep
         return False
 
 
-async def send_media_from_topic_to_user(topic_id, media_type, file_id, caption=None, reply_markup=None, entities=None):
+async def send_media_from_topic_to_user(topic_id, media_type, file_id, caption=None, reply_markup=None, entities=None, group_id=None):
     """
     Отправляет медиа из темы пользователю (для обработки медиа от админов в теме)
     
@@ -373,11 +430,12 @@ async def send_media_from_topic_to_user(topic_id, media_type, file_id, caption=N
         file_id: ID файла
         caption: Подпись к медиа
         reply_markup: Клавиатура для сообщения
+        group_id: ID супергруппы темы
     
     Returns:
         bool: True если сообщение отправлено успешно, False иначе
     """
-    user_id = await get_user_from_topic_id(topic_id)
+    user_id = await get_user_from_topic_id(topic_id, group_id)
     
     if not user_id:
         print(f"Пользователь для темы {topic_id} не найден")
@@ -544,8 +602,7 @@ async def send_from_topic(user_id, text=None, photo=None, video=None, document=N
     file_id = None
     caption = text
     
-    user_info = await db.get_one_generic_async(table='users', user_id=user_id)
-    topic_id = user_info['topic_id']
+    group_id, topic_id = await get_user_topic(user_id)
     
     if photo:
         media_type = 'photo'
@@ -576,14 +633,16 @@ async def send_from_topic(user_id, text=None, photo=None, video=None, document=N
             media_type=media_type,
             file_id=file_id,
             caption=caption,
-            reply_markup=reply_markup
+            reply_markup=reply_markup,
+            group_id=group_id
         )
     else:
         return await send_message_from_topic_to_user(
             topic_id=topic_id,
             text=text or "",
             parse_mode=parse_mode,
-            reply_markup=reply_markup
+            reply_markup=reply_markup,
+            group_id=group_id
         )
 
 
@@ -639,7 +698,8 @@ async def send(user_id, message, text=None, reply_markup=None, entities=None):
         await send(12345, "Выберите действие:", reply_markup=keyboard)
     """
     
-    if user_id == bot_id:
+    # Сообщения самого бота не пересылаем
+    if user_id == bot.id:
         return
     
     # Если передан объект Message
@@ -658,6 +718,7 @@ async def send(user_id, message, text=None, reply_markup=None, entities=None):
                 # Сообщение из группы -> отправляем пользователю
                 return await send_message_from_topic_to_user(
                     topic_id=message.message_thread_id,
+                    group_id=message.chat.id,
                     text=text,
                     entities=entities,
                     reply_markup=reply_markup
@@ -675,6 +736,7 @@ async def send(user_id, message, text=None, reply_markup=None, entities=None):
             if is_from_group:
                 return await send_media_from_topic_to_user(
                     topic_id=message.message_thread_id,
+                    group_id=message.chat.id,
                     media_type='photo',
                     file_id=file_id,
                     caption=text,
@@ -695,6 +757,7 @@ async def send(user_id, message, text=None, reply_markup=None, entities=None):
             if is_from_group:
                 return await send_media_from_topic_to_user(
                     topic_id=message.message_thread_id,
+                    group_id=message.chat.id,
                     media_type='video',
                     file_id=file_id,
                     caption=text,
@@ -715,6 +778,7 @@ async def send(user_id, message, text=None, reply_markup=None, entities=None):
             if is_from_group:
                 return await send_media_from_topic_to_user(
                     topic_id=message.message_thread_id,
+                    group_id=message.chat.id,
                     media_type='document',
                     file_id=file_id,
                     caption=text,
@@ -735,6 +799,7 @@ async def send(user_id, message, text=None, reply_markup=None, entities=None):
             if is_from_group:
                 return await send_media_from_topic_to_user(
                     topic_id=message.message_thread_id,
+                    group_id=message.chat.id,
                     media_type='audio',
                     file_id=file_id,
                     caption=text,
@@ -755,6 +820,7 @@ async def send(user_id, message, text=None, reply_markup=None, entities=None):
             if is_from_group:
                 return await send_media_from_topic_to_user(
                     topic_id=message.message_thread_id,
+                    group_id=message.chat.id,
                     media_type='voice',
                     file_id=file_id,
                     caption=text,
@@ -773,6 +839,7 @@ async def send(user_id, message, text=None, reply_markup=None, entities=None):
             if is_from_group:
                 return await send_media_from_topic_to_user(
                     topic_id=message.message_thread_id,
+                    group_id=message.chat.id,
                     media_type='video_note',
                     file_id=file_id,
                     entities=entities,
@@ -791,6 +858,7 @@ async def send(user_id, message, text=None, reply_markup=None, entities=None):
             if is_from_group:
                 return await send_media_from_topic_to_user(
                     topic_id=message.message_thread_id,
+                    group_id=message.chat.id,
                     media_type='sticker',
                     file_id=file_id,
                     entities=entities,
@@ -809,6 +877,7 @@ async def send(user_id, message, text=None, reply_markup=None, entities=None):
             if is_from_group:
                 return await send_message_from_topic_to_user(
                     topic_id=message.message_thread_id,
+                    group_id=message.chat.id,
                     text=text or "Неподдерживаемый тип сообщения",
                     entities=entities,
                     reply_markup=reply_markup
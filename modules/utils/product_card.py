@@ -0,0 +1,64 @@
+from typing import Tuple
+from aiogram.types import InlineKeyboardMarkup
+from modules.utils.bot_fn import compile_keyboard
+from modules.utils.callback_codec import PAY, DOWNLOAD
+
+DOWNLOAD_KEYBOARD = compile_keyboard(line_1=[("Скачать", '{data}')], width_1=1)
+PAY_KEYBOARD = compile_keyboard(line_1=[("Оплатить и скачать", '{data}')], width_1=1)
+
+
+def end_price(product_data) -> int:
+    """Итоговая цена продукта с учетом скидки (в процентах), в рублях. Цена должна быть задана."""
+    price = product_data['price']
+    discount = product_data.get('discount') or 0
+    return int(price - (price / 100 * discount))
+
+
+def is_free(product_data) -> bool:
+    """Продукт бесплатный, только если так отмечен в базе (нулевая цена или скидка 100% не в счет)."""
+    return bool(product_data.get('is_free'))
+
+
+class ProductCard:
+    """
+    Готовая карточка продукта для /start: текст и клавиатура для двух состояний
+    (куплен / не куплен), итоговая цена и путь к медиа.
+
+    Собирается один раз при загрузке каталога (render_card) и переиспользуется
+    для всех пользователей, пока продукт не изменится.
+    """
+
+    __slots__ = ('product_id', 'title', 'end_price', 'is_free', 'media_type', 'media_path',
+                 'purchased_text', 'purchased_markup', 'not_purchased_text', 'not_purchased_markup')
+
+    def view(self, purchased: bool) -> Tuple[str, InlineKeyboardMarkup]:
+        """Текст и клавиатура для пользователя: бесплатный или купленный продукт можно сразу скачать."""
+        if purchased or self.is_free:
+            return self.purchased_text, self.purchased_markup
+        return self.not_purchased_text, self.not_purchased_markup
+
+
+def render_card(product_data) -> ProductCard:
+    card = ProductCard()
+    card.product_id = product_data['id']
+    card.title = product_data['title']
+    card.end_price = end_price(product_data)
+    card.is_free = is_free(product_data)
+
+    unique_product_id = product_data['unique_product_id']
+    if product_data['image']:
+        card.media_type, card.media_path = 'photo', f"products/{unique_product_id}/media/photos/image.jpg"
+    elif product_data['video']:
+        card.media_type, card.media_path = 'video', f"products/{unique_product_id}/media/video.mp4"
+    else:
+        card.media_type, card.media_path = None, None
+
+    text = f"<b>{card.title}</b>"
+    if product_data['description']:
+        text += f"\n\n<i>{product_data['description']}</i>"
+
+    card.purchased_text = text
+    card.purchased_markup = DOWNLOAD_KEYBOARD.render(data=DOWNLOAD.pack(product_id=card.product_id))
+    card.not_purchased_text = text + f"\n\n<b>Стоимость:</b> <i>{card.end_price} руб.</i>"
+    card.not_purchased_markup = PAY_KEYBOARD.render(data=PAY.pack(product_id=card.product_id))
+    return card
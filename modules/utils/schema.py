@@ -0,0 +1,154 @@
+from types import SimpleNamespace
+
+# Описание схемы базы данных, общее для бота и админки.
+# Применяется через db.reconcile_schema(TABLES, INDEXES, TRIGGERS, BACKFILLS, duplicate_priority=DUPLICATE_PRIORITY):
+# при любом изменении здесь версия схемы меняется и при следующем запуске база обновляется.
+# Колонка id (INTEGER PRIMARY KEY) добавляется в каждую таблицу автоматически.
+
+TABLES = {
+    # topic_id, super_group_id - тема пользователя до появления user_topics (перенесена туда
+    # при создании таблицы, бот их больше не читает и не пишет)
+    'users': {'user_id': 'INTEGER', 'topic_id': 'INTEGER', 'username': 'TEXT',
+              'first_name': 'TEXT', 'last_name': 'TEXT', 'source': 'TEXT',
+              'is_admin': 'INTEGER', 'is_moderator': 'INTEGER', 'banned': 'INTEGER',
+              'tariff': 'TEXT', 'bot_username': 'TEXT', 'bot_id': 'INTEGER',
+              'super_group_id': 'INTEGER'},
+    # Тема пользователя в супергруппе поддержки - своя у каждого бота, которого он запустил.
+    # super_group_id пустой - основная SUPER_GROUP_ID; bot_id пустой - тема, заведенная
+    # до user_topics, ее использует любой бот, обслуживающий эту супергруппу
+    'user_topics': {'user_id': 'INTEGER', 'bot_id': 'INTEGER', 'super_group_id': 'INTEGER', 'topic_id': 'INTEGER'},
+    'purchased': {'user_id': 'INTEGER', 'product_id': 'INTEGER', 'step': 'TEXT', 'paid': 'INTEGER'},
+    'products': {'title': 'TEXT', 'description': 'TEXT', 'image': 'TEXT', 'video': 'TEXT', 'is_free': 'INTEGER',
+                 'price': 'INTEGER', 'discount': 'INTEGER', 'file_type': 'TEXT', 'product_bot': 'TEXT',
+                 'path': 'TEXT', 'link': 'TEXT', 'telegram_file_id': 'TEXT', 'telegram_video_id': 'TEXT',
+                 'telegram_image_id': 'TEXT', 'unique_product_id': 'TEXT', 'file_title': 'TEXT',
+                 'paid_caption': 'TEXT'},
+    # super_group_id - своя супергруппа поддержки бота (пусто - SUPER_GROUP_ID из конфига)
+    'bots': {'title': 'TEXT', 'bot_id': 'INTEGER', 'bot_token': 'TEXT', 'bot_username': 'TEXT',
+             'super_group_id': 'INTEGER'},
+    # Счетчики изменений таблиц для инвалидации кэшей (увеличиваются триггерами)
+    'change_counters': {'name': 'TEXT', 'counter': 'INTEGER'},
+    # Служебные значения бота между перезапусками (например, последний обработанный update_id)
+    'bot_state': {'name': 'TEXT', 'value': 'INTEGER'},
+}
+
+# (таблица, [колонки], уникальный)
+INDEXES = [
+    # Уникальные ключи для upsert_async / insert_ignore_async
+    ('users', ['user_id'], True),
+    ('user_topics', ['user_id', 'bot_id'], True),
+    ('purchased', ['user_id', 'product_id'], True),
+    ('change_counters', ['name'], True),
+    ('bot_state', ['name'], True),
+    # Поиск пользователя по теме, в которую написал администратор (messages_provider)
+    ('user_topics', ['topic_id', 'super_group_id'], False),
+]
+
+# Какую запись оставить, если перед созданием уникального индекса в таблице нашлись дубликаты
+# (ORDER BY внутри группы, остается первая). Для остальных таблиц - самая поздняя запись
+DUPLICATE_PRIORITY = {
+    # Оплаченная покупка важнее неоплаченной
+    'purchased': 'COALESCE(paid, 0) DESC, id DESC',
+    # Пользователь с темой в супергруппе важнее записи без темы
+    'users': 'topic_id IS NULL, id DESC',
+}
+
+# {таблица: INSERT ... SELECT} - начальное заполнение таблицы при ее создании
+BACKFILLS = {
+    # Темы, созданные до user_topics, - без бота: их использует любой бот этой супергруппы
+    'user_topics': ("INSERT INTO user_topics (user_id, bot_id, super_group_id, topic_id) "
+                    "SELECT user_id, NULL, super_group_id, topic_id FROM users "
+                    "WHERE user_id IS NOT NULL AND topic_id IS NOT NULL"),
+}
+
+
+def extreme_date_index(table):
+    """
+    Индекс под db.get_extreme_date_records: (user_id, category, date).
+    Добавляется в INDEXES для каждой таблицы, из которой читаются крайние записи по дате.
+    """
+    return (table, ['user_id', 'category', 'date'], False)
+
+
+def date_index(table, columns=('user_id',)):
+    """
+    Индекс под выборки по диапазону дат (db.get_records_from_to_date): сначала
+    колонки с фильтром на равенство, затем date - диапазон и ORDER BY date читаются из индекса.
+    """
+    return (table, [*columns, 'date'], False)
+
+
+def daily_rollup(table, user_column='user_id', date_column='date'):
+    """
+    Таблица {table}_daily с количеством событий на пользователя за день
+    ({user_column}, day, events), которую поддерживают триггеры на table.
+
+    Диапазоны и серии дней читаются из нее (db.get_daily_counts, db.get_user_days, db.get_day_numbers) -
+    одна строка на день вместо всех событий. День берется как date({date_column}).
+    При создании таблица заполняется из уже накопленных событий (backfills).
+
+    Пример подключения:
+        RECORDS_DAILY = daily_rollup('records')
+        TABLES.update(RECORDS_DAILY.tables)
+        INDEXES.extend(RECORDS_DAILY.indexes)
+        TRIGGERS.update(RECORDS_DAILY.triggers)
+        await db.reconcile_schema(TABLES, INDEXES, TRIGGERS, RECORDS_DAILY.backfills)
+    """
+    rollup = f'{table}_daily'
+    day = f'date({{row}}.{date_column})'
+
+    def increment(row):
+        return (f"INSERT INTO {rollup} ({user_column}, day, events) "
+                f"SELECT {row}.{user_column}, {day.format(row=row)}, 1 "
+                f"WHERE {row}.{user_column} IS NOT NULL AND {row}.{date_column} IS NOT NULL "
+                f"ON CONFLICT({user_column}, day) DO UPDATE SET events = events + 1; ")
+
+    def decrement(row):
+        where = f"{user_column} = {row}.{user_column} AND day = {day.format(row=row)}"
+        return (f"UPDATE {rollup} SET events = events - 1 WHERE {where}; "
+                f"DELETE FROM {rollup} WHERE {where} AND events <= 0; ")
+
+    return SimpleNamespace(
+        tables={rollup: {user_column: 'INTEGER', 'day': 'TEXT', 'events': 'INTEGER'}},
+        indexes=[(rollup, [user_column, 'day'], True)],
+        triggers={
+            f'trg_{rollup}_insert': f"AFTER INSERT ON {table} BEGIN {increment('NEW')}END",
+            f'trg_{rollup}_delete': f"AFTER DELETE ON {table} BEGIN {decrement('OLD')}END",
+            f'trg_{rollup}_update': (f"AFTER UPDATE OF {user_column}, {date_column} ON {table} "
+                                     f"BEGIN {decrement('OLD')}{increment('NEW')}END"),
+        },
+        backfills={rollup: (f"INSERT INTO {rollup} ({user_column}, day, events) "
+                            f"SELECT {user_column}, date({date_column}), COUNT(*) FROM {table} "
+                            f"WHERE {user_column} IS NOT NULL AND {date_column} IS NOT NULL "
+                            f"GROUP BY {user_column}, date({date_column})")},
+    )
+
+
+def change_counter_triggers(table, name=None, events=('INSERT', 'UPDATE', 'DELETE')):
+    """
+    Триггеры, увеличивающие change_counters[name] при каждой записи в table.
+    Событие можно сузить, например 'UPDATE OF banned, is_admin'.
+    """
+    name = name or table
+    triggers = {}
+    for event in events:
+        suffix = event.split()[0].lower()
+        triggers[f'trg_{name}_changed_{suffix}'] = (
+            f"AFTER {event} ON {table} BEGIN "
+            f"INSERT INTO change_counters (name, counter) VALUES ('{name}', 1) "
+            f"ON CONFLICT(name) DO UPDATE SET counter = counter + 1; END"
+        )
+    return triggers
+
+
+# {имя триггера: определение после CREATE TRIGGER <имя>}
+TRIGGERS = {
+    # Каталог продуктов в боте перечитывается, когда админка меняет products
+    **change_counter_triggers('products'),
+    # Кэш флагов пользователей (бан и роли) перечитывается, когда админка их меняет.
+    # Новые пользователи добавляются без флагов, поэтому INSERT не отслеживается
+    **change_counter_triggers('users', name='user_state',
+                              events=('UPDATE OF banned, is_admin, is_moderator', 'DELETE')),
+    # Мультибот запускает и останавливает ботов, когда админка меняет таблицу bots
+    **change_counter_triggers('bots'),
+}
@@ -0,0 +1,68 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+from modules.configs import config
+from modules.utils import db
+
+# Как часто (в секундах) перечитывать из базы, сколько пользователей в каждой супергруппе.
+# Между перечитываниями счетчики ведутся в памяти; перечитывание выравнивает их
+# с тем, что назначили другие процессы (воркеры мультибота)
+SUPER_GROUP_COUNTS_TTL = getattr(config, 'SUPER_GROUP_COUNTS_TTL', 300)
+
+
+class SupergroupShards:
+    """
+    Распределение тем пользователей по нескольким супергруппам (шардам).
+
+    У каждой супергруппы свой лимит на отправку сообщений, а форум с сотнями тысяч
+    тем неудобен, поэтому тема нового пользователя создается в самой незагруженной
+    супергруппе из списка бота (bot_settings.super_group_ids), а выбранная группа
+    запоминается в user_topics.super_group_id. Темы, заведенные до шардов
+    (super_group_id пустой), живут в основной супергруппе (SUPER_GROUP_ID).
+
+    Пример:
+        group_id = await supergroup_shards.choose(super_group_ids())
+        if not created:
+            supergroup_shards.release(group_id)
+    """
+
+    def __init__(self, counts_ttl: float = SUPER_GROUP_COUNTS_TTL):
+        self.counts_ttl = counts_ttl
+        self.counts: Dict[int, int] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    async def _load_counts(self) -> None:
+        # Темы всех ботов: супергруппа общая, если ее используют несколько ботов
+        counts = await db.count_by_async('user_topics', 'super_group_id')
+        # Темы, заведенные до шардов (super_group_id пустой), - в основной супергруппе
+        legacy = counts.pop(None, 0)
+        primary = getattr(config, 'SUPER_GROUP_ID', None)
+        if primary is not None:
+            counts[primary] = counts.get(primary, 0) + legacy
+        self.counts = counts
+        self._loaded_at = time.monotonic()
+
+    async def choose(self, group_ids: List[int]) -> int:
+        """
+        Самая незагруженная супергруппа из group_ids; сразу учитывает в ней нового пользователя,
+        чтобы одновременные выборы не попали в одну группу. Если тема так и не создана -
+        release(group_id).
+        """
+        if len(group_ids) == 1:
+            group_id = group_ids[0]
+        else:
+            async with self._lock:
+                if self._loaded_at is None or time.monotonic() - self._loaded_at > self.counts_ttl:
+                    await self._load_counts()
+                group_id = min(group_ids, key=lambda group: self.counts.get(group, 0))
+        self.counts[group_id] = self.counts.get(group_id, 0) + 1
+        return group_id
+
+    def release(self, group_id: int) -> None:
+        """Отменяет choose(): тема в выбранной супергруппе не создана."""
+        if self.counts.get(group_id):
+            self.counts[group_id] -= 1
+
+
+supergroup_shards = SupergroupShards()
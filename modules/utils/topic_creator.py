@@ -1,25 +1,34 @@
-from modules.bot.bot import bot
+from modules.bot.context import bot, super_group_ids
 from modules.utils import db
-from modules.configs.config import SUPER_GROUP_ID, USE_SUPER_GROUP
-from modules.utils.messages_provider import check_supergroup_access
+from modules.utils.supergroups import supergroup_shards
+from modules.configs.config import USE_SUPER_GROUP
+from modules.utils.messages_provider import check_supergroup_access, find_user_topic
 
 
 async def create_topic(user_id):
     
     if USE_SUPER_GROUP:
         
-        # Проверяем доступность супергруппы
-        if not await check_supergroup_access():
-            print(f"Супергруппа недоступна, пропускаем создание темы для пользователя {user_id}")
-            return
+        # Супергруппа, выбранная для нового пользователя, пока тема в ней не создана
+        chosen_group_id = None
         
         try:
             
             user_data = await db.get_one_generic_async(table='users', user_id=user_id)
-            topic_id = user_data['topic_id']
+            # Темы у каждого бота свои: пользователь, уже известный другому боту, получает
+            # тему и в супергруппе этого бота
+            _, topic_id = await find_user_topic(user_id)
             
             if not topic_id:
                 
+                # Новая тема - в самой незагруженной супергруппе бота
+                group_id = chosen_group_id = await supergroup_shards.choose(super_group_ids())
+                
+                # Проверяем доступность супергруппы
+                if not await check_supergroup_access(group_id):
+                    print(f"Супергруппа {group_id} недоступна, пропускаем создание темы для пользователя {user_id}")
+                    return
+                
                 full_name = (
                     user_data['first_name'] or
                     user_data['username'] or
@@ -30,16 +39,24 @@ async def create_topic(user_id):
                 
                 # Создаём новую тему
                 created_topic = await bot.create_forum_topic(
-                    chat_id=SUPER_GROUP_ID,
+                    chat_id=group_id,
                     name=topic_name
                 )
                 
                 topic_id = created_topic.message_thread_id
+                chosen_group_id = None
                 
-                await db.update_generic_async(columns=['topic_id'], values=[topic_id], table='users', user_id=user_id)
-                print(f"Создана тема {topic_id} для пользователя {user_id}")
+                await db.upsert_async(table='user_topics', key_columns=['user_id', 'bot_id'],
+                                      columns=['user_id', 'bot_id', 'super_group_id', 'topic_id'],
+                                      values=[user_id, bot.id, group_id, topic_id])
+                print(f"Создана тема {topic_id} в супергруппе {group_id} для пользователя {user_id}")
         
         except Exception as e:
             print(f"Ошибка при создании темы для пользователя {user_id}: {e}")
         
+        finally:
+            # Тема не создана - пользователь не должен учитываться в нагрузке супергруппы
+            if chosen_group_id is not None:
+                supergroup_shards.release(chosen_group_id)
+        
     
\ No newline at end of file
@@ -0,0 +1,49 @@
+from typing import Dict, NamedTuple
+from modules.utils import db
+from modules.utils.watched_cache import WatchedCache
+
+
+class UserState(NamedTuple):
+    banned: bool = False
+    is_admin: bool = False
+    is_moderator: bool = False
+
+
+# Состояние обычного пользователя: такие в кэше не хранятся
+DEFAULT_STATE = UserState()
+
+
+class UserStateCache(WatchedCache):
+    """
+    Флаги banned / is_admin / is_moderator из таблицы users в памяти бота.
+
+    Хранятся только пользователи, у которых установлен хотя бы один флаг, поэтому
+    кэш маленький и перечитывается целиком. Админка меняет флаги - триггеры
+    увеличивают счетчик 'user_state' (см. schema.TRIGGERS), и кэш перезагружается.
+
+    Пример:
+        state = await user_states.get(user_id)
+        if state.banned: ...
+    """
+
+    counter_name = 'user_state'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.states: Dict[int, UserState] = {}
+
+    async def _reload(self) -> None:
+        flagged = {}
+        for flag in UserState._fields:
+            for user in await db.get_all_generic_async('users', **{flag: 1}):
+                flagged.setdefault(user['user_id'], user)
+        self.states = {user_id: UserState(bool(user['banned']), bool(user['is_admin']), bool(user['is_moderator']))
+                       for user_id, user in flagged.items()}
+        print(f"Состояния пользователей загружены: {len(self.states)} с флагами")
+
+    async def get(self, user_id: int) -> UserState:
+        await self.ensure_loaded()
+        return self.states.get(user_id, DEFAULT_STATE)
+
+
+user_states = UserStateCache()
@@ -0,0 +1,73 @@
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Optional
+from modules.configs import config
+from modules.utils import db
+
+# Как часто (в секундах) кэши сверяют счетчик изменений в базе
+CACHE_POLL_INTERVAL = getattr(config, 'CACHE_POLL_INTERVAL', 2.0)
+
+
+class WatchedCache(ABC):
+    """
+    Базовый класс для кэшей таблиц, которые меняет другой процесс (например, админка).
+
+    Кэш целиком загружается при start(), а затем раз в poll_interval секунд читает
+    одно число из change_counters. Если счетчик изменился (его увеличивают триггеры
+    на отслеживаемой таблице), кэш перезагружается. Между проверками чтения из кэша
+    вообще не обращаются к SQLite.
+
+    Наследник задает counter_name и реализует _reload().
+    """
+
+    counter_name: str = ''
+
+    def __init__(self, poll_interval: float = CACHE_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.loaded = False
+        self._version: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._reload_lock = asyncio.Lock()
+
+    @abstractmethod
+    async def _reload(self) -> None:
+        """Полностью перечитывает данные кэша из базы."""
+
+    async def refresh(self, force: bool = False) -> bool:
+        """Перезагружает кэш, если счетчик изменений сдвинулся. Возвращает True, если была перезагрузка."""
+        async with self._reload_lock:
+            # Счетчик читаем до загрузки: изменение во время загрузки заметим на следующей проверке
+            version = await db.get_change_counter(self.counter_name)
+            if not force and self.loaded and version == self._version:
+                return False
+            await self._reload()
+            self._version = version
+            self.loaded = True
+            return True
+
+    async def ensure_loaded(self) -> None:
+        if not self.loaded:
+            await self.refresh()
+
+    async def start(self) -> None:
+        """Загружает кэш и запускает фоновую проверку изменений."""
+        await self.refresh(force=True)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._poll())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _poll(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Ошибка при обновлении кэша {self.counter_name}: {e}")